@@ -1,9 +1,8 @@
 # Adapted from https://mblogscode.com/2016/06/03/python-naughts-crossestic-tac-toe-coding-unbeatable-ai/
 
 import gym
-import matplotlib.pyplot as plt
 import numpy as np
-from stable_baselines import logger
+from SIMPLE.utils import log as logger
 
 
 class Player():
@@ -142,6 +141,7 @@ class TicTacToeEnv(gym.Env):
 
     def _make_axis(self, ax=None):
         if ax is None:
+            import matplotlib.pyplot as plt
             self.fig, self.ax = plt.subplots(1, 1)
         else:
             self.ax = ax
@@ -196,6 +196,7 @@ class TicTacToeEnv(gym.Env):
 
             print(board.reshape((3, 3)))
         elif self.render_mode == "plot":
+            import matplotlib.pyplot as plt
             if self.ax is None:
                 self._make_axis()
 
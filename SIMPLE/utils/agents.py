@@ -7,7 +7,7 @@ np.set_printoptions(threshold=sys.maxsize)
 import random
 import string
 
-from stable_baselines import logger
+from SIMPLE.utils import log as logger
 
 
 def sample_action(action_probs):
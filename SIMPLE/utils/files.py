@@ -5,9 +5,7 @@ import time
 from shutil import rmtree
 
 import numpy as np
-from mpi4py import MPI
-from stable_baselines import logger
-from stable_baselines.ppo1 import PPO1
+from SIMPLE.utils import log as logger
 
 import SIMPLE.config
 from SIMPLE.utils.register import get_network_arch
@@ -33,6 +31,9 @@ def write_results(players, game, games, episode_length):
         writer.writerow(out)
 
 def load_model(env, name):
+    from mpi4py import MPI
+    from stable_baselines.ppo1 import PPO1
+
     filename = os.path.join(SIMPLE.config.MODELDIR, env.name, name)
     if os.path.exists(filename):
         logger.info(f'Loading {name}')
@@ -77,11 +78,13 @@ def load_model(env, name):
 def load_all_models(env, load=True):
     modellist = [f for f in os.listdir(os.path.join(SIMPLE.config.MODELDIR, env.name)) if f.startswith("_model")]
     modellist.sort()
-    models = [load_model(env, 'base.zip')]
     if load:
+        models = [load_model(env, 'base.zip')]
         for model_name in modellist:
             models.append(load_model(env, name = model_name))
     else:
+        # Only the names, loaded (and stable_baselines imported) when an opponent first needs them
+        models = ['base.zip']
         for model_name in modellist:
             models.append(model_name)
     return models
@@ -0,0 +1,37 @@
+"""Drop-in for `stable_baselines.logger` that doesn't import stable_baselines (and so TensorFlow) just to log
+
+Once something else has imported stable_baselines, e.g. to load a model or in train.py, messages go to its logger
+so its level and output formats apply. Until then they are printed, at the stable_baselines default level of INFO
+"""
+
+import sys
+
+import SIMPLE.config
+
+
+def _stable_baselines_logger():
+    return sys.modules.get("stable_baselines.logger")
+
+
+def _log(level, *args):
+    logger = _stable_baselines_logger()
+    if logger is not None:
+        logger.log(*args, level=level)
+    elif level >= SIMPLE.config.INFO:
+        print(*args)
+
+
+def debug(*args):
+    _log(SIMPLE.config.DEBUG, *args)
+
+
+def info(*args):
+    _log(SIMPLE.config.INFO, *args)
+
+
+def warn(*args):
+    _log(SIMPLE.config.WARN, *args)
+
+
+def error(*args):
+    _log(SIMPLE.config.ERROR, *args)
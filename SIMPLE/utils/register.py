@@ -1,12 +1,12 @@
 import multiprocessing
 
-from stable_baselines.common import make_vec_env
 from tictactoe.envs import TicTacToeEnv
 
 
 def get_environment(env_name):
     try:
         if env_name in ('tictactoe'):
+            # from stable_baselines.common import make_vec_env
             # return make_vec_env(TicTacToeEnv, n_envs=multiprocessing.cpu_count())
             return TicTacToeEnv
         elif env_name in ('connect4'):
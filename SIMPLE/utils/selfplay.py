@@ -2,7 +2,7 @@ import numpy as np
 import random
 
 import numpy as np
-from stable_baselines import logger
+from SIMPLE.utils import log as logger
 
 from SIMPLE.utils.agents import Agent
 from SIMPLE.utils.files import load_model, load_all_models, get_best_model_name
@@ -60,6 +60,8 @@ def selfplay_wrapper(env):
                         self.opponent_agent = Agent('ppo_opponent', self.opponent_models[i])
 
                 elif self.opponent_type == 'base':
+                    if type(self.opponent_models[0]) is str:
+                        self.opponent_models[0] = load_model(env, name=self.opponent_models[0])
                     self.opponent_agent = Agent('base', self.opponent_models[0])
 
             #
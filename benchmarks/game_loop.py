@@ -0,0 +1,103 @@
+import contextlib
+import io
+import sys
+import warnings
+from time import perf_counter, process_time
+
+import numpy as np
+
+from hardware.simulated import SimulatedBackend
+from stm_control import STMTicTacToe
+
+PROFILES = {
+    "ideal": {},
+    "lan": {"rpc_latency": 5e-3},
+    "slow_rpc": {"rpc_latency": 50e-3},
+    "slow_tip": {"t_raster": 40e-3},
+    "fast_tip": {"t_raster": 5e-3},
+    "slow_scan": {"raster_time": 4e-4},
+    "low_res": {"resolution": 256},
+    "high_res": {"resolution": 1024},
+}
+_DEFAULTS = {"rpc_latency": 0.0, "t_raster": 20e-3, "raster_time": 1e-4, "resolution": 512}
+
+
+def run_profile(profile="ideal", n_games=3, seed=0, time_scale=0.0, **game_kwargs):
+    """Plays games of rules against rules on a SimulatedBackend under one latency profile
+
+    Parameters
+    ----------
+    profile: str or dict
+        Name of one of PROFILES, or a dict overriding any of 'rpc_latency' (Seconds per call), 't_raster' (tip
+        speed, Seconds per point moved), 'raster_time' (scan time per point, Seconds) and 'resolution' (scan points)
+    n_games: int
+        Number of games to play. Default 3
+    seed: int
+        Seed of the simulated surface. Default 0
+    time_scale: float
+        Fraction of instrument time actually slept (see SimulatedBackend). Default 0, so the instrument's time only
+        passes on its simulated clock
+    **game_kwargs
+        Passed to STMTicTacToe, e.g. pipelined=False
+
+    Returns
+    -------
+    results: dict
+        'turn_latency' percentiles {50, 90, 99} of the simulated instrument time from the end of one turn to the end
+        of the next, the first counting from the start of the game so including the reset, and the last ending once
+        the game is finished (Seconds). 'host_latency', the same percentiles of the real time. 'instrument_seconds'
+        of simulated instrument time per game, 'games_per_hour' taking each game as long as the longer of its real
+        and instrument time, and 'cpu_utilisation', the CPU time of every thread as a fraction of one core over
+        that length of the games
+    """
+    settings = {**_DEFAULTS, **(PROFILES[profile] if isinstance(profile, str) else profile)}
+
+    turn_latencies = []
+    host_latencies = []
+    instrument_seconds = []
+    game_seconds = []
+    cpu_start = process_time()
+    for i in range(n_games):
+        backend = SimulatedBackend(resolution=settings["resolution"], raster_time=settings["raster_time"],
+                                   rpc_latency=settings["rpc_latency"], time_scale=time_scale, seed=seed + i)
+        game = STMTicTacToe(-2.25, 250e-12, 4.2, 1.5e-9, settings["t_raster"], 512,
+                            player_1_type="rules", player_2_type="rules", render_mode=None, backend=backend,
+                            **game_kwargs)
+
+        # As play_game, noting the end of each turn on the simulated clock and in real time
+        clocks, times = [backend.clock], [perf_counter()]
+        with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            game.reset()
+            while not game.game.is_episode_done:
+                game.step()
+                clocks.append(backend.clock)
+                times.append(perf_counter())
+            game.finish_game()
+        clocks[-1], times[-1] = backend.clock, perf_counter()
+
+        turn_latencies.extend(np.diff(clocks))
+        host_latencies.extend(np.diff(times))
+        instrument_seconds.append(clocks[-1] - clocks[0])
+        game_seconds.append(max(times[-1] - times[0], clocks[-1] - clocks[0]))
+        game.pipeline.shutdown()
+
+    cpu_utilisation = (process_time() - cpu_start) / sum(game_seconds)
+    return {"turn_latency": {p: float(np.percentile(turn_latencies, p)) for p in (50, 90, 99)},
+            "host_latency": {p: float(np.percentile(host_latencies, p)) for p in (50, 90, 99)},
+            "instrument_seconds": float(np.mean(instrument_seconds)),
+            "games_per_hour": 3600 / float(np.mean(game_seconds)),
+            "cpu_utilisation": cpu_utilisation}
+
+
+if __name__ == '__main__':
+    # Run from the repository root, e.g. `python -m benchmarks.game_loop slow_rpc low_res`
+    names = sys.argv[1:] or list(PROFILES)
+    print(f"{'profile':<10} {'p50 (s)':>8} {'p90 (s)':>8} {'p99 (s)':>8} {'host p50 (ms)':>14} {'instrument (s)':>15} "
+          f"{'games/hour':>11} {'CPU':>6}")
+    for name in names:
+        results = run_profile(name)
+        latency = results["turn_latency"]
+        print(f"{name:<10} {latency[50]:>8.1f} {latency[90]:>8.1f} {latency[99]:>8.1f} "
+              f"{results['host_latency'][50] * 1e3:>14.1f} {results['instrument_seconds']:>15.1f} "
+              f"{results['games_per_hour']:>11.1f} {results['cpu_utilisation']:>6.1%}")
@@ -0,0 +1,60 @@
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("matplotlib", "matplotlib.pyplot", "tensorflow", "stable_baselines", "PIL.Image")
+
+# Run in a fresh interpreter each time, so nothing is already imported
+_IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def time_import(module="stm_control", repeats=5):
+    """Times importing `module` in fresh interpreters
+
+    Parameters
+    ----------
+    module: str
+        Module to import. Default 'stm_control'
+    repeats: int
+        Number of fresh interpreters to time the import in. Default 5
+
+    Returns
+    -------
+    seconds: np.ndarray
+        Import time of each repeat (Seconds)
+    loaded: list of str
+        Which of HEAVY_MODULES the import pulled in
+    """
+    seconds = []
+    loaded = []
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, "-c", _IMPORT_SCRIPT.format(module=module, heavy=HEAVY_MODULES)],
+                                cwd=REPO_ROOT, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+        out = json.loads(result.stdout.strip().splitlines()[-1])
+        seconds.append(out["seconds"])
+        loaded = out["loaded"]
+    return np.array(seconds), loaded
+
+
+if __name__ == '__main__':
+    modules = sys.argv[1:] or ["stm_control", "rendering", "model.self_play_test"]
+    for module in modules:
+        try:
+            seconds, loaded = time_import(module)
+        except RuntimeError as e:
+            print(e)
+            continue
+        print(f"{module}: median {np.median(seconds) * 1e3:.0f} ms (min {seconds.min() * 1e3:.0f} ms), "
+              f"heavy modules loaded: {', '.join(loaded) if loaded else 'none'}")
@@ -3,9 +3,19 @@ import warnings
 import numpy as np
 from skimage import filters
 
+from tracing import traced
+
 
 class ImagePreprocessing:
-    def __init__(self):
+    def __init__(self, median_mode="histogram"):
+        """Flattens and binarises scans
+
+        Parameters
+        ----------
+        median_mode: str
+            How lines are median aligned, 'histogram' (default) or 'exact' (see _median_offsets)
+        """
+        self.median_mode = median_mode
         self.are_flattening_parameters_set = False
         self.prelim_image = None
         self.poly_flat_order = None
@@ -13,14 +23,20 @@ class ImagePreprocessing:
         self.yv = None
         self.threshold_method = "multiotsu"
 
+    @traced("preprocess")
     def preprocess_and_binarise(self, image):
+        """Binarises a scan, in the shape (lines, points), or (2, lines, points) of which the forward scan is used.
+        The flattening parameters are set from the first scan given, if not already set"""
+        image = np.asarray(image)
+        if image.ndim == 3:
+            image = image[0]
 
-        return image
-
-        norm_data = self._normalize_data(image)
-        median_data = self._median_align(norm_data)
+        norm_data = self._normalize_data(image.astype(float))
+        median_data = self._median_align(norm_data, self.median_mode)
+        return self._flatten_and_binarise(median_data)
 
-        if self.are_flattening_parameters_set:
+    def _flatten_and_binarise(self, median_data):
+        if not self.are_flattening_parameters_set:
             self.set_flattening_parameters(median_data)
 
         flattened_data = self.flatten(median_data)
@@ -34,15 +50,60 @@ class ImagePreprocessing:
         return (arr - np.min(arr)) / (np.max(arr) - np.min(arr))
 
     @staticmethod
-    def _median_align(arr):
-        for i in range(len(arr)):
-            diff = arr[i - 1, :] - arr[i, :]
-            bins = np.linspace(np.min(diff), np.max(diff), 1000)
-            binned_indices = np.digitize(diff, bins, right=True)
-            np.sort(binned_indices)
-            median_index = np.median(binned_indices)
-            arr[i, :] += bins[int(median_index)]
+    def _median_offsets(diffs, mode="histogram", n_bins=1000):
+        """Median of `diffs` along the last axis
+
+        Parameters
+        ----------
+        diffs: ndarray
+            Differences between lines, in the shape (..., points)
+        mode: str
+            'histogram' (default) to round each median to one of `n_bins` evenly spaced levels between the smallest
+            and largest difference, as the alignment always has, or 'exact'
+        n_bins: int
+            Number of levels in histogram mode. Default 1000
+        """
+        if mode == "exact":
+            return np.median(diffs, axis=-1)
+        if mode != "histogram":
+            raise ValueError(f"Unknown median mode {mode}, expected 'histogram' or 'exact'")
+
+        lo = np.min(diffs, axis=-1)
+        levels = np.linspace(lo, np.max(diffs, axis=-1), n_bins, axis=-1)
+        step = (levels[..., -1:] - levels[..., :1]) / (n_bins - 1)
+
+        # Index of the first level at or above each difference, as np.digitize(..., right=True). Rounding can leave
+        # the estimate one level out, so it is checked against the levels themselves
+        with np.errstate(divide="ignore", invalid="ignore"):
+            estimate = np.where(step > 0, np.ceil((diffs - levels[..., :1]) / step), 0)
+        binned_indices = np.clip(estimate, 0, n_bins - 1).astype(int)
+        binned_indices -= (binned_indices > 0) & (np.take_along_axis(levels, binned_indices - 1, axis=-1) >= diffs)
+        binned_indices += ((binned_indices < n_bins - 1)
+                           & (np.take_along_axis(levels, binned_indices, axis=-1) < diffs))
+
+        median_index = np.median(binned_indices, axis=-1).astype(int)
+        return np.take_along_axis(levels, median_index[..., None], axis=-1)[..., 0]
 
+    @staticmethod
+    def _median_offset(diff, mode="histogram"):
+        """Median of the differences between two lines (see _median_offsets)"""
+        return ImagePreprocessing._median_offsets(np.asarray(diff)[None], mode)[0]
+
+    @staticmethod
+    def _median_align(arr, mode="histogram"):
+        """Aligns each line of `arr` in place to the line before it, by the median of their difference
+
+        Each line is offset by the median difference to the line before it once that line is itself aligned, which
+        is its median difference to the unaligned line plus that line's offset. So every median is taken at once from
+        the unaligned image and the offsets are their running sum. The first line is aligned to the unaligned last
+
+        In histogram mode that only holds up to rounding: each median is the same as the line by line alignment's
+        to within a rounding error, but on coarsely quantised data, where many differences lie on a level, the
+        offset shifts which level some of them round into. The running sum can then drift a few levels from the line
+        by line result, by up to 1% of the image's range on normalised data quantised to a few dozen heights
+        """
+        diffs = np.roll(arr, 1, axis=0) - arr
+        arr += np.cumsum(ImagePreprocessing._median_offsets(diffs, mode))[:, None]
         return arr
 
     def set_flattening_parameters(self, prelim_image, n=5):
@@ -73,6 +134,52 @@ class ImagePreprocessing:
 
         return image + self.yv + self.xv
 
+    def get_state(self):
+        """The flattening parameters and settings, as (values, arrays), e.g. to save to a checkpoint"""
+        values = {key: value.item() if isinstance(value, np.generic) else value for key, value in vars(self).items()
+                  if not isinstance(value, np.ndarray)}
+        arrays = {key: value for key, value in vars(self).items() if isinstance(value, np.ndarray)}
+        return values, arrays
+
+    def set_state(self, values, arrays):
+        """Restores the flattening parameters and settings from get_state"""
+        vars(self).update(values)
+        vars(self).update(arrays)
+
+    @staticmethod
+    def binarise_region(image, reference=None, n_sigma=5.0):
+        """Finds the desorbed pixels of a small region of a scan, e.g. around one piece, from how much higher they
+        appear than in `reference`, the same region scanned before the piece was drawn
+
+        Otsu's threshold always splits a region in two, even if nothing in it desorbed, so a pixel only counts as
+        desorbed if its gain is also `n_sigma` times the noise above the typical gain of the region. The noise is
+        estimated from the differences between neighbouring points of each line, which are barely changed by the few
+        edges of desorbed lines. Without a reference, e.g. for the first scan of a game, the gain is taken over the
+        median height of the region, so only works on a flat region
+
+        Lines aren't median aligned, as across a small region a horizontal line of desorption can fill most of a line
+        and would be aligned away
+
+        Parameters
+        ----------
+        image: ndarray
+            Region of the scan, in the shape (lines, points)
+        reference: ndarray or None
+            The same region before anything was drawn in it, or None (default)
+        n_sigma: float
+            Least gain of a desorbed pixel, in standard deviations of the noise. Default 5
+        """
+        gain = np.array(image, dtype=float)
+        if reference is not None:
+            gain -= reference
+        gain -= np.median(gain)
+
+        noise = 1.4826 * np.median(np.abs(np.diff(gain, axis=-1))) / np.sqrt(2)
+        threshold = n_sigma * noise
+        if np.ptp(gain) > 0:
+            threshold = max(threshold, filters.threshold_otsu(gain))
+        return gain > threshold
+
     def _binarise(self, arr):
         threshes = filters.threshold_multiotsu(arr, classes=2)
         # if type(threshes) is np.ndarray:  # Some thresholds return multiple levels - reduce to 2
@@ -80,3 +187,43 @@ class ImagePreprocessing:
         binarised = arr > threshes
 
         return binarised
+
+
+class StreamingPreprocessing:
+    def __init__(self, preprocessor: ImagePreprocessing):
+        """Preprocesses a scan line by line as it is acquired, so the binarised image is ready as soon as it ends
+
+        Each line is median aligned to the one before it and the running min/max is tracked as it arrives, leaving
+        only vectorised normalisation, flattening and thresholding once the last line is in. The result is that of
+        ImagePreprocessing.preprocess_and_binarise on the forward scan: aligning commutes with normalising, as the
+        min/max are taken before the lines are aligned, and the offset the batch alignment gives the whole image
+        through its first line is normalised away after flattening. Only histogram rounding (see _median_align) can
+        flip a pixel lying on the threshold
+
+        Parameters
+        ----------
+        preprocessor: ImagePreprocessing
+            Holds the flattening parameters, which are set from the first streamed scan if not already set
+        """
+        self.preprocessor = preprocessor
+        self.lines = []
+        self.running_min = np.inf
+        self.running_max = -np.inf
+
+    def add_line(self, line):
+        """Aligns and stores the next line of the scan"""
+        line = np.array(line, dtype=float)
+        self.running_min = min(self.running_min, np.min(line))
+        self.running_max = max(self.running_max, np.max(line))
+        if self.lines:
+            line += ImagePreprocessing._median_offset(self.lines[-1] - line, self.preprocessor.median_mode)
+
+        self.lines.append(line)
+
+    def finish(self):
+        """Normalises, flattens and binarises the aligned lines, and resets for the next scan"""
+        median_data = (np.array(self.lines) - self.running_min) / (self.running_max - self.running_min)
+        self.lines = []
+        self.running_min = np.inf
+        self.running_max = -np.inf
+        return self.preprocessor._flatten_and_binarise(median_data)
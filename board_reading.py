@@ -0,0 +1,97 @@
+import numpy as np
+
+import utils
+
+
+class CellReader:
+    def __init__(self, classifier, geometry: utils.BoardGeometry = None, class_tokens=(0, 1, -1), input_size=None):
+        """Reads the token on every square of the board from one scan, with a single batched classifier call
+
+        Every cell is cut out of the scan at once with one fancy index, so the cost of a read is one crop and one
+        forward pass of each model whatever the size of the board
+
+        Parameters
+        ----------
+        classifier: model.classify.EnsembleClassifier
+            Classifier with its models loaded, taking patches in the shape (n, size, size, 1)
+        geometry: utils.BoardGeometry or None
+            Where the board is laid out in the scan area. None (default) for the 3x3 board filling the scan area
+        class_tokens: tuple of int
+            Token number (1, -1 or 0) of each of the classifier's categories, in order. Default (0, 1, -1), i.e.
+            empty, cross, nought
+        input_size: int or None
+            Side of the patches the models take (pixels). None (default) for one cell pitch of the scan
+        """
+        self.classifier = classifier
+        self.geometry = geometry if geometry is not None else utils.board_geometry()
+        self.class_tokens = np.asarray(class_tokens)
+        self.input_size = input_size
+
+    def cell_centres(self, resolution: int, offset=(0, 0)):
+        """(column, row) pixel co-ords of the centre of every cell in a scan with `resolution` points, moved by
+        `offset` (index co-ords) as the pieces are, in the shape (n_actions, 2)"""
+        centres = self.geometry.cell_centre_inds + np.asarray(offset)
+        return np.round(utils.mtrx2px(self.geometry.to_scan(self.geometry.ind2mtrx(centres)), resolution)).astype(int)
+
+    def cell_size(self, resolution: int):
+        """Pitch of the cells in a scan with `resolution` points (pixels)"""
+        n_rows, n_cols = self.geometry.grid_shape
+        pitch_mtrx = 2 / max(n_rows, n_cols) * self.geometry.piece_scale
+        return int(pitch_mtrx / 2 * (resolution - 1))
+
+    def crop_cells(self, image, offset=(0, 0)):
+        """Cuts the patch around every cell out of a scan, padding with zeros past its edges
+
+        Returns
+        -------
+        patches: ndarray
+            In the shape (n_actions, size, size), in the order of the actions
+        """
+        image = np.asarray(image)
+        resolution = image.shape[-1]
+        size = self.cell_size(resolution)
+        centres = self.cell_centres(resolution, offset)
+
+        span = np.arange(size) - size // 2
+        rows = centres[:, 1, None, None] + span[None, :, None]
+        cols = centres[:, 0, None, None] + span[None, None, :]
+        inside = (rows >= 0) & (rows < image.shape[0]) & (cols >= 0) & (cols < image.shape[1])
+        patches = image[np.clip(rows, 0, image.shape[0] - 1), np.clip(cols, 0, image.shape[1] - 1)]
+        return np.where(inside, patches, 0)
+
+    def _to_input(self, patches):
+        """Normalises each patch to [0, 1], resamples them to the models' input size and adds the feature axis"""
+        patches = patches.astype(np.float32)
+        lo = patches.min(axis=(1, 2), keepdims=True)
+        patches = (patches - lo) / np.maximum(patches.max(axis=(1, 2), keepdims=True) - lo, 1e-12)
+        if self.input_size is not None and self.input_size != patches.shape[1]:
+            idx = (np.arange(self.input_size) * patches.shape[1] / self.input_size).astype(int)
+            patches = patches[:, idx[:, None], idx[None, :]]
+        return patches[..., None]
+
+    def read(self, image, offset=(0, 0)):
+        """Token number of every square of the board, comparable with [tile.number for tile in env.board]
+
+        Parameters
+        ----------
+        image: ndarray
+            Binarised scan of the board, in the shape (lines, points), or (2, lines, points) of which the forward
+            scan is read
+        offset: tuple of float
+            How far the pieces were moved to follow drift (index co-ords). Default (0, 0)
+
+        Returns
+        -------
+        board: ndarray
+            Token number (1, -1 or 0) of each of the n_actions squares
+        """
+        image = np.asarray(image)
+        if image.ndim == 3:
+            image = image[0]
+
+        batch = self._to_input(self.crop_cells(image, offset))
+        preds = self.classifier.ensemble_predict(self.classifier.classify(batch))
+        if preds.shape[-1] != len(self.class_tokens):
+            raise ValueError(f"Classifier has {preds.shape[-1]} categories, but {len(self.class_tokens)} class tokens "
+                             f"were given")
+        return self.class_tokens[np.argmax(preds, axis=-1)]
@@ -0,0 +1,53 @@
+import json
+import os
+import tempfile
+
+import numpy as np
+
+
+def save_checkpoint(path, state: dict, arrays: dict):
+    """Atomically writes a checkpoint of JSON serialisable `state` and named `arrays` to `path`
+
+    Everything is written to a temporary file next to `path`, flushed to disk and then renamed over it, so a crash at
+    any point leaves either the previous checkpoint or the new one, never a partial file. Arrays that are None are
+    left out
+
+    Parameters
+    ----------
+    path: str
+        File to write, conventionally ending in .npz
+    state: dict
+        Values to save, loaded back as by json
+    arrays: dict
+        Arrays to save by name
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, _state=np.array(json.dumps(state)),
+                     **{name: arr for name, arr in arrays.items() if arr is not None})
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_checkpoint(path):
+    """Reads a checkpoint written by save_checkpoint
+
+    Returns
+    -------
+    state: dict
+        The values saved
+    arrays: dict
+        The arrays saved, by name
+    """
+    with np.load(path, allow_pickle=False) as data:
+        state = json.loads(str(data["_state"]))
+        arrays = {name: data[name] for name in data.files if name != "_state"}
+    return state, arrays
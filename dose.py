@@ -0,0 +1,86 @@
+import numpy as np
+
+from shapes.shapes import DataShape
+
+
+class DoseOptimiser:
+    def __init__(self, threshold_charge=5e-9, reference_bias=4.2, threshold_voltage=3.5, margin=1.2,
+                 min_t_raster=5e-3):
+        """Picks the raster time of each move of a piece, drawing desorbing moves as fast as the dose allows and
+        travelling between them as fast as the scanner allows
+
+        The charge a line receives per unit length is the current times the time the tip takes to cross it, and the
+        line only desorbs above a threshold charge. Above `threshold_voltage` the yield per electron is taken to rise
+        linearly with bias, so the threshold scales as (reference_bias - threshold_voltage) / (bias -
+        threshold_voltage)
+
+        Raster times are as the t_raster of STMTicTacToe, i.e. crossing the full frame takes t_raster * points. As
+        only their product sets the speed of the tip, the number of points is kept and only the raster time chosen
+
+        Parameters
+        ----------
+        threshold_charge: float
+            Least charge per unit length, in Matrix co-ords, that desorbs a line at `reference_bias` (Coulombs).
+            Default 5e-9, i.e. 1.5 nA at t_raster 20 ms over 512 points desorbs with a margin of 1.5
+        reference_bias: float
+            Bias `threshold_charge` was measured at (Volts). Default 4.2
+        threshold_voltage: float
+            Bias below which nothing desorbs however long the tip dwells (Volts). Default 3.5
+        margin: float
+            Factor the dose of desorbing moves is kept above the threshold by. Default 1.2
+        min_t_raster: float
+            Shortest raster time the scanner follows reliably, used for every move that doesn't desorb (Seconds).
+            Default 5e-3
+        """
+        self.threshold_charge = threshold_charge
+        self.reference_bias = reference_bias
+        self.threshold_voltage = threshold_voltage
+        self.margin = margin
+        self.min_t_raster = min_t_raster
+        self.history = []
+
+    def threshold(self, bias):
+        """Least charge per unit length, in Matrix co-ords, that desorbs a line at `bias` (Coulombs)"""
+        if bias <= self.threshold_voltage:
+            raise ValueError(f"Nothing desorbs at {bias} V, below the threshold of {self.threshold_voltage} V")
+        return self.threshold_charge * (self.reference_bias - self.threshold_voltage) / (bias - self.threshold_voltage)
+
+    def desorbing_t_raster(self, bias, current, points):
+        """Shortest raster time that keeps the dose of a desorbing move `margin` above the threshold (Seconds)"""
+        seconds_per_unit = self.margin * self.threshold(bias) / current
+        return max(seconds_per_unit * 2 / points, self.min_t_raster)
+
+    def plan(self, piece: DataShape, bias, current, points):
+        """Raster time of the move into each point of the piece, as taken by DataShape.draw_in_stm"""
+        return np.where(piece.desorb, self.desorbing_t_raster(bias, current, points), self.min_t_raster)
+
+    @staticmethod
+    def predicted_time(piece: DataShape, t_rasters, points, start=None):
+        """Time the tip takes to follow the path of the piece at raster times `t_rasters`, from `start` if given or
+        else from its first point (Seconds)"""
+        path = piece.mtrx_positions if start is None else np.vstack([start, piece.mtrx_positions])
+        t_rasters = np.asarray(t_rasters)[1:] if start is None else np.asarray(t_rasters)
+        distances = np.linalg.norm(np.diff(path, axis=0), axis=1)
+        return float(np.sum(distances / 2 * t_rasters * points))
+
+    def record(self, piece: DataShape, t_raster, t_rasters, points, start=None):
+        """Reports the time saved drawing `piece` at `t_rasters` rather than at `t_raster` throughout, once it has
+        been drawn from `start`, and keeps it in `history`
+
+        The actual time is as measured on the backend's clock by DataShape.draw_in_stm, from the same point as the
+        predictions: from `start` if given, else from the tip reaching the first point of the piece, as the first
+        move of a tip whose position can't be read back takes an unknown time
+
+        Returns
+        -------
+        saved: dict
+            'predicted' and 'actual' time saved (Seconds), the actual from the time the piece took to draw
+        """
+        fixed = self.predicted_time(piece, np.full(len(piece.desorb), t_raster), points, start)
+        planned = self.predicted_time(piece, t_rasters, points, start)
+        took = piece.draw_time if start is not None else piece.path_time
+        saved = {"shape": piece.object_shape, "predicted": fixed - planned, "actual": fixed - took}
+        self.history.append(saved)
+        print(f"Dose optimised {piece.object_shape}: predicted {planned:.1f}s against {fixed:.1f}s at a fixed raster "
+              f"time, saving {saved['predicted']:.1f}s. Took {took:.1f}s, saving {saved['actual']:.1f}s")
+        return saved
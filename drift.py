@@ -0,0 +1,196 @@
+import warnings
+from time import perf_counter
+
+import numpy as np
+
+
+class DriftTracker:
+    def __init__(self, levels=3, finest_level=0, search_radius=2, min_size=64, bright_threshold=4.0,
+                 min_peak_ratio=10.0, max_rate=0.2, tolerance=1.0):
+        """Estimates how far the sample has drifted since a reference scan, by FFT phase correlation
+
+        Each estimate is made coarse to fine over an image pyramid. The coarsest level is searched over every
+        shift, and each finer level only refines the shift found below it within `search_radius`, so a large drift
+        is found cheaply without the fine levels locking onto a repeating feature
+
+        An estimate is only made from at least `min_size` pixels a side, as on fewer the full search locks onto
+        whichever peak the noise makes highest. It is rejected, leaving `shift` as it was, if that peak doesn't stand
+        `min_peak_ratio` times above the mean of the correlation, or if the shift changed by more than the sample
+        could have drifted at `max_rate` since the last estimate
+
+        Parameters
+        ----------
+        levels: int
+            Number of pyramid levels, each half the size of the one above. Default 3
+        finest_level: int
+            Stop refining at this level, e.g. 1 for half resolution, trading precision for speed. Default 0
+        search_radius: int
+            Largest correction to the shift from the level below searched at each finer level (pixels). Default 2
+        min_size: int
+            Fewest pixels along either side of the coarsest level, below which features wash out, and so of a window to
+            estimate from. Default 64
+        bright_threshold: float
+            Pixels more than this many standard deviations above the median are left out of the correlation. Default 4
+        min_peak_ratio: float
+            Least height of the correlation peak at the coarsest level over the mean of its magnitude. Default 10
+        max_rate: float
+            Fastest the sample is expected to drift (pixels per Second). Default 0.2
+        tolerance: float
+            Change in the shift allowed however little time has passed, for the error of each estimate (pixels).
+            Default 1
+        """
+        self.levels = levels
+        self.finest_level = finest_level
+        self.search_radius = search_radius
+        self.min_size = min_size
+        self.bright_threshold = bright_threshold
+        self.min_peak_ratio = min_peak_ratio
+        self.max_rate = max_rate
+        self.tolerance = tolerance
+        self.reference = None
+        self.shift = np.zeros(2)
+        self.shift_at = None
+        self.times = []
+        self._windows = {}
+
+    def set_reference(self, image, at=None):
+        """Sets the image that drift is measured from, e.g. the first full frame of a game, scanned at time `at`
+        (Seconds) if known"""
+        self.reference = np.array(image, dtype=float)
+        self.shift = np.zeros(2)
+        self.shift_at = at
+
+    @staticmethod
+    def _downsample(image):
+        rows, cols = (image.shape[0] // 2) * 2, (image.shape[1] // 2) * 2
+        image = image[:rows, :cols]
+        return (image[0::2, 0::2] + image[1::2, 0::2] + image[0::2, 1::2] + image[1::2, 1::2]) / 4
+
+    def _window(self, shape):
+        if shape not in self._windows:
+            self._windows[shape] = np.outer(np.hanning(shape[0]), np.hanning(shape[1]))
+        return self._windows[shape]
+
+    @staticmethod
+    def _remove_plane(image):
+        """Subtracts the least squares plane, so the tilt of the sample doesn't pin the correlation at zero shift
+
+        On a regular grid the row and column slopes are independent, so they are fitted to the row and column means
+        """
+        rows = np.arange(image.shape[0]) - (image.shape[0] - 1) / 2
+        cols = np.arange(image.shape[1]) - (image.shape[1] - 1) / 2
+        row_slope = rows @ image.mean(axis=1) / (rows @ rows)
+        col_slope = cols @ image.mean(axis=0) / (cols @ cols)
+        return image - image.mean() - row_slope * rows[:, None] - col_slope * cols[None, :]
+
+    def _suppress_bright(self, image):
+        """Flattens anything far brighter than the surface, i.e. desorbed lines, which are mostly pieces drawn since
+        the reference and so would only pull the correlation towards zero shift"""
+        median = np.median(image)
+        sigma = 1.4826 * np.median(np.abs(image - median))
+        return np.where(image > median + self.bright_threshold * sigma, median, image)
+
+    def _correlation(self, reference, image):
+        """Phase correlation surface, peaking at the shift of `image` relative to `reference`"""
+        window = self._window(reference.shape)
+        f_ref = np.fft.rfft2(reference * window)
+        f_img = np.fft.rfft2(image * window)
+        cross_power = f_img * np.conj(f_ref)
+        cross_power /= np.abs(cross_power) + 1e-12
+        return np.fft.irfft2(cross_power, s=reference.shape)
+
+    @staticmethod
+    def _subpixel(corr, peak):
+        """Refines the peak along each axis with a parabola through it and its neighbours"""
+        offsets = np.zeros(2)
+        for axis in range(2):
+            before, after = list(peak), list(peak)
+            before[axis] = (peak[axis] - 1) % corr.shape[axis]
+            after[axis] = (peak[axis] + 1) % corr.shape[axis]
+            c_before, c_peak, c_after = corr[tuple(before)], corr[tuple(peak)], corr[tuple(after)]
+            denominator = c_before - 2 * c_peak + c_after
+            if denominator < 0:
+                offsets[axis] = 0.5 * (c_before - c_after) / denominator
+        return offsets
+
+    def _pyramid(self, image):
+        pyramid = [image]
+        for _ in range(1, self.levels):
+            if min(pyramid[-1].shape) // 2 < self.min_size:
+                break
+            pyramid.append(self._downsample(pyramid[-1]))
+        return pyramid
+
+    def estimate(self, image, window=None, at=None):
+        """Measures the drift of `image` relative to the reference, within `window` of both if given
+
+        Parameters
+        ----------
+        image: ndarray
+            A scan of the same frame as the reference, in the shape (lines, points)
+        window: tuple of int or None
+            Pixel bounds (col_min, row_min, col_max, row_max) to compare, e.g. the region of interest just
+            rescanned. None (default) compares the whole frame
+        at: float or None
+            Time `image` was scanned on the same clock as the reference (Seconds), e.g. MicroscopeBackend.time. If
+            None (default), the change in the shift isn't limited
+
+        Returns
+        -------
+        shift: ndarray or None
+            Drift as (columns, rows), i.e. features in `image` are this far from where they are in the reference
+            (pixels). None, with a warning, if the window is too small or the estimate implausible
+        """
+        start = perf_counter()
+        if window is not None:
+            col_min, row_min, col_max, row_max = window
+            if min(col_max - col_min, row_max - row_min) < self.min_size:
+                return None
+            reference = self.reference[row_min:row_max, col_min:col_max]
+            image = np.asarray(image, dtype=float)[row_min:row_max, col_min:col_max]
+        else:
+            reference = self.reference
+            image = np.asarray(image, dtype=float)
+
+        ref_pyramid = self._pyramid(self._suppress_bright(self._remove_plane(reference)))
+        img_pyramid = self._pyramid(self._suppress_bright(self._remove_plane(image)))
+        finest_level = min(self.finest_level, len(ref_pyramid) - 1)
+
+        shift = np.zeros(2, dtype=int)  # (rows, columns) at the current level
+        for level in range(len(ref_pyramid) - 1, finest_level - 1, -1):
+            is_coarsest = level == len(ref_pyramid) - 1
+            shift = shift * (1 if is_coarsest else 2)
+            corr = self._correlation(ref_pyramid[level], np.roll(img_pyramid[level], -shift, axis=(0, 1)))
+
+            if is_coarsest:
+                peak = np.array(np.unravel_index(np.argmax(corr), corr.shape))
+                peak_ratio = corr[tuple(peak)] / np.mean(np.abs(corr))
+            else:
+                radius = self.search_radius
+                near = np.arange(-radius, radius + 1)
+                local = corr[np.ix_(near % corr.shape[0], near % corr.shape[1])]
+                peak = np.array(np.unravel_index(np.argmax(local), local.shape)) - radius
+                peak %= corr.shape
+
+            residual = (peak + np.array(corr.shape) // 2) % np.array(corr.shape) - np.array(corr.shape) // 2
+            if level == finest_level:
+                subpixel = self._subpixel(corr, tuple(peak))
+            shift = shift + residual
+
+        shift = (shift + subpixel) * 2 ** finest_level
+        shift = shift[::-1]
+        self.times.append(perf_counter() - start)
+
+        if peak_ratio < self.min_peak_ratio:
+            warnings.warn(f"Ignoring drift estimate of {shift} pixels, as its correlation peak is only "
+                          f"{peak_ratio:.1f} times the mean")
+            return None
+        if at is not None and self.shift_at is not None:
+            max_change = self.tolerance + self.max_rate * (at - self.shift_at)
+            if np.linalg.norm(shift - self.shift) > max_change:
+                warnings.warn(f"Ignoring drift estimate of {shift} pixels, further from the last than the sample could "
+                              f"have drifted since")
+                return None
+        self.shift = shift
+        self.shift_at = at
+        return self.shift
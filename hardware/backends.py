@@ -0,0 +1,357 @@
+from collections import defaultdict
+from time import perf_counter, sleep
+
+
+class MicroscopeBackend:
+    """Interface between the game and the microscope
+
+    Parameter methods follow the nOmicron convention of acting as a getter when called without a value and as a
+    setter when called with one. Positions are in Matrix co-ord form [-1 - 1, -1 - 1]. Every call made through a
+    backend is counted in `n_calls` so the cost of a sequence of operations can be compared.
+    """
+
+    supports_position_readback = False
+
+    def __init__(self):
+        self.n_calls = 0
+
+    def _count(self):
+        self.n_calls += 1
+
+    def connect(self):
+        raise NotImplementedError
+
+    def voltage(self, value=None):
+        """Gap voltage (Volts)"""
+        raise NotImplementedError
+
+    def setpoint(self, value=None):
+        """Regulator setpoint current (Amps)"""
+        raise NotImplementedError
+
+    def raster_time(self, value=None):
+        """Time spent per point when scanning or moving (Seconds)"""
+        raise NotImplementedError
+
+    def points(self, value=None):
+        """Number of points per scan line"""
+        raise NotImplementedError
+
+    def return_to_stored_position(self, value):
+        raise NotImplementedError
+
+    def move_tip(self, target):
+        """Start moving the tip to `target`. Does not wait for the move to finish"""
+        raise NotImplementedError
+
+    def tip_position(self):
+        """Current tip position. Only available if `supports_position_readback`"""
+        raise NotImplementedError
+
+    def get_xy_scan(self, channel="Z", direction="Forward-Backward", trace="Up", window=None):
+        """Acquires a scan in the shape (no_directions, lines, points)
+
+        If `window` is given as pixel bounds (col_min, row_min, col_max, row_max) of the full frame, with the
+        maxima exclusive, only that region is scanned at the same pixel size as the full frame
+        """
+        raise NotImplementedError
+
+    def iter_xy_scan_lines(self, channel="Z", direction="Forward-Backward", trace="Up", window=None):
+        """Yields a scan line by line as (line_index, line) with each line in the shape (no_directions, points)
+
+        By default the whole scan is acquired first, backends that can stream lines as they arrive override this
+        """
+        scan = self.get_xy_scan(channel, direction, trace, window=window)
+        for i in range(scan.shape[1]):
+            yield i, scan[:, i, :]
+
+    def get_preview_scan(self, points=64, channel="Z"):
+        """Acquires a quick, forward only scan of the full frame at `points` x `points`, in the shape (lines, points)
+        """
+        raise NotImplementedError
+
+    def retract(self):
+        """Withdraws the tip from the surface, ready for coarse moves"""
+        raise NotImplementedError
+
+    def coarse_move(self, direction, steps=1):
+        """Moves the sample under the retracted tip by `steps` coarse steps in `direction`, one of 'x_plus',
+        'x_minus', 'y_plus', 'y_minus'"""
+        raise NotImplementedError
+
+    def approach(self):
+        """Brings the tip back into tunnelling range after coarse moves"""
+        raise NotImplementedError
+
+    def stop_experiment(self):
+        raise NotImplementedError
+
+    def resume_experiment(self):
+        raise NotImplementedError
+
+    def sleep(self, seconds):
+        """Wait for the instrument. Simulated backends may advance a virtual clock instead"""
+        sleep(seconds)
+
+    def time(self):
+        """Time on the clock that `sleep` waits on (Seconds), e.g. to measure how long the instrument took"""
+        return perf_counter()
+
+
+class NOmicronBackend(MicroscopeBackend):
+    def __init__(self):
+        """Talks to a real MATRIX instrument through nOmicron"""
+        super().__init__()
+        from nOmicron.mate import objects as mo
+        from nOmicron.microscope import IO, black_box, xy_scanner
+
+        self._mo = mo
+        self._IO = IO
+        self._black_box = black_box
+        self._xy_scanner = xy_scanner
+
+    def _param(self, attribute, value):
+        self._count()
+        if value is None:
+            return attribute()
+        return attribute(value)
+
+    def connect(self):
+        self._IO.connect()
+
+    def voltage(self, value=None):
+        return self._param(self._mo.gap_voltage_control.Voltage, value)
+
+    def setpoint(self, value=None):
+        return self._param(self._mo.regulator.Setpoint_1, value)
+
+    def raster_time(self, value=None):
+        return self._param(self._mo.xy_scanner.Raster_Time, value)
+
+    def points(self, value=None):
+        return self._param(self._mo.xy_scanner.Points, value)
+
+    def return_to_stored_position(self, value):
+        return self._param(self._mo.xy_scanner.Return_To_Stored_Position, value)
+
+    def move_tip(self, target):
+        self._count()
+        self._mo.xy_scanner.Target_Position(list(target))
+        self._count()
+        self._mo.xy_scanner.move()
+
+    def get_xy_scan(self, channel="Z", direction="Forward-Backward", trace="Up", window=None):
+        if window is None:
+            self._count()
+            return self._xy_scanner.get_xy_scan(channel, direction, trace)
+
+        # Shrink the scan area around the window, keeping the pixel size, then put it back
+        old_area = self._param(self._mo.xy_scanner.Area, None)
+        old_offset = self._param(self._mo.xy_scanner.Offset, None)
+        old_points = self._param(self._mo.xy_scanner.Points, None)
+        old_lines = self._param(self._mo.xy_scanner.Lines, None)
+
+        col_min, row_min, col_max, row_max = window
+        pixel_size = (old_area[0] / old_points, old_area[1] / old_lines)
+        centre_px = ((col_min + col_max - 1) / 2, (row_min + row_max - 1) / 2)
+        try:
+            self._param(self._mo.xy_scanner.Area, ((col_max - col_min) * pixel_size[0],
+                                                   (row_max - row_min) * pixel_size[1]))
+            self._param(self._mo.xy_scanner.Offset,
+                        (old_offset[0] + (centre_px[0] - (old_points - 1) / 2) * pixel_size[0],
+                         old_offset[1] + (centre_px[1] - (old_lines - 1) / 2) * pixel_size[1]))
+            self._param(self._mo.xy_scanner.Points, col_max - col_min)
+            self._param(self._mo.xy_scanner.Lines, row_max - row_min)
+
+            self._count()
+            return self._xy_scanner.get_xy_scan(channel, direction, trace)
+        finally:
+            # Even if the scan fails or is interrupted, so the instrument isn't left scanning the window
+            self._param(self._mo.xy_scanner.Area, old_area)
+            self._param(self._mo.xy_scanner.Offset, old_offset)
+            self._param(self._mo.xy_scanner.Points, old_points)
+            self._param(self._mo.xy_scanner.Lines, old_lines)
+
+    def get_preview_scan(self, points=64, channel="Z"):
+        old_points = self._param(self._mo.xy_scanner.Points, None)
+        old_lines = self._param(self._mo.xy_scanner.Lines, None)
+        try:
+            self._param(self._mo.xy_scanner.Points, points)
+            self._param(self._mo.xy_scanner.Lines, points)
+
+            self._count()
+            return self._xy_scanner.get_xy_scan(channel, "Forward", "Up")[0]
+        finally:
+            self._param(self._mo.xy_scanner.Points, old_points)
+            self._param(self._mo.xy_scanner.Lines, old_lines)
+
+    def retract(self):
+        self._count()
+        self._black_box.backward()
+
+    def coarse_move(self, direction, steps=1):
+        if direction not in ("x_plus", "x_minus", "y_plus", "y_minus"):
+            raise ValueError(f"Unknown coarse move direction {direction}")
+        for _ in range(steps):
+            self._count()
+            getattr(self._black_box, direction)()
+
+    def approach(self):
+        self._count()
+        self._black_box.auto_approach()
+
+    def stop_experiment(self):
+        self._count()
+        self._mo.experiment.stop()
+
+    def resume_experiment(self):
+        self._count()
+        self._mo.experiment.resume()
+
+
+class CachedBackend(MicroscopeBackend):
+    def __init__(self, backend: MicroscopeBackend):
+        """Wraps a backend with a local cache of its parameters, so repeated reads and writes don't each cost a round
+        trip to the instrument
+
+        Reads are served from the cache once a value is known, and writes go through to the instrument only when the
+        value changes. The cache is cleared whenever the experiment is stopped or resumed, as the instrument may
+        change its parameters then, or by calling `invalidate`. Every call forwarded to the wrapped backend is timed
+        in `stats`
+
+        Parameters
+        ----------
+        backend: MicroscopeBackend
+            Backend to forward calls to
+        """
+        self.backend = backend
+        self.supports_position_readback = backend.supports_position_readback
+        self._cache = {}
+        self.stats = defaultdict(lambda: {"calls": 0, "seconds": 0.0, "cache_hits": 0, "skipped_writes": 0})
+
+    @property
+    def n_calls(self):
+        """Calls made to the instrument, i.e. by the wrapped backend"""
+        return self.backend.n_calls
+
+    def _forward(self, name, *args, **kwargs):
+        start = perf_counter()
+        try:
+            return getattr(self.backend, name)(*args, **kwargs)
+        finally:
+            stats = self.stats[name]
+            stats["calls"] += 1
+            stats["seconds"] += perf_counter() - start
+
+    def _param(self, name, value):
+        if value is None:
+            if name in self._cache:
+                self.stats[name]["cache_hits"] += 1
+            else:
+                self._cache[name] = self._forward(name)
+            return self._cache[name]
+
+        if name in self._cache and self._cache[name] == value:
+            self.stats[name]["skipped_writes"] += 1
+            return None
+        result = self._forward(name, value)
+        self._cache[name] = value
+        return result
+
+    def invalidate(self, name=None):
+        """Forgets the cached value of parameter `name`, or of every parameter if None (default)"""
+        if name is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(name, None)
+
+    def reset_stats(self):
+        """Starts counting calls afresh, e.g. for a new session"""
+        self.stats.clear()
+
+    def summary(self):
+        """One line summary of the calls made and saved since the stats were last reset"""
+        n_forwarded = sum(stats["calls"] for stats in self.stats.values())
+        seconds = sum(stats["seconds"] for stats in self.stats.values())
+        n_hits = sum(stats["cache_hits"] for stats in self.stats.values())
+        n_skipped = sum(stats["skipped_writes"] for stats in self.stats.values())
+        return (f"{n_forwarded} calls forwarded to the instrument taking {seconds:.2f}s, {n_hits} reads served from "
+                f"cache and {n_skipped} unchanged writes skipped")
+
+    def connect(self):
+        return self._forward("connect")
+
+    def voltage(self, value=None):
+        return self._param("voltage", value)
+
+    def setpoint(self, value=None):
+        return self._param("setpoint", value)
+
+    def raster_time(self, value=None):
+        return self._param("raster_time", value)
+
+    def points(self, value=None):
+        return self._param("points", value)
+
+    def return_to_stored_position(self, value):
+        return self._param("return_to_stored_position", value)
+
+    def move_tip(self, target):
+        return self._forward("move_tip", target)
+
+    def tip_position(self):
+        return self._forward("tip_position")
+
+    def get_xy_scan(self, channel="Z", direction="Forward-Backward", trace="Up", window=None):
+        return self._forward("get_xy_scan", channel, direction, trace, window=window)
+
+    def iter_xy_scan_lines(self, channel="Z", direction="Forward-Backward", trace="Up", window=None):
+        start = perf_counter()
+        yield from self.backend.iter_xy_scan_lines(channel, direction, trace, window=window)
+        stats = self.stats["iter_xy_scan_lines"]
+        stats["calls"] += 1
+        stats["seconds"] += perf_counter() - start
+
+    def get_preview_scan(self, points=64, channel="Z"):
+        return self._forward("get_preview_scan", points, channel)
+
+    def retract(self):
+        return self._forward("retract")
+
+    def coarse_move(self, direction, steps=1):
+        return self._forward("coarse_move", direction, steps)
+
+    def approach(self):
+        return self._forward("approach")
+
+    def stop_experiment(self):
+        result = self._forward("stop_experiment")
+        self.invalidate()
+        return result
+
+    def resume_experiment(self):
+        result = self._forward("resume_experiment")
+        self.invalidate()
+        return result
+
+    def sleep(self, seconds):
+        return self.backend.sleep(seconds)
+
+    def time(self):
+        return self.backend.time()
+
+
+_backend = None
+
+
+def get_backend():
+    """Returns the active backend, connecting to the real microscope if none has been set"""
+    global _backend
+    if _backend is None:
+        _backend = NOmicronBackend()
+    return _backend
+
+
+def set_backend(backend: MicroscopeBackend):
+    global _backend
+    _backend = backend
@@ -0,0 +1,60 @@
+import numpy as np
+
+from tracing import traced
+
+
+class MoveWaiter:
+    def __init__(self, tolerance=2e-3, poll_interval=2e-2, timeout_factor=1.3, margin=1.1):
+        """Waits for tip moves to actually finish rather than for a fixed time
+
+        If the backend can read back the tip position it is polled until the tip is within `tolerance` of the
+        target. Otherwise the wait is estimated from the path length. Either way a full frame move never waits
+        longer than the old fixed `timeout_factor * t_raster * points`.
+
+        Parameters
+        ----------
+        tolerance: float
+            Distance from the target at which a move is considered finished (Matrix co-ords)
+        poll_interval: float
+            Time between position reads when polling (Seconds)
+        timeout_factor: float
+            Longest wait, as a multiple of the time taken to cross the full frame
+        margin: float
+            Safety factor applied to path length estimates
+        """
+        self.tolerance = tolerance
+        self.poll_interval = poll_interval
+        self.timeout_factor = timeout_factor
+        self.margin = margin
+
+    def fixed_wait(self, t_raster, points):
+        """The wait used regardless of distance before completion-driven waiting (Seconds)"""
+        return self.timeout_factor * t_raster * points
+
+    def estimate(self, start, target, t_raster, points):
+        """Estimated time to travel from `start` to `target`, where crossing the full frame takes
+        `t_raster * points` (Seconds)"""
+        distance = np.linalg.norm(np.asarray(target, dtype=float) - np.asarray(start, dtype=float))
+        return min(self.margin * distance / 2 * t_raster * points, self.fixed_wait(t_raster, points))
+
+    @traced("wait_for_move")
+    def wait(self, backend, target, t_raster, points, start=None):
+        """Blocks until the move to `target` has finished
+
+        Returns
+        -------
+        waited: float
+            Time spent waiting (Seconds)
+        """
+        timeout = self.fixed_wait(t_raster, points)
+
+        if backend.supports_position_readback:
+            waited = 0.0
+            while np.linalg.norm(backend.tip_position() - target) > self.tolerance and waited < timeout:
+                backend.sleep(self.poll_interval)
+                waited += self.poll_interval
+            return waited
+
+        waited = timeout if start is None else self.estimate(start, target, t_raster, points)
+        backend.sleep(waited)
+        return waited
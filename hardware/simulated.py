@@ -0,0 +1,291 @@
+from time import sleep
+
+import numpy as np
+
+from hardware.backends import MicroscopeBackend
+from utils import mtrx2px
+
+
+class SimulatedBackend(MicroscopeBackend):
+    supports_position_readback = True
+
+    def __init__(self, resolution=512, raster_time=1e-4, rpc_latency=0.0, time_scale=1.0, desorption_threshold=3.5,
+                 desorption_width=3, desorption_height=1.0, noise=0.05, defect_density=1e-3, drift_velocity=(0, 0),
+                 viable_fraction=1.0, coarse_step_time=1.0, approach_time=20.0, desorption_probability=1.0,
+                 desorption_charge=0.0, seed=None):
+        """In-process stand-in for the microscope with a virtual tip and synthetic Z scans
+
+        Parameters
+        ----------
+        resolution: int
+            Number of points per scan line and number of lines in a scan
+        raster_time: float
+            Initial time spent per point when scanning or moving (Seconds)
+        rpc_latency: float
+            Round trip time added to every call, to mimic the MATRIX server (Seconds)
+        time_scale: float
+            Fraction of instrument time actually slept. 1 (default) runs in real time, 0 runs as fast as possible
+        desorption_threshold: float
+            Voltage at and above which tip moves desorb the surface (Volts)
+        desorption_width: int
+            Width of desorbed lines (pixels)
+        desorption_height: float
+            Apparent height of desorbed lines in the Z channel
+        noise: float
+            Standard deviation of the noise added to each scan
+        defect_density: float
+            Fraction of pixels at the centre of a pit in the surface, giving scans features to track drift by
+        drift_velocity: tuple of float
+            Rate the sample drifts under the scan frame, as (columns, rows) per second of instrument time (pixels)
+        viable_fraction: float
+            Chance that an area is flat enough to play on, rather than covered in step edges and defects. The starting
+            area is always viable. Default 1
+        coarse_step_time: float
+            Time taken by each coarse step (Seconds)
+        approach_time: float
+            Time taken to approach the surface after coarse moves (Seconds)
+        desorption_probability: float
+            Chance that each desorbing move actually desorbs, to mimic an unreliable tip. Default 1
+        desorption_charge: float
+            Least charge per unit length, in Matrix co-ords, for a move to desorb, i.e. the setpoint current times
+            the time taken to cross the unit (Coulombs). Default 0
+        seed: int or None
+            Seed for the surface and noise generator
+        """
+        super().__init__()
+        self.resolution = resolution
+        self.rpc_latency = rpc_latency
+        self.time_scale = time_scale
+        self.desorption_threshold = desorption_threshold
+        self.desorption_width = desorption_width
+        self.desorption_height = desorption_height
+        self.noise = noise
+        self.defect_density = defect_density
+        self.drift_velocity = np.asarray(drift_velocity, dtype=float)
+        self.viable_fraction = viable_fraction
+        self.coarse_step_time = coarse_step_time
+        self.approach_time = approach_time
+        self.desorption_probability = desorption_probability
+        self.desorption_charge = desorption_charge
+        self.rng = np.random.default_rng(seed)
+
+        self.clock = 0.0
+        self.is_connected = False
+        self.is_running = True
+
+        self._voltage = -2.0
+        self._setpoint = 100e-12
+        self._raster_time = raster_time
+        self._points = resolution
+        self._return_to_stored_position = True
+
+        self._move_from = np.zeros(2)
+        self._move_to = np.zeros(2)
+        self._move_started = 0.0
+        self._move_duration = 0.0
+
+        self.is_retracted = False
+        self.coarse_position = (0, 0)
+        self.surface = self._make_surface()
+        self.desorbed = np.zeros((resolution, resolution), dtype=bool)
+        self.is_viable = True
+        self._areas = {self.coarse_position: (self.surface, self.desorbed, self.is_viable)}
+
+    def _make_surface(self, is_viable=True):
+        yy, xx = np.mgrid[0:self.resolution, 0:self.resolution] / self.resolution
+        plane = 0.3 * xx + 0.2 * yy
+        roughness = self.rng.normal(0, 0.02, (self.resolution, self.resolution))
+        defect_density = self.defect_density
+
+        if not is_viable:
+            # A staircase of step edges across the frame, and far more defects
+            angle = self.rng.uniform(0, np.pi)
+            plane = plane + 0.5 * np.floor(6 * (np.cos(angle) * xx + np.sin(angle) * yy))
+            defect_density = 10 * defect_density
+
+        pits = np.zeros((self.resolution, self.resolution))
+        n_pits = int(defect_density * self.resolution ** 2)
+        pit_rows, pit_cols = self.rng.integers(0, self.resolution, (2, n_pits))
+        for d_row, d_col in np.argwhere(np.ones((5, 5), dtype=bool)) - 2:
+            if d_row ** 2 + d_col ** 2 <= 4:
+                pits[(pit_rows + d_row) % self.resolution, (pit_cols + d_col) % self.resolution] = -0.3
+        return plane + roughness + pits
+
+    def sample_offset(self):
+        """How far the sample has drifted under the scan frame so far, as (columns, rows) (pixels)"""
+        return self.drift_velocity * self.clock
+
+    def _wait(self, seconds):
+        self.clock += seconds
+        if self.time_scale:
+            sleep(seconds * self.time_scale)
+
+    def _count(self):
+        super()._count()
+        if self.rpc_latency:
+            self._wait(self.rpc_latency)
+
+    def _param(self, name, value):
+        self._count()
+        if value is None:
+            return getattr(self, name)
+        setattr(self, name, value)
+
+    def _position(self):
+        if self._move_duration <= 0:
+            return self._move_to.copy()
+        progress = np.clip((self.clock - self._move_started) / self._move_duration, 0, 1)
+        return self._move_from + progress * (self._move_to - self._move_from)
+
+    def tip_position(self):
+        """Current position of the virtual tip, interpolated along any move in progress"""
+        self._count()
+        return self._position()
+
+    def move_duration(self, start, target):
+        """Time the tip takes to travel between two positions at the current raster time (Seconds)"""
+        distance_px = np.linalg.norm(np.asarray(target) - np.asarray(start)) / 2 * self._points
+        return distance_px * self._raster_time
+
+    def connect(self):
+        self._count()
+        self.is_connected = True
+
+    def voltage(self, value=None):
+        return self._param("_voltage", value)
+
+    def setpoint(self, value=None):
+        return self._param("_setpoint", value)
+
+    def raster_time(self, value=None):
+        return self._param("_raster_time", value)
+
+    def points(self, value=None):
+        return self._param("_points", value)
+
+    def return_to_stored_position(self, value):
+        return self._param("_return_to_stored_position", value)
+
+    def move_tip(self, target):
+        self._count()
+        start = self._position()
+        target = np.clip(np.asarray(target, dtype=float), -1, 1)
+
+        charge_per_unit = self._setpoint * self._raster_time * self._points / 2
+        if (self._voltage >= self.desorption_threshold and charge_per_unit >= self.desorption_charge
+                and (self.desorption_probability >= 1 or self.rng.uniform() < self.desorption_probability)):
+            self._desorb_line(start, target)
+
+        self._move_from = start
+        self._move_to = target
+        self._move_started = self.clock
+        self._move_duration = self.move_duration(start, target)
+
+    def _desorb_line(self, start, target):
+        """Marks every pixel within half a line width of the segment as desorbed"""
+        offset = self.sample_offset()
+        p0, p1 = mtrx2px(start, self.resolution) - offset, mtrx2px(target, self.resolution) - offset
+        radius = self.desorption_width / 2
+
+        lo = np.maximum(np.floor(np.minimum(p0, p1) - radius), 0).astype(int)
+        hi = np.minimum(np.ceil(np.maximum(p0, p1) + radius) + 1, self.resolution).astype(int)
+        rows, cols = np.mgrid[lo[1]:hi[1], lo[0]:hi[0]]
+        pixels = np.stack([cols, rows], axis=-1).astype(float)
+
+        segment = p1 - p0
+        length_sq = segment @ segment
+        if length_sq == 0:
+            t = np.zeros(pixels.shape[:-1])
+        else:
+            t = np.clip((pixels - p0) @ segment / length_sq, 0, 1)
+        nearest = p0 + t[..., None] * segment
+        within = np.linalg.norm(pixels - nearest, axis=-1) <= radius
+
+        self.desorbed[lo[1]:hi[1], lo[0]:hi[0]] |= within
+
+    def get_xy_scan(self, channel="Z", direction="Forward-Backward", trace="Up", window=None):
+        lines = [line for _, line in self.iter_xy_scan_lines(channel, direction, trace, window=window)]
+        return np.stack(lines, axis=1)
+
+    def iter_xy_scan_lines(self, channel="Z", direction="Forward-Backward", trace="Up", window=None):
+        self._count()
+        if channel != "Z":
+            raise NotImplementedError("Only the Z channel is simulated")
+
+        # Finish any move in progress before scanning
+        self._wait(max(self._move_started + self._move_duration - self.clock, 0))
+
+        if window is None:
+            window = (0, 0, self.resolution, self.resolution)
+        col_min, row_min, col_max, row_max = window
+
+        n_directions = 2 if direction == "Forward-Backward" else 1
+        line_time = n_directions * (col_max - col_min) * self._raster_time
+
+        cols = np.arange(col_min, col_max)
+        rows = range(row_max - row_min) if trace != "Down" else range(row_max - row_min - 1, -1, -1)
+        for i, row in enumerate(rows):
+            self._wait(line_time)
+            # The sample has drifted under the frame, which wraps round at the edges
+            d_col, d_row = np.round(self.sample_offset()).astype(int)
+            sample_row = (row_min + row - d_row) % self.resolution
+            sample_cols = (cols - d_col) % self.resolution
+            line = self.surface[sample_row, sample_cols] \
+                + self.desorption_height * self.desorbed[sample_row, sample_cols]
+            yield i, np.stack([line + self.rng.normal(0, self.noise, len(cols)) for _ in range(n_directions)])
+
+    def get_preview_scan(self, points=64, channel="Z"):
+        self._count()
+        if channel != "Z":
+            raise NotImplementedError("Only the Z channel is simulated")
+        self._wait(max(self._move_started + self._move_duration - self.clock, 0))
+        self._wait(points * points * self._raster_time)
+
+        d_col, d_row = np.round(self.sample_offset()).astype(int)
+        pixels = np.round(np.linspace(0, self.resolution - 1, points)).astype(int)
+        sample_rows = (pixels[:, None] - d_row) % self.resolution
+        sample_cols = (pixels[None, :] - d_col) % self.resolution
+        image = self.surface[sample_rows, sample_cols] \
+            + self.desorption_height * self.desorbed[sample_rows, sample_cols]
+        return image + self.rng.normal(0, self.noise, image.shape)
+
+    def retract(self):
+        self._count()
+        self.is_retracted = True
+
+    def coarse_move(self, direction, steps=1):
+        moves = {"x_plus": (1, 0), "x_minus": (-1, 0), "y_plus": (0, 1), "y_minus": (0, -1)}
+        if direction not in moves:
+            raise ValueError(f"Unknown coarse move direction {direction}")
+        if not self.is_retracted:
+            raise RuntimeError("Retract the tip before coarse moving")
+        for _ in range(steps):
+            self._count()
+            self._wait(self.coarse_step_time)
+            self.coarse_position = (self.coarse_position[0] + moves[direction][0],
+                                    self.coarse_position[1] + moves[direction][1])
+
+    def approach(self):
+        """Approaches onto the area under the current coarse position, making it the first time it is visited"""
+        self._count()
+        self._wait(self.approach_time)
+        if self.coarse_position not in self._areas:
+            is_viable = self.rng.uniform() < self.viable_fraction
+            self._areas[self.coarse_position] = (self._make_surface(is_viable),
+                                                 np.zeros((self.resolution, self.resolution), dtype=bool), is_viable)
+        self.surface, self.desorbed, self.is_viable = self._areas[self.coarse_position]
+        self.is_retracted = False
+
+    def stop_experiment(self):
+        self._count()
+        self.is_running = False
+
+    def resume_experiment(self):
+        self._count()
+        self.is_running = True
+
+    def sleep(self, seconds):
+        self._wait(seconds)
+
+    def time(self):
+        return self.clock
@@ -1,16 +1,21 @@
 import os
-import tensorflow as tf
 
 from SIMPLE.utils.agents import Agent
 from SIMPLE.utils.files import load_model
 from SIMPLE.utils.register import get_environment
 from SIMPLE.utils.selfplay import selfplay_wrapper
 
+_LEARNED_OPPONENT_TYPES = ("best", "mostly_best", "random", "base")
 
-os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 
-tf.get_logger().setLevel('INFO')
-tf.compat.v1.logging.set_verbosity(tf.compat.v1.logging.ERROR)
+def _quiet_tensorflow():
+    """Imports TensorFlow with its logging turned down. Only done once a learned agent is asked for, so games
+    between rule based or human players never import it"""
+    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+    import tensorflow as tf
+
+    tf.get_logger().setLevel('INFO')
+    tf.compat.v1.logging.set_verbosity(tf.compat.v1.logging.ERROR)
 
 
 class SelfPlayTester:
@@ -49,6 +54,9 @@ class SelfPlayTester:
         self._setup_env()
 
     def _setup_env(self):
+        if "zip" in self.player_1_type or self.player_2_type in _LEARNED_OPPONENT_TYPES:
+            _quiet_tensorflow()
+
         base_env = get_environment("tictactoe")
         self.env = selfplay_wrapper(base_env)(opponent_type=self.player_2_type, first_player=self.first_player,
                                               render_mode=self.render_mode,
@@ -77,6 +85,41 @@ class SelfPlayTester:
     def reset(self):
         self.env.reset()
 
+    def snapshot(self, serialisable=False):
+        """Returns the game state, so a speculative step can be undone with restore
+
+        With `serialisable`, the board is given as token numbers and everything else as plain ints and bools, e.g.
+        to save to a checkpoint
+        """
+        state = {"board": list(self.env.board),
+                 "current_player_num": self.env.current_player_num,
+                 "turns_taken": self.env.turns_taken,
+                 "done": self.env.done,
+                 "player_0_last_move": getattr(self.env, "player_0_last_move", None),
+                 "player_1_last_move": getattr(self.env, "player_1_last_move", None),
+                 "is_episode_done": self.is_episode_done}
+        if serialisable:
+            state["board"] = [int(tile.number) for tile in state["board"]]
+            for key in ("current_player_num", "turns_taken", "player_0_last_move", "player_1_last_move"):
+                state[key] = None if state[key] is None else int(state[key])
+            for key in ("done", "is_episode_done"):
+                state[key] = bool(state[key])
+        return state
+
+    def restore(self, state):
+        """Restores a state from snapshot, whose board may be given as tokens or as token numbers"""
+        self.is_episode_done = state["is_episode_done"]
+        token_type = type(self.env.players[0].token)
+        tokens = {0: token_type(".", 0), **{player.token.number: player.token for player in self.env.players}}
+        self.env.board = [tokens[tile] if isinstance(tile, int) else tile for tile in state["board"]]
+        for key in ("current_player_num", "turns_taken", "done", "player_0_last_move", "player_1_last_move"):
+            setattr(self.env, key, state[key])
+
+    @property
+    def opponent_last_move(self):
+        """Square the opponent last played, whichever player they are, or None if they haven't played yet"""
+        return getattr(self.env, f"player_{1 - self.env.agent_player_num}_last_move", None)
+
     def step(self, action=None):
         if self.auto_render:
             self.env.render()
@@ -89,6 +132,25 @@ class SelfPlayTester:
         if self.is_episode_done and self.auto_render:
             self.env.render()
 
+    def step_agent(self, action):
+        """Plays only the agent's `action`, as the first half of step, leaving the opponent to step_opponent"""
+        self.play_move(action)
+
+    def play_move(self, action):
+        """Plays `action` for whichever player is to move, without the opponent replying, e.g. to catch up with a
+        move already made on the sample"""
+        _, _, self.is_episode_done, _ = super(type(self.env), self.env).step(action)
+
+    def step_opponent(self):
+        """Plays the opponent's reply to the agent's last move, as the second half of step"""
+        if self.is_episode_done:
+            return
+        observation, _, done, _ = self.env.continue_game()
+        if observation is not None:
+            self.is_episode_done = done
+        if self.is_episode_done and self.auto_render:
+            self.env.render()
+
 
 if __name__ == '__main__':
     game = SelfPlayTester()
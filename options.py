@@ -0,0 +1,160 @@
+import copy
+import os
+
+from dose import DoseOptimiser
+
+
+class _Options:
+    def replace(self, **changes):
+        """A copy with `changes` made, e.g. for one of several boards"""
+        unknown = set(changes) - set(vars(self))
+        if unknown:
+            raise TypeError(f"{type(self).__name__} has no options {sorted(unknown)}")
+        options = copy.copy(self)
+        vars(options).update(changes)
+        return options
+
+
+class InstrumentOptions(_Options):
+    def __init__(self, optimise_paths=True, dose_optimiser: DoseOptimiser = None, roi_scans=True, roi_margin=16,
+                 stream_scans=False, track_drift=False, verify_pieces=False, max_redraws=2, check_area=False,
+                 cache_parameters=True, median_mode="histogram"):
+        """How STMTicTacToe draws, scans and checks each piece on the instrument
+
+        Parameters
+        ----------
+        optimise_paths: bool
+            Reorder and merge the moves of each piece to minimise tip travel before drawing (default, True)
+        dose_optimiser: DoseOptimiser or None
+            Picks the raster time of each move of a piece from the dose needed to desorb at desorption_bias and
+            desorption_current, reporting the time saved. None (default) draws every move at t_raster. Redraws of
+            segments that didn't desorb are always at t_raster
+        roi_scans: bool
+            After each move only rescan around the new piece, stitching into the last full frame (default, True)
+        roi_margin: int
+            Padding around each piece for region of interest scans (pixels). Default 16
+        stream_scans: bool
+            Preprocess scans line by line as they are acquired (see binarisation.StreamingPreprocessing), or only
+            once the whole scan has arrived (default). Either gives the same binarised forward scan
+        track_drift: bool
+            Measure how far the sample has drifted since the first scan from each new scan (see drift.DriftTracker),
+            and draw the following pieces that much further over. Off by default, so pieces are drawn where asked
+        verify_pieces: bool
+            Check each piece desorbed by matching it against its scan, and redraw any segments that didn't, up to
+            `max_redraws` times. Off by default, as it draws on the sample again
+        max_redraws: int
+            Most times the segments of a piece that didn't desorb are redrawn. Default 2
+        check_area: bool
+            On each reset, preview the area and coarse move until a flat one is found, within the budget of
+            `area_search`, or play wherever the tip is (default). Off unless asked for, as it moves the sample
+        cache_parameters: bool
+            Keep a local copy of the instrument's parameters so unchanged reads and writes skip the round trip (see
+            hardware.backends.CachedBackend) (default, True). A backend that is already a CachedBackend, e.g. one
+            shared between games, is used as it is
+        median_mode: str
+            How the lines of each scan are median aligned before binarising, 'histogram' (default) or 'exact' (see
+            binarisation.ImagePreprocessing._median_offsets)
+        """
+        self.optimise_paths = optimise_paths
+        self.dose_optimiser = dose_optimiser
+        self.roi_scans = roi_scans
+        self.roi_margin = roi_margin
+        self.stream_scans = stream_scans
+        self.track_drift = track_drift
+        self.verify_pieces = verify_pieces
+        self.max_redraws = max_redraws
+        self.check_area = check_area
+        self.cache_parameters = cache_parameters
+        self.median_mode = median_mode
+
+    def serialisable(self):
+        """The options as a dict that can be saved as JSON, e.g. to a recording, with the settings of the dose
+        optimiser in place of it"""
+        options = dict(vars(self))
+        if self.dose_optimiser is not None:
+            options["dose_optimiser"] = {key: value for key, value in vars(self.dose_optimiser).items()
+                                         if key != "history"}
+        return options
+
+    @classmethod
+    def from_serialisable(cls, options: dict):
+        """Options as saved by serialisable"""
+        options = dict(options)
+        if options.get("dose_optimiser") is not None:
+            options["dose_optimiser"] = DoseOptimiser(**options["dose_optimiser"])
+        return cls(**options)
+
+
+class ReadingOptions(_Options):
+    def __init__(self, board_reader=None, classifier=None, class_tokens=(0, 1, -1), max_rereads=2):
+        """How STMTicTacToe reads the board back from each scan, to check it before committing to the opponent's
+        speculatively computed reply
+
+        Parameters
+        ----------
+        board_reader: callable or None
+            Maps a binarised scan to the token number (1, -1 or 0) of each of the 9 squares. If it disagrees with the
+            game, the reply is discarded and the cross scanned again on the next step, up to `max_rereads` times.
+            None (default) skips the check
+        classifier: model.classify.EnsembleClassifier or None
+            Classifier, with its models loaded, to read the board back from each scan with CNN_assess. If given and
+            board_reader is None, CNN_assess is used as the board_reader. None (default) reads nothing
+        class_tokens: tuple of int
+            Token number (1, -1 or 0) of each of the classifier's categories, in order. Default (0, 1, -1), i.e.
+            empty, cross, nought
+        max_rereads: int
+            Most times the cross is scanned again before carrying on regardless. Default 2
+        """
+        self.board_reader = board_reader
+        self.classifier = classifier
+        self.class_tokens = class_tokens
+        self.max_rereads = max_rereads
+
+
+class OutputOptions(_Options):
+    def __init__(self, recorder=None, trace_dir=None, checkpoint=None, checkpoint_every=1, video_fps=None,
+                 max_queued_frames=8, drop_frames=False):
+        """What STMTicTacToe saves of each game, besides the figures saved to `savefig`
+
+        Parameters
+        ----------
+        recorder: recording.SessionRecorder or None
+            Records every scan acquired, drawn path, parameter set and decision of the session for later replay (see
+            replay.py). None (default) records nothing
+        trace_dir: str or None
+            If set, time each phase of every turn (see tracing.Tracer) and save those of each game to
+            `<trace_dir>/trace_game<n>.json` in the Chrome trace format and `<trace_dir>/turns_game<n>.csv` at its end,
+            where n numbers the games traced in this process, tracing only while a game is played. Default None
+        checkpoint: str or None
+            File to atomically save the game, preprocessor, drift and image of the board to every `checkpoint_every`
+            turns, so that after a crash the game can be carried on with resume. Each piece is also noted in a
+            journal, `<checkpoint>.queued`, before it is drawn, so resume can look for pieces drawn since the last
+            checkpoint. None (default) saves nothing
+        checkpoint_every: int
+            Turns between checkpoints. Each is saved on the instrument lane once the turn's pieces are drawn and
+            scanned, so the game doesn't wait for it. Default 1
+        video_fps: float or None
+            If set, also save each game's figures as a video at this frame rate (see rendering.FrameWriter). Default
+            None
+        max_queued_frames: int
+            Most figures waiting to be saved at once. Default 8
+        drop_frames: bool
+            Drop figures rather than wait for the disk when that many are waiting. Default False
+        """
+        self.recorder = recorder
+        self.trace_dir = trace_dir
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
+        self.video_fps = video_fps
+        self.max_queued_frames = max_queued_frames
+        self.drop_frames = drop_frames
+
+    def for_board(self, i: int):
+        """A copy saving board `i` of several played at once to `<trace_dir>/board_<i>/` and `<checkpoint>_board_<i>`
+
+        Raises ValueError if set to record, as the scans of several boards can't be told apart in one session"""
+        if self.recorder is not None:
+            raise ValueError("Sessions of several boards at once can't be recorded")
+        root, ext = os.path.splitext(self.checkpoint) if self.checkpoint else (None, None)
+        return self.replace(trace_dir=os.path.join(self.trace_dir, f"board_{i}") if self.trace_dir else None,
+                            checkpoint=f"{root}_board_{i}{ext}" if self.checkpoint else None)
@@ -0,0 +1,79 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from tracing import tracer
+
+
+class TurnPipeline:
+    def __init__(self, is_threaded=True, n_host_workers=2):
+        """Overlaps host-side work with instrument time
+
+        Work is submitted to one of three lanes. The instrument lane has a single worker so hardware operations
+        run one at a time in submission order. The preprocessing lane also has a single worker so images are
+        preprocessed in the order they were acquired. The host lane runs anything else, such as policy inference,
+        in parallel. Everything returns a `concurrent.futures.Future`.
+
+        Parameters
+        ----------
+        is_threaded: bool
+            Run work on worker threads (default, True), or immediately in the calling thread
+        n_host_workers: int
+            Number of workers in the host lane. Default 2
+        """
+        self.is_threaded = is_threaded
+        self._instrument = None
+        self._preprocessing = None
+        self._host = None
+
+        if self.is_threaded:
+            self._instrument = ThreadPoolExecutor(max_workers=1, thread_name_prefix="instrument")
+            self._preprocessing = ThreadPoolExecutor(max_workers=1, thread_name_prefix="preprocessing")
+            self._host = ThreadPoolExecutor(max_workers=n_host_workers, thread_name_prefix="host")
+
+    @staticmethod
+    def run_now(fn, *args, **kwargs):
+        """Runs work in the calling thread, returning a completed future"""
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    @staticmethod
+    def then(future: Future, fn):
+        """Returns a future for `fn` applied to the result of `future`, run by whichever thread completes it"""
+        chained = Future()
+
+        def _chain(done):
+            try:
+                chained.set_result(fn(done.result()))
+            except Exception as e:
+                chained.set_exception(e)
+
+        future.add_done_callback(_chain)
+        return chained
+
+    def _submit(self, executor, fn, *args, **kwargs):
+        if executor is None:
+            return self.run_now(fn, *args, **kwargs)
+        if tracer.enabled:
+            # Label the work's spans with the game and turn that queued it, not whichever is in progress when it runs
+            return executor.submit(tracer.run_labelled, tracer.label(), fn, *args, **kwargs)
+        return executor.submit(fn, *args, **kwargs)
+
+    def instrument(self, fn, *args, **kwargs):
+        """Queues hardware work behind all previously queued hardware work"""
+        return self._submit(self._instrument, fn, *args, **kwargs)
+
+    def preprocessing(self, fn, *args, **kwargs):
+        """Queues image processing behind all previously queued image processing"""
+        return self._submit(self._preprocessing, fn, *args, **kwargs)
+
+    def host(self, fn, *args, **kwargs):
+        """Runs host-side work as soon as a worker is free"""
+        return self._submit(self._host, fn, *args, **kwargs)
+
+    def shutdown(self, wait=True):
+        for executor in (self._instrument, self._preprocessing, self._host):
+            if executor is not None:
+                executor.shutdown(wait=wait)
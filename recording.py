@@ -0,0 +1,239 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+from hardware.backends import MicroscopeBackend
+
+
+class SessionRecorder:
+    def __init__(self, directory, chunk_size=16):
+        """Appends everything that happens in an STM session to an archive on disk
+
+        Arrays are written into chunked, memory-mapped .npy files, one series of chunks per stream (e.g.
+        'raw_scans'). Every event is appended as a line of `index.jsonl`, pointing at any array rows it wrote.
+        Nothing is ever rewritten, so a crash loses at most the event in progress. Events may be recorded from any
+        thread, e.g. scans as the instrument acquires them (see RecordingBackend)
+
+        Parameters
+        ----------
+        directory: str
+            Directory to write the archive to. Created if needed, and appended to if it already holds an archive
+        chunk_size: int
+            Number of arrays per .npy chunk. Default 16
+        """
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self._chunks = {}
+        self._lock = threading.Lock()
+        self.step = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        index_path = os.path.join(self.directory, "index.jsonl")
+        if os.path.exists(index_path):
+            # Carry on numbering from the last event already in the archive
+            with open(index_path) as f:
+                lines = [line for line in f if line.strip()]
+            if lines:
+                self.step = json.loads(lines[-1])["step"] + 1
+        self._index = open(index_path, "a")
+
+    def _append_array(self, stream, arr):
+        """Writes `arr` into the next free row of the stream's current chunk, starting a new chunk when it is full
+        or the array shape changes"""
+        arr = np.asarray(arr)
+        chunk = self._chunks.get(stream)
+        if chunk is None or chunk["row"] == self.chunk_size or chunk["data"].shape[1:] != arr.shape \
+                or chunk["data"].dtype != arr.dtype:
+            number = 0 if chunk is None else chunk["number"] + 1
+            filename = f"{stream}_{number:05d}.npy"
+            while os.path.exists(os.path.join(self.directory, filename)):
+                number += 1
+                filename = f"{stream}_{number:05d}.npy"
+            data = np.lib.format.open_memmap(os.path.join(self.directory, filename), mode="w+", dtype=arr.dtype,
+                                             shape=(self.chunk_size,) + arr.shape)
+            chunk = self._chunks[stream] = {"number": number, "filename": filename, "data": data, "row": 0}
+
+        chunk["data"][chunk["row"]] = arr
+        chunk["data"].flush()
+        chunk["row"] += 1
+        return {"file": chunk["filename"], "row": chunk["row"] - 1}
+
+    def _write_event(self, kind, arrays=None, **fields):
+        """Appends an event, first writing each of `arrays`, {field: (stream, array)}, and pointing `field` at it"""
+        with self._lock:
+            for field, (stream, arr) in (arrays or {}).items():
+                fields[field] = self._append_array(stream, arr)
+            event = {"step": self.step, "kind": kind, **fields}
+            self._index.write(json.dumps(event) + "\n")
+            self._index.flush()
+            self.step += 1
+
+    def record_parameters(self, parameters: dict):
+        self._write_event("parameters", parameters=parameters)
+
+    def record_decision(self, player: str, action):
+        self._write_event("decision", player=player, action=None if action is None else int(action))
+
+    def record_piece(self, piece, offset=(0, 0)):
+        """Records the DataShape path of a piece as it is queued to be drawn, and the `offset` (index co-ords) it
+        was moved by to follow drift"""
+        self._write_event("piece", shape=piece.object_shape, offset=np.asarray(offset, dtype=float).tolist(),
+                          positions=np.asarray(piece.positions).tolist(), desorb=np.asarray(piece.desorb).tolist())
+
+    def record_scan(self, raw_scan, binarised_scan, label=None):
+        """Records a scan as rendered, with its binarised image"""
+        self._write_event("scan", label=label,
+                          arrays={"raw": ("raw_scans", raw_scan), "binarised": ("binarised_scans", binarised_scan)})
+
+    def record_acquisition(self, method: str, data, **details):
+        """Records a scan as the instrument acquired it, whether or not it was rendered
+
+        Parameters
+        ----------
+        method: str
+            'scan' for get_xy_scan and iter_xy_scan_lines, or 'preview' for get_preview_scan
+        data: ndarray
+            The scan, with its lines top to bottom
+        **details
+            What was asked for, e.g. the window and direction of the scan, or the points of the preview
+        """
+        self._write_event("acquisition", method=method, **details, arrays={"data": ("acquisitions", data)})
+
+    def close(self):
+        with self._lock:
+            for chunk in self._chunks.values():
+                chunk["data"].flush()
+            self._chunks = {}
+            self._index.close()
+
+
+class SessionArchive:
+    def __init__(self, directory):
+        """Reads an archive written by SessionRecorder, memory-mapping arrays rather than loading them"""
+        self.directory = directory
+        self._files = {}
+        with open(os.path.join(self.directory, "index.jsonl")) as f:
+            self.events = [json.loads(line) for line in f if line.strip()]
+
+    def _load(self, ref):
+        if ref["file"] not in self._files:
+            self._files[ref["file"]] = np.load(os.path.join(self.directory, ref["file"]), mmap_mode="r")
+        return self._files[ref["file"]][ref["row"]]
+
+    def of_kind(self, kind):
+        return [event for event in self.events if event["kind"] == kind]
+
+    def scans(self):
+        """Yields (raw_scan, binarised_scan) in the order they were recorded"""
+        for event in self.of_kind("scan"):
+            yield self._load(event["raw"]), self._load(event["binarised"])
+
+    def acquisitions(self):
+        """Every scan the instrument acquired, as (event, data) in the order they were acquired"""
+        return [(event, self._load(event["data"])) for event in self.of_kind("acquisition")]
+
+    def decisions(self, player):
+        return [event["action"] for event in self.of_kind("decision") if event["player"] == player]
+
+    def opening(self):
+        """The opponent's first move, if they moved before the agent, or None"""
+        decisions = self.of_kind("decision")
+        if decisions and decisions[0]["player"] == "player_1":
+            return decisions[0]["action"]
+        return None
+
+
+class RecordingBackend(MicroscopeBackend):
+    def __init__(self, backend: MicroscopeBackend, recorder: SessionRecorder):
+        """Wraps a backend, recording every scan it acquires with `recorder`, so the session can be replayed scan for
+        scan (see replay.ReplayBackend)
+
+        That includes the scans never rendered, e.g. of regions of interest, of redrawn segments and the previews of
+        the area search. Scans taken with trace 'Down' are recorded with their lines top to bottom, as those taken
+        'Up'
+
+        Parameters
+        ----------
+        backend: MicroscopeBackend
+            Backend to forward calls to
+        recorder: SessionRecorder
+            Recorder to append the scans to
+        """
+        self.backend = backend
+        self.recorder = recorder
+        self.supports_position_readback = backend.supports_position_readback
+
+    @property
+    def n_calls(self):
+        return self.backend.n_calls
+
+    def _record_scan(self, scan, direction, trace, window):
+        scan = np.asarray(scan)
+        if trace == "Down":
+            scan = scan[:, ::-1]
+        self.recorder.record_acquisition("scan", scan, direction=direction, trace=trace,
+                                         window=None if window is None else [int(bound) for bound in window])
+
+    def connect(self):
+        return self.backend.connect()
+
+    def voltage(self, value=None):
+        return self.backend.voltage(value)
+
+    def setpoint(self, value=None):
+        return self.backend.setpoint(value)
+
+    def raster_time(self, value=None):
+        return self.backend.raster_time(value)
+
+    def points(self, value=None):
+        return self.backend.points(value)
+
+    def return_to_stored_position(self, value):
+        return self.backend.return_to_stored_position(value)
+
+    def move_tip(self, target):
+        return self.backend.move_tip(target)
+
+    def tip_position(self):
+        return self.backend.tip_position()
+
+    def get_xy_scan(self, channel="Z", direction="Forward-Backward", trace="Up", window=None):
+        scan = self.backend.get_xy_scan(channel, direction, trace, window=window)
+        self._record_scan(scan, direction, trace, window)
+        return scan
+
+    def iter_xy_scan_lines(self, channel="Z", direction="Forward-Backward", trace="Up", window=None):
+        lines = []
+        for i, line in self.backend.iter_xy_scan_lines(channel, direction, trace, window=window):
+            lines.append(np.array(line))
+            yield i, line
+        self._record_scan(np.stack(lines, axis=1), direction, trace, window)
+
+    def get_preview_scan(self, points=64, channel="Z"):
+        scan = self.backend.get_preview_scan(points, channel)
+        self.recorder.record_acquisition("preview", scan, points=points)
+        return scan
+
+    def retract(self):
+        return self.backend.retract()
+
+    def coarse_move(self, direction, steps=1):
+        return self.backend.coarse_move(direction, steps)
+
+    def approach(self):
+        return self.backend.approach()
+
+    def stop_experiment(self):
+        return self.backend.stop_experiment()
+
+    def resume_experiment(self):
+        return self.backend.resume_experiment()
+
+    def sleep(self, seconds):
+        return self.backend.sleep(seconds)
+
+    def time(self):
+        return self.backend.time()
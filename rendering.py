@@ -0,0 +1,273 @@
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import warnings
+from time import perf_counter
+
+import numpy as np
+from PIL import Image
+from matplotlib import pyplot as plt
+
+try:
+    from nOmicron.utils.plotting import nanomap
+except ImportError:  # Simulated runs don't need nOmicron installed
+    nanomap = "afmhot"
+
+import utils
+
+
+class BoardRenderer:
+    def __init__(self, env, resolution=512, frame_budget=0.1):
+        """Four panel figure of the game board, desorption paths, STM image and binarised STM image
+
+        Every artist is made once here and then only has its data updated, and each frame only redraws the panels
+        that changed, by blitting where the canvas supports it
+
+        Parameters
+        ----------
+        env: TicTacToeEnv
+            The game being played, whose board is shown in the first panel
+        resolution: int
+            Size of the index co-ord space the desorption paths are drawn in
+        frame_budget: float
+            Warn if a frame takes longer than this to render (Seconds). Default 0.1
+        """
+        self.env = env
+        self.resolution = resolution
+        self.frame_budget = frame_budget
+        self.frame_times = []
+
+        self.fig, self.axs = plt.subplots(1, 4)
+        self.fig.set_size_inches(16, 6)
+
+        self.axs[0].set_title("Game Board")
+        self.axs[1].set_title("Desorption Path")
+        self.axs[2].set_title("STM Image")
+        self.axs[3].set_title("Binarised STM Image")
+
+        for i in range(4):
+            self.axs[i].set_xticks([])
+            self.axs[i].set_yticks([])
+
+        self.env._make_axis(ax=self.axs[0])
+        self.env.fig = self.fig
+        self.env.xplot.set_linestyle('None')
+        self.env.oplot.set_linestyle('None')
+
+        self.desorb_line, = self.axs[1].plot([], [], 'g')
+        self.move_line, = self.axs[1].plot([], [], 'r')
+        self.axs[1].set_xlim(0, resolution)
+        self.axs[1].set_ylim(0, resolution)
+        self.axs[1].invert_xaxis()
+        self.axs[1].set_aspect('equal', adjustable='box')
+        self._desorb_segments = np.empty((0, 2))
+        self._move_segments = np.empty((0, 2))
+
+        self.scan_image = self.axs[2].imshow(np.zeros((2, 2)), cmap=nanomap)
+        self.binary_image = self.axs[3].imshow(np.zeros((2, 2)), cmap=utils.rabanimap, vmin=0, vmax=2)
+
+        self._artists = {0: [self.env.xplot, self.env.oplot], 1: [self.desorb_line, self.move_line],
+                         2: [self.scan_image], 3: [self.binary_image]}
+        for artists in self._artists.values():
+            for artist in artists:
+                artist.set_animated(self.fig.canvas.supports_blit)
+
+        self._backgrounds = None
+        self.fig.canvas.mpl_connect("draw_event", self._on_draw)
+        plt.pause(0.01)
+
+    def _on_draw(self, event):
+        """Captures the static parts of each panel whenever the whole figure is redrawn, e.g. on resize"""
+        if event is not None and event.canvas is not self.fig.canvas:  # e.g. from savefig
+            return
+        if self.fig.canvas.supports_blit:
+            self._backgrounds = [self.fig.canvas.copy_from_bbox(ax.bbox) for ax in self.axs]
+            for i in self._artists:
+                self._draw_panel(i)
+
+    def _draw_panel(self, i):
+        for artist in self._artists[i]:
+            self.axs[i].draw_artist(artist)
+
+    @staticmethod
+    def _segments(positions, mask):
+        """Joins the segments ending on each masked point into one polyline, separated by NaNs"""
+        ends = np.flatnonzero(mask[1:]) + 1
+        segments = np.full((len(ends), 3, 2), np.nan)
+        segments[:, 0] = positions[ends - 1]
+        segments[:, 1] = positions[ends]
+        return segments.reshape(-1, 2)
+
+    def update_board(self, board=None):
+        """Shows `board`, the token number of each square, or if None the env's board"""
+        if board is None:
+            board = [tile.number for tile in self.env.board]
+        board = np.asarray(board).reshape(self.env.grid_shape).T
+        x_to_plot = np.argwhere(board == 1)
+        o_to_plot = np.argwhere(board == -1)
+        self.env.xplot.set_data(x_to_plot[:, 0], x_to_plot[:, 1])
+        self.env.oplot.set_data(o_to_plot[:, 0], o_to_plot[:, 1])
+
+    def update_piece(self, piece):
+        """Adds the path of a newly drawn piece to the desorption path panel"""
+        positions = np.asarray(piece.positions, dtype=float)
+        desorb = np.asarray(piece.desorb, dtype=bool)
+        self._desorb_segments = np.concatenate([self._desorb_segments, self._segments(positions, desorb)])
+        self._move_segments = np.concatenate([self._move_segments, self._segments(positions, ~desorb)])
+        self.desorb_line.set_data(self._desorb_segments[:, 0], self._desorb_segments[:, 1])
+        self.move_line.set_data(self._move_segments[:, 0], self._move_segments[:, 1])
+
+    def update_scan(self, scan_data):
+        scan_data = np.fliplr(scan_data)
+        self.scan_image.set_data(scan_data)
+        self.scan_image.set_extent((-0.5, scan_data.shape[1] - 0.5, scan_data.shape[0] - 0.5, -0.5))
+        self.scan_image.set_clim(np.min(scan_data), np.max(scan_data))
+
+    def update_binarised(self, binary_data):
+        """Shows a binarised scan, returning False and leaving the panel as it was if `binary_data` isn't one, e.g.
+        the raw scan while binarisation is turned off"""
+        binary_data = np.asarray(binary_data)
+        if binary_data.dtype != bool:
+            return False
+        if binary_data.ndim == 3:
+            binary_data = binary_data[0]
+        self.binary_image.set_data(binary_data)
+        self.binary_image.set_extent((-0.5, binary_data.shape[1] - 0.5, binary_data.shape[0] - 0.5, -0.5))
+        return True
+
+    def render(self, scan_data=None, binary_data=None, piece=None, board=None):
+        """Updates the panels that have new data and redraws only those, showing `board` if given rather than the
+        env's board, e.g. while the env is being stepped on another thread
+
+        Returns
+        -------
+        frame_time: float
+            Time taken to render the frame (Seconds)
+        """
+        start = perf_counter()
+
+        changed = [0]
+        self.update_board(board)
+        if piece is not None:
+            self.update_piece(piece)
+            changed.append(1)
+        if scan_data is not None:
+            self.update_scan(scan_data)
+            changed.append(2)
+        if binary_data is not None and self.update_binarised(binary_data):
+            changed.append(3)
+
+        canvas = self.fig.canvas
+        if canvas.supports_blit and self._backgrounds is not None:
+            for i in changed:
+                canvas.restore_region(self._backgrounds[i])
+                self._draw_panel(i)
+                canvas.blit(self.axs[i].bbox)
+            canvas.flush_events()
+        else:
+            canvas.draw_idle()
+            canvas.flush_events()
+
+        frame_time = perf_counter() - start
+        self.frame_times.append(frame_time)
+        if frame_time > self.frame_budget:
+            warnings.warn(f"Rendering took {frame_time:.3f}s, over the {self.frame_budget:.3f}s budget")
+        return frame_time
+
+
+class FrameWriter:
+    def __init__(self, directory, max_queued=8, drop_when_full=False, video_fps=None, video_name="game.mp4"):
+        """Saves frames to disk on a worker thread, so rendering never waits on encoding or disk I/O
+
+        Frames wait in a bounded queue. When it is full, `put_*` blocks until there is space (backpressure), or
+        drops the frame if `drop_when_full`
+
+        Parameters
+        ----------
+        directory: str
+            Directory to save frames to. Created if needed
+        max_queued: int
+            Most frames waiting to be written at once. Default 8
+        drop_when_full: bool
+            Drop frames rather than wait when the queue is full. Default False
+        video_fps: float or None
+            If set, also stream figure frames into `video_name` at this frame rate through ffmpeg, which is only
+            finished once the writer is closed. Default None
+        video_name: str
+            File name of the video in `directory`. Default 'game.mp4'
+        """
+        self.directory = directory
+        self.drop_when_full = drop_when_full
+        self.video_fps = video_fps
+        self.video_name = video_name
+        self.n_written = 0
+        self.n_dropped = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._video = None
+        if self.video_fps is not None and shutil.which("ffmpeg") is None:
+            warnings.warn("ffmpeg not found, not writing a video")
+            self.video_fps = None
+
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._worker = threading.Thread(target=self._work, name="frame-writer", daemon=True)
+        self._worker.start()
+
+    def _put(self, item):
+        try:
+            self._queue.put(item, block=not self.drop_when_full)
+        except queue.Full:
+            self.n_dropped += 1
+
+    def put_figure(self, fig, name):
+        """Queues the figure's RGBA buffer, as last rendered, to be saved as `<name>.png`"""
+        rgba = np.array(fig.canvas.buffer_rgba())
+        self._put(("png", name, rgba))
+
+    def put_array(self, arr, name):
+        """Queues an array, e.g. a raw scan, to be saved as `<name>.npy`"""
+        self._put(("npy", name, np.array(arr)))
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                kind, name, data = item
+                if kind == "png":
+                    Image.fromarray(data).save(os.path.join(self.directory, f"{name}.png"))
+                    if self.video_fps is not None:
+                        self._write_video_frame(data)
+                else:
+                    np.save(os.path.join(self.directory, f"{name}.npy"), data)
+                self.n_written += 1
+            except Exception as e:
+                warnings.warn(f"Failed to write frame: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _write_video_frame(self, rgba):
+        if self._video is None:
+            height, width = rgba.shape[:2]
+            self._video = subprocess.Popen(
+                ["ffmpeg", "-y", "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", "rgba",
+                 "-s", f"{width}x{height}", "-r", str(self.video_fps), "-i", "-",
+                 "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-pix_fmt", "yuv420p",
+                 os.path.join(self.directory, self.video_name)], stdin=subprocess.PIPE)
+        self._video.stdin.write(rgba.tobytes())
+
+    def flush(self):
+        """Waits until everything queued so far has been written"""
+        self._queue.join()
+
+    def close(self):
+        """Writes everything still queued and finishes the video, then stops the worker"""
+        self._queue.put(None)
+        self._worker.join()
+        if self._video is not None:
+            self._video.stdin.close()
+            self._video.wait()
+            self._video = None
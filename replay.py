@@ -0,0 +1,117 @@
+import numpy as np
+
+from hardware.simulated import SimulatedBackend
+from options import InstrumentOptions
+from recording import SessionArchive
+from stm_control import STMTicTacToe
+
+
+class ReplayBackend(SimulatedBackend):
+    def __init__(self, archive: SessionArchive, **kwargs):
+        """Simulated microscope whose scans are the ones recorded by a RecordingBackend, served in the order they
+        were acquired
+
+        Every scan must be asked for as it was recorded, the same window for scans and the same points for previews,
+        else the replay has gone out of sync with the session and a RuntimeError is raised. Keyword arguments are
+        passed on to SimulatedBackend, which still handles timing and the virtual tip
+        """
+        self.archive = archive
+        self._acquisitions = archive.acquisitions()
+        full_frames = [data for event, data in self._acquisitions
+                       if event["method"] == "scan" and event["window"] is None]
+        if not full_frames:
+            raise ValueError(f"No full frame scans were recorded in {archive.directory} to replay")
+        super().__init__(resolution=full_frames[0].shape[-1], **kwargs)
+        self.n_replayed = 0
+
+    def _next_acquisition(self, method, **details):
+        if self.n_replayed >= len(self._acquisitions):
+            raise RuntimeError("No recorded scans left to replay")
+        event, data = self._acquisitions[self.n_replayed]
+        requested = {"method": method, **details}
+        recorded = {key: event.get(key) for key in requested}
+        if recorded != requested:
+            raise RuntimeError(f"Replay is out of sync with the recording: asked for {requested}, but acquisition "
+                               f"{self.n_replayed} was {recorded}")
+        self.n_replayed += 1
+        return data
+
+    def iter_xy_scan_lines(self, channel="Z", direction="Forward-Backward", trace="Up", window=None):
+        recording = self._next_acquisition("scan", direction=direction,
+                                           window=None if window is None else [int(bound) for bound in window])
+        n_lines = recording.shape[1]
+
+        # Keep the simulated timing, but hand back the recorded lines, which are stored top to bottom
+        for i, _ in super().iter_xy_scan_lines(channel, direction, trace, window=window):
+            row = i if trace != "Down" else n_lines - 1 - i
+            yield i, np.array(recording[:, row, :])
+
+    def get_preview_scan(self, points=64, channel="Z"):
+        super().get_preview_scan(points, channel)
+        return np.array(self._next_acquisition("preview", points=points))
+
+
+class ReplayAgent:
+    def __init__(self, actions):
+        """Plays back recorded actions in place of a SIMPLE Agent"""
+        self.name = "replay"
+        self.actions = list(actions)
+
+    def choose_action(self, env, choose_best_action, mask_invalid_actions):
+        return self.actions.pop(0)
+
+
+class ReplaySTMTicTacToe(STMTicTacToe):
+    def __init__(self, archive: SessionArchive, time_scale=0.0, **kwargs):
+        """Replays a recorded session through STMTicTacToe at full speed, using the recorded scans and decisions
+
+        Both players are played by their recorded decisions, so no models are loaded, and whoever moved first in the
+        session moves first again. Each piece is moved by the drift offset it was drawn with in the session, which
+        depends on how far the instrument had got when it was queued, so that it is scanned where it was. The
+        pieces are drawn and scanned with the recorded InstrumentOptions, so that the same scans are asked for.
+        Keyword arguments override the recorded STMTicTacToe parameters, e.g. to compare pipeline options with
+        `instrument=recorded_instrument_options(archive).replace(stream_scans=True)`
+        """
+        self.archive = archive
+        self.opening = archive.opening()
+        parameters = archive.of_kind("parameters")[0]["parameters"]
+        parameters.update({"player_1_type": "rules", "player_2_type": "rules",
+                           "first_player": "player_1" if self.opening is None else "player_2",
+                           "instrument": recorded_instrument_options(archive)})
+        parameters.update(kwargs)
+        super().__init__(backend=ReplayBackend(archive, time_scale=time_scale), **parameters)
+
+    def reset(self):
+        self._piece_offsets = [event["offset"] for event in self.archive.of_kind("piece")]
+        super().reset()
+        opponent_actions = [action for action in self.archive.decisions("player_1") if action is not None]
+        if self.opening is not None:
+            self._replay_opening(opponent_actions.pop(0))
+
+        self.game.player_0 = ReplayAgent(self.archive.decisions("player_0"))
+        opponent = ReplayAgent(opponent_actions)
+        self.game.env.agents = [None if agent is None else opponent for agent in self.game.env.agents]
+
+    def _queue_piece(self, object_shape: str, action: int, offset=None):
+        return super()._queue_piece(object_shape, action, offset=np.array(self._piece_offsets.pop(0)))
+
+    def _replay_opening(self, action):
+        """Moves the opponent's first move, made as the env was reset, to where it was made in the session"""
+        state = self.game.snapshot(serialisable=True)
+        played = self.game.opponent_last_move
+        state["board"][played], state["board"][action] = state["board"][action], state["board"][played]
+        state[f"player_{1 - self.game.env.agent_player_num}_last_move"] = action
+        self.game.restore(state)
+
+
+def recorded_instrument_options(archive: SessionArchive):
+    """The InstrumentOptions the session was recorded with, or the defaults for archives that predate them"""
+    instrument = archive.of_kind("parameters")[0]["parameters"].get("instrument")
+    return InstrumentOptions() if instrument is None else InstrumentOptions.from_serialisable(instrument)
+
+
+def replay_session(directory, time_scale=0.0, **kwargs):
+    """Replays the session recorded in `directory`, returning the game"""
+    game = ReplaySTMTicTacToe(SessionArchive(directory), time_scale=time_scale, **kwargs)
+    game.play_game()
+    return game
@@ -0,0 +1,76 @@
+import numpy as np
+
+import utils
+from hardware.backends import MicroscopeBackend
+from shapes.shapes import DataShape
+
+
+class BoardScanCache:
+    def __init__(self, backend: MicroscopeBackend, margin=16):
+        """Keeps a full-frame image of the board up to date by only rescanning around newly drawn pieces
+
+        Parameters
+        ----------
+        backend: MicroscopeBackend
+            Microscope to scan with
+        margin: int
+            Padding around the bounding box of each piece (pixels)
+        """
+        self.backend = backend
+        self.margin = margin
+        self.resolution = None
+        self.image = None
+
+    def full_scan(self):
+        """Rescans the whole frame, replacing the cached image"""
+        self.image = utils.get_scan(self.backend)
+        self.resolution = self.image.shape[-1]
+        return self.image
+
+    def roi_window(self, piece: DataShape):
+        """Pixel bounds (col_min, row_min, col_max, row_max) of the piece in the scan, padded by the margin"""
+        px_points = utils.mtrx2px(piece.mtrx_positions, self.resolution)
+
+        lo = np.maximum(np.floor(px_points.min(axis=0)) - self.margin, 0).astype(int)
+        hi = np.minimum(np.ceil(px_points.max(axis=0)) + self.margin + 1, self.resolution).astype(int)
+        return lo[0], lo[1], hi[0], hi[1]
+
+    def update(self, piece: DataShape):
+        """Scans only around `piece` and stitches the result into the cached image
+
+        Returns
+        -------
+        image: ndarray
+            The full-frame image in the shape (no_directions, lines, points)
+        """
+        if self.image is None:
+            return self.full_scan().copy()
+
+        col_min, row_min, col_max, row_max = window = self.roi_window(piece)
+        roi = utils.get_scan(self.backend, window=window)
+        self.image[:, row_min:row_max, col_min:col_max] = roi
+
+        return self.image.copy()
+
+    def iter_update(self, piece: DataShape):
+        """As update, but yields (line_index, line) of the full-frame image in order as the scan progresses
+
+        Lines outside the region of interest are yielded straight from the cache
+        """
+        if self.image is None:
+            lines = []
+            for i, line in utils.iter_scan_lines(self.backend):
+                lines.append(line)
+                yield i, line
+            self.image = np.stack(lines, axis=1)
+            self.resolution = self.image.shape[-1]
+            return
+
+        col_min, row_min, col_max, row_max = window = self.roi_window(piece)
+        for i in range(row_min):
+            yield i, self.image[:, i, :].copy()
+        for i, roi_line in utils.iter_scan_lines(self.backend, window=window):
+            self.image[:, row_min + i, col_min:col_max] = roi_line
+            yield row_min + i, self.image[:, row_min + i, :].copy()
+        for i in range(row_max, self.resolution):
+            yield i, self.image[:, i, :].copy()
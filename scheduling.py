@@ -0,0 +1,151 @@
+import os
+import warnings
+from concurrent.futures import FIRST_COMPLETED, wait
+from time import perf_counter
+
+import numpy as np
+
+import utils
+from hardware.backends import CachedBackend, MicroscopeBackend, NOmicronBackend
+from options import InstrumentOptions, OutputOptions
+from pipeline import TurnPipeline
+from scanning import BoardScanCache
+from stm_control import STMTicTacToe
+from viability import AreaSearch
+
+
+def board_layout(n_boards: int, resolution=512, piece_scale=0.75, piece_inset=None):
+    """Lays out `n_boards` boards on a square grid of cells across the scan area, filling it row by row
+
+    Returns
+    -------
+    geometries: list of utils.BoardGeometry
+        Geometry of each board, scaled to fit its cell and centred on it
+    """
+    n_side = int(np.ceil(np.sqrt(n_boards)))
+    centres = -1 + (2 * np.arange(n_side) + 1) / n_side
+    return [utils.board_geometry(resolution=resolution, piece_scale=piece_scale / n_side, piece_inset=piece_inset,
+                                 origin=(centres[i % n_side], centres[i // n_side]))
+            for i in range(n_boards)]
+
+
+class MultiBoardScheduler:
+    def __init__(self, n_boards, scan_bias, scan_setpoint, desorption_bias, desorption_current, t_raster,
+                 raster_points, backend: MicroscopeBackend = None, render_mode=None, savefig=None, pipelined=True,
+                 instrument: InstrumentOptions = None, output: OutputOptions = None, **game_kwargs):
+        """Plays several games at once on one tip, each on its own board in a different part of the scan area
+
+        Every game queues its hardware work on one shared pipeline, and plays its turns as STMTicTacToe.turn, so that
+        while one game waits on the tip or the host (choosing a move, preprocessing, rendering) the others carry on
+        and queue their pieces behind its own. The instrument lane so always has the next board's piece to draw or
+        scan. All boards share one cached image of the scan area, so only one full frame is ever scanned, and, if
+        instrument.check_area, one area, found by `area_search` before each set of games
+
+        Parameters
+        ----------
+        n_boards: int
+            Number of games to play at once
+        scan_bias, scan_setpoint, desorption_bias, desorption_current, t_raster, raster_points
+            As for STMTicTacToe
+        backend: MicroscopeBackend or None
+            Microscope to play on. Either None (default) for the real instrument through nOmicron, or e.g. a
+            hardware.simulated.SimulatedBackend
+        render_mode: str or None
+            How to render each game. One of 'plot', 'print', None (default)
+        savefig: str or None
+            If set, each game saves its figures to `<savefig>/board_<i>/`. Default None
+        pipelined: bool
+            Overlap the games' host work with the instrument (default, True)
+        instrument: InstrumentOptions or None
+            How every game draws, scans and checks its pieces, or None (default) for the defaults. Its roi_margin
+            pads the shared scans and, if cache_parameters, one local copy of the instrument's parameters is shared by
+            every game. If check_area, the area is checked once for all of them
+        output: OutputOptions or None
+            What each game saves, to its own `board_<i>` (see OutputOptions.for_board), or None (default) for nothing
+        **game_kwargs
+            Passed to each STMTicTacToe, e.g. player types
+        """
+        instrument = instrument if instrument is not None else InstrumentOptions()
+        output = output if output is not None else OutputOptions()
+        self.backend = backend if backend is not None else NOmicronBackend()
+        if instrument.cache_parameters and not isinstance(self.backend, CachedBackend):
+            self.backend = CachedBackend(self.backend)
+        self.geometries = board_layout(n_boards)
+        self.pipeline = TurnPipeline(is_threaded=pipelined, n_host_workers=max(2, n_boards))
+        self.scans = BoardScanCache(self.backend, margin=instrument.roi_margin)
+        self.games_per_hour = None
+        self.area_search = AreaSearch() if instrument.check_area else None
+        self.n_sessions = 0
+
+        self.games = [STMTicTacToe(scan_bias, scan_setpoint, desorption_bias, desorption_current, t_raster,
+                                   raster_points, render_mode=render_mode,
+                                   savefig=os.path.join(savefig, f"board_{i}") if savefig else None,
+                                   backend=self.backend, pipelined=pipelined, geometry=geometry,
+                                   pipeline=self.pipeline, scan_cache=self.scans,
+                                   instrument=instrument.replace(check_area=False), output=output.for_board(i),
+                                   **game_kwargs)
+                      for i, geometry in enumerate(self.geometries)]
+
+    def play_games(self):
+        """Plays every game to the end, carrying on whichever games aren't waiting on the tip or the host
+
+        Returns
+        -------
+        games_per_hour: float
+            Throughput of the session
+        """
+        start = perf_counter()
+        if isinstance(self.backend, CachedBackend):
+            self.backend.reset_stats()
+        self.backend.stop_experiment()
+        if self.area_search is not None and not self.area_search.find(self.backend, move_first=self.n_sessions > 0):
+            warnings.warn("No viable game area found within the search budget! Playing here anyway")
+        self.n_sessions += 1
+
+        self.scans.image = None
+        for game in self.games:
+            game.reset()
+
+        # Each game plays up to the next future its turn waits on, and is carried on once that is done
+        turns = {game: game.turn() for game in self.games}
+        waiting = {}
+        for game in self.games:
+            self._carry_on(game, turns, waiting)
+        while waiting:
+            done, _ = wait(waiting, return_when=FIRST_COMPLETED)
+            for future in done:
+                self._carry_on(waiting.pop(future), turns, waiting)
+
+        elapsed = perf_counter() - start
+        self.games_per_hour = len(self.games) / elapsed * 3600
+        print(f"Played {len(self.games)} games in {elapsed:.1f}s ({self.games_per_hour:.1f} games per hour)")
+        if isinstance(self.backend, CachedBackend):
+            print(f"Hardware parameters: {self.backend.summary()}")
+        return self.games_per_hour
+
+    @staticmethod
+    def _carry_on(game: STMTicTacToe, turns: dict, waiting: dict):
+        """Plays `game` until its turn next waits on a future, noting it in `waiting`, starting its next turn as each
+        ends and finishing it once the game is over"""
+        while True:
+            future = next(turns[game], None)
+            if future is not None:
+                waiting[future] = game
+                return
+            if game.game.is_episode_done:
+                game.finish_game()
+                del turns[game]
+                return
+            turns[game] = game.turn()
+
+    def shutdown(self):
+        self.pipeline.shutdown()
+
+
+if __name__ == '__main__':
+    scheduler = MultiBoardScheduler(4, scan_bias=-2.25, scan_setpoint=250e-12,
+                                    desorption_bias=4.2, desorption_current=1.5e-9,
+                                    t_raster=20e-3, raster_points=512,
+                                    player_1_type="rules", player_2_type="rules")
+    scheduler.play_games()
+    scheduler.shutdown()
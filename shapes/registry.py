@@ -0,0 +1,63 @@
+import ast
+import json
+
+import numpy as np
+
+
+class CompiledShape(object):
+    def __init__(self, name: str, datafile: dict):
+        """A shape parsed once into arrays, shared read-only between every DataShape drawing it
+
+        Parameters
+        ----------
+        name: str
+            Name of the shape, e.g. 'cross'
+        datafile: dict
+            The parsed shapes/data/<name>.json
+        """
+        self.name = name
+        self.size = datafile["size"]
+        self.centre_offset = np.array(datafile["centre_offset"])
+
+        all_points = datafile["all_points"]
+        self.positions = np.array([point["datapoint"] for point in all_points]).reshape(-1, 2)
+        self.desorb = np.array([ast.literal_eval(point["desorb"]) for point in all_points], dtype=bool)
+
+        is_outside = np.any(self.positions < 0, axis=1) | np.all(self.positions > self.size, axis=1)
+        if np.any(is_outside):
+            raise LookupError(f"Point is outside bounds of shape {name}: {self.positions[is_outside].tolist()}")
+
+        for arr in (self.centre_offset, self.positions, self.desorb):
+            arr.flags.writeable = False
+
+        self._mtrx_positions = {}
+
+    def mtrx_positions(self, geometry):
+        """Unscaled Matrix co-ords of the points, scaled by the geometry's shape_scale, for a utils.BoardGeometry,
+        computed once per resolution and shape scale
+
+        Matrix co-ords are affine in the index co-ords, so any centre offset is later just a shift of these
+        """
+        key = (geometry.resolution, geometry.shape_scale)
+        if key not in self._mtrx_positions:
+            mtrx_positions = geometry.ind2mtrx(self.positions * geometry.shape_scale)
+            mtrx_positions.flags.writeable = False
+            self._mtrx_positions[key] = mtrx_positions
+        return self._mtrx_positions[key]
+
+
+_library = {}
+
+
+def load_shape(name: str, shape_directory="shapes/data/"):
+    """Returns the compiled shape, only reading its file the first time it is asked for"""
+    key = (shape_directory, name)
+    if key not in _library:
+        with open(f"{shape_directory}{name}.json") as f:
+            _library[key] = CompiledShape(name, json.load(f))
+    return _library[key]
+
+
+def clear_library():
+    """Forgets every compiled shape, so edited shape files are read again"""
+    _library.clear()
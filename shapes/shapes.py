@@ -1,14 +1,15 @@
+import copy
 import warnings
-from time import sleep
 
 import numpy as np
 from typing import Tuple
-import json
-from matplotlib import pyplot as plt
-import ast
-from nOmicron.mate import objects as mo
 
-from utils import ind2mtrx
+from hardware.backends import get_backend
+from hardware.motion import MoveWaiter
+from shapes.registry import load_shape
+from shapes.trajectory import optimise_path, path_travel
+from tracing import traced
+from utils import BoardGeometry, board_geometry, ind2mtrx
 
 
 class DataPoint(object):
@@ -17,63 +18,120 @@ class DataPoint(object):
         self.desorb_on_approach = desorb_on_approach
         self.piece_scale = 0.75
 
-    def move_to_point(self, desorb_voltage, desorb_current, t_raster, points):
+    @property
+    def mtrx_pos(self):
+        """Position of the point in Matrix co-ords, scaled to the piece size"""
+        return np.array((ind2mtrx(self.pos))) * self.piece_scale
+
+    @traced("move_to_point")
+    def move_to_point(self, desorb_voltage, desorb_current, t_raster, points, backend=None, waiter=None):
+        if backend is None:
+            backend = get_backend()
+
         # Store old parameters
-        old_voltage = mo.gap_voltage_control.Voltage()
-        old_current = mo.regulator.Setpoint_1()
-        old_raster = mo.xy_scanner.Raster_Time()
+        old_voltage = backend.voltage()
+        old_current = backend.setpoint()
+        old_raster = backend.raster_time()
 
         # Prep for movement
-        new_raster = t_raster * points / mo.xy_scanner.Points()
-        mo.xy_scanner.Raster_Time(new_raster)
+        new_raster = t_raster * points / backend.points()
+        backend.raster_time(new_raster)
         if self.desorb_on_approach:
-            mo.gap_voltage_control.Voltage(desorb_voltage)
-            mo.regulator.Setpoint_1(desorb_current)
+            backend.voltage(desorb_voltage)
+            backend.setpoint(desorb_current)
 
-        # Do movement
-        target_pos = np.array((ind2mtrx(self.pos)))
-        mo.xy_scanner.Target_Position(list(target_pos * self.piece_scale))
-        mo.xy_scanner.move()
-
-        sleep(1.3 * t_raster * points)
+        self.move(t_raster, points, backend, waiter=waiter)
 
         # Reset
-        mo.gap_voltage_control.Voltage(old_voltage)
-        mo.regulator.Setpoint_1(old_current)
-        mo.xy_scanner.Raster_Time(old_raster)
-
-
-class DataShape(object):
-    def __init__(self, object_shape: str, centre_offset=[0, 0], shape_directory="shapes/data/"):
-        self.shape_directory = shape_directory
-        self.object_shape = object_shape
+        backend.voltage(old_voltage)
+        backend.setpoint(old_current)
+        backend.raster_time(old_raster)
 
-        self.datafile = None
+    def move(self, t_raster, points, backend, waiter=None, start=None):
+        """Moves the tip to this point with whatever parameters are currently set on the microscope
 
-        self.centre_offset = np.array(centre_offset)
-        self.size = None
-        self.datapoints = []
+        Returns
+        -------
+        waited: float
+            Time spent waiting for the move to finish (Seconds)
+        """
+        if waiter is None:
+            waiter = MoveWaiter()
 
-        self.load_file()
-        self.prepare()
+        target_pos = self.mtrx_pos
+        backend.move_tip(target_pos)
 
-    def load_file(self):
-        with open(f"{self.shape_directory}{self.object_shape}.json") as f:
-            self.datafile = json.load(f)
+        return waiter.wait(backend, target_pos, t_raster, points, start=start)
 
-    def prepare(self):
-        self.centre_offset += self.datafile["centre_offset"]
-        self.size = self.datafile["size"]
-        for point in self.datafile["all_points"]:
-            if np.any(np.array(point["datapoint"]) < 0) or np.all(np.array(point["datapoint"]) > self.size):
-                raise LookupError("Point is outside bounds of shape")
-            self._add_datapoint(point["datapoint"], ast.literal_eval(point["desorb"]))
 
-    def _add_datapoint(self, xy: np.ndarray, desorb_on_approach: bool):
-        self.datapoints.append(DataPoint(xy + self.centre_offset, desorb_on_approach))
+class DataShape(object):
+    def __init__(self, object_shape: str, centre_offset=[0, 0], shape_directory="shapes/data/",
+                 geometry: BoardGeometry = None):
+        """A view of a compiled shape (see shapes.registry) placed at `centre_offset`
+
+        The path is held as arrays: `positions` (no_points, 2) in index co-ords, `desorb` (no_points,) and
+        `mtrx_positions` (no_points, 2), the scaled Matrix co-ords the tip is moved to. These are laid out by
+        `geometry`, by default that of the 3x3 board
+        """
+        self.shape_directory = shape_directory
+        self.object_shape = object_shape
+        self.geometry = geometry if geometry is not None else board_geometry()
+
+        self.compiled = load_shape(object_shape, shape_directory)
+
+        self.centre_offset = np.array(centre_offset) + self.compiled.centre_offset
+        self.size = self.compiled.size
+
+        self.positions = self.compiled.positions * self.geometry.shape_scale + self.centre_offset
+        self.desorb = self.compiled.desorb
+        mtrx_offset = self.geometry.ind2mtrx(self.centre_offset) - self.geometry.ind2mtrx(np.zeros(2))
+        self.mtrx_positions = self.geometry.to_scan(self.compiled.mtrx_positions(self.geometry) + mtrx_offset)
+        self.draw_time = None
+        self.path_time = None
+
+    @classmethod
+    def on_action(cls, object_shape: str, action: int, geometry: BoardGeometry = None, offset=(0, 0), **kwargs):
+        """Places the shape on the board square of `action`, moved by `offset` (index co-ords), e.g. to follow drift"""
+        geometry = geometry if geometry is not None else board_geometry()
+        return cls(object_shape, centre_offset=geometry.action2ind(action) + np.asarray(offset), geometry=geometry,
+                   **kwargs)
+
+    @property
+    def datapoints(self):
+        """The path as DataPoint objects, built on demand"""
+        return [DataPoint(pos, is_desorbing) for pos, is_desorbing in zip(self.positions, self.desorb)]
+
+    def optimise_path(self):
+        """Merges collinear desorbing moves and reorders strokes to minimise non-desorbing travel"""
+        new_positions, new_desorb = optimise_path(self.positions, self.desorb)
+
+        _, old_travel = path_travel(self.positions, self.desorb)
+        _, new_travel = path_travel(new_positions, new_desorb)
+        print(f"Optimised {self.object_shape} path from {len(self.positions)} to {len(new_positions)} points, "
+              f"non-desorbing travel {old_travel:.0f} -> {new_travel:.0f}")
+
+        self.positions = new_positions
+        self.desorb = new_desorb
+        self.mtrx_positions = self.geometry.to_scan(self.geometry.ind2mtrx(self.positions))
+
+    def segment_ends(self):
+        """Indices of the points that end each desorbing segment, i.e. segment i runs from point i - 1 to point i"""
+        return np.flatnonzero(self.desorb[1:]) + 1
+
+    def with_segments(self, ends):
+        """A copy of the shape that only draws the desorbing segments ending at `ends`, e.g. to redraw them"""
+        ends = np.asarray(ends, dtype=int)
+        order = np.stack([ends - 1, ends], axis=1).ravel()
+
+        piece = copy.copy(self)
+        piece.positions = self.positions[order]
+        piece.desorb = np.tile([False, True], len(ends))
+        piece.mtrx_positions = self.mtrx_positions[order]
+        return piece
 
     def _make_axs(self, ax):
         if not ax:
+            from matplotlib import pyplot as plt
             fig, ax = plt.subplots(1, 1)
             ax.set_title(self.object_shape)
         padding = self.size // 50
@@ -84,21 +142,92 @@ class DataShape(object):
 
         return ax
 
-    def draw_in_stm(self, desorb_voltage, desorb_current, t_raster, points):
+    @traced("draw_in_stm")
+    def draw_in_stm(self, desorb_voltage, desorb_current, t_raster, points, backend=None, waiter=None,
+                    t_rasters=None):
+        """Draws the whole path, only switching between scan and desorption parameters when needed
+
+        Parameters are read once before drawing and restored once afterwards, rather than around every point. The
+        time drawing took on the backend's clock is kept in `draw_time`, and the time from the tip reaching the first
+        point in `path_time`
+
+        Parameters
+        ----------
+        t_rasters: ndarray or None
+            Raster time of the move into each point, e.g. from dose.DoseOptimiser.plan. None (default) moves at
+            t_raster throughout
+
+        Returns
+        -------
+        n_calls: int
+            Number of hardware calls made while drawing
+        """
+        if backend is None:
+            backend = get_backend()
+        if waiter is None:
+            waiter = MoveWaiter()
+
         # mo.experiment.stop()
         print(f"Drawing {self.object_shape}")
-        for datapoint in self.datapoints:
-            datapoint.move_to_point(desorb_voltage, desorb_current, t_raster, points)
+        calls_before = backend.n_calls
+        started = backend.time()
+
+        # Store old parameters
+        old_voltage = backend.voltage()
+        old_current = backend.setpoint()
+        old_raster = backend.raster_time()
+
+        t_rasters = np.full(len(self.desorb), t_raster) if t_rasters is None else np.asarray(t_rasters)
+        scan_points = backend.points()
+        move_t_raster = t_rasters[0]
+        backend.raster_time(move_t_raster * points / scan_points)
+
+        is_desorbing = False
+        n_move_calls = 0
+        total_waited = 0.0
+        start = None
+        for target, desorb_on_approach, next_t_raster in zip(self.mtrx_positions, self.desorb, t_rasters):
+            if desorb_on_approach != is_desorbing:
+                is_desorbing = desorb_on_approach
+                backend.voltage(desorb_voltage if is_desorbing else old_voltage)
+                backend.setpoint(desorb_current if is_desorbing else old_current)
+            if next_t_raster != move_t_raster:
+                move_t_raster = next_t_raster
+                backend.raster_time(move_t_raster * points / scan_points)
+            move_calls_before = backend.n_calls
+            backend.move_tip(target)
+            total_waited += waiter.wait(backend, target, move_t_raster, points, start=start)
+            if start is None:
+                reached_first_point = backend.time()
+            start = target
+            n_move_calls += backend.n_calls - move_calls_before
+
+        # Reset
+        if is_desorbing:
+            backend.voltage(old_voltage)
+            backend.setpoint(old_current)
+        backend.raster_time(old_raster)
         # mo.experiment.resume()
+        finished = backend.time()
+
+        n_calls = backend.n_calls - calls_before
+        # DataPoint.move_to_point makes 8 parameter calls per point, plus 2 more when desorbing
+        n_calls_per_point = n_move_calls + 8 * len(self.desorb) + 2 * np.count_nonzero(self.desorb)
+        print(f"Drew {self.object_shape} in {n_calls} hardware calls ({n_calls_per_point} if set per point)")
+        wait_saved = len(self.desorb) * waiter.fixed_wait(t_raster, points) - total_waited
+        print(f"Waited {total_waited:.2f}s for moves to finish, saving {wait_saved:.2f}s over fixed waits")
+        self.draw_time = finished - started
+        self.path_time = finished - reached_first_point
+        return n_calls
 
     def plot(self, ax=None):
         if ax is None:
             ax = self._make_axs(ax)
 
-        for i in range(len(self.datapoints) - 1):
-            xs = np.array([self.datapoints[i].pos[0], self.datapoints[i + 1].pos[0]]) + self.centre_offset[0]
-            ys = np.array([self.datapoints[i].pos[1], self.datapoints[i + 1].pos[1]]) + self.centre_offset[1]
-            if self.datapoints[i + 1].desorb_on_approach:
+        for i in range(len(self.positions) - 1):
+            xs = self.positions[i:i + 2, 0] + self.centre_offset[0]
+            ys = self.positions[i:i + 2, 1] + self.centre_offset[1]
+            if self.desorb[i + 1]:
                 ax.plot(xs, ys, 'g')
             else:
                 ax.plot(xs, ys, 'r')
@@ -0,0 +1,134 @@
+import numpy as np
+
+
+def split_strokes(positions: np.ndarray, desorb: np.ndarray):
+    """Splits a path into strokes, each a run of desorbing moves starting from the point before them
+
+    Non-desorbing moves only reposition the tip, so they are dropped here and re-added when the strokes are joined.
+    A desorbing move onto the first point comes from wherever the tip was, so it starts the first stroke there
+    """
+    strokes = []
+    stroke = None
+    for pos, is_desorbing in zip(positions, desorb):
+        if is_desorbing:
+            if stroke is None:
+                stroke = [pos]
+            else:
+                stroke.append(pos)
+        else:
+            if stroke is not None and len(stroke) > 1:
+                strokes.append(np.array(stroke))
+            stroke = [pos]
+    if stroke is not None and len(stroke) > 1:
+        strokes.append(np.array(stroke))
+
+    return strokes
+
+
+def merge_collinear(stroke: np.ndarray, tol=1e-6):
+    """Removes interior points of a stroke that continue in the same direction as the move before them"""
+    if len(stroke) < 3:
+        return stroke
+
+    before = stroke[1:-1] - stroke[:-2]
+    after = stroke[2:] - stroke[1:-1]
+    cross = before[:, 0] * after[:, 1] - before[:, 1] * after[:, 0]
+    dot = np.sum(before * after, axis=1)
+    scale = np.linalg.norm(before, axis=1) * np.linalg.norm(after, axis=1)
+
+    is_redundant = (np.abs(cross) <= tol * scale) & (dot > 0)
+    keep = np.concatenate([[True], ~is_redundant, [True]])
+    return stroke[keep]
+
+
+def _travel(strokes, order, reverse, start):
+    ends = [(strokes[i][::-1] if r else strokes[i])[[0, -1]] for i, r in zip(order, reverse)]
+    travel = np.linalg.norm(ends[0][0] - start)
+    for (_, end), (next_start, _) in zip(ends[:-1], ends[1:]):
+        travel += np.linalg.norm(next_start - end)
+    return travel
+
+
+def order_strokes(strokes, start):
+    """Orders and orients strokes to minimise the travel between them
+
+    Uses a nearest neighbour tour from `start` improved with 2-opt, where reversing a run of strokes also
+    reverses the direction each is drawn in
+
+    Returns
+    -------
+    order: list of int
+        Indices into `strokes` in drawing order
+    reverse: list of bool
+        Whether each stroke in `order` should be drawn backwards
+    """
+    remaining = list(range(len(strokes)))
+    order, reverse = [], []
+    pos = start
+    while remaining:
+        dists = [(np.linalg.norm(strokes[i][0] - pos), i, False) for i in remaining] + \
+                [(np.linalg.norm(strokes[i][-1] - pos), i, True) for i in remaining]
+        _, i, is_reversed = min(dists, key=lambda d: d[0])
+        order.append(i)
+        reverse.append(is_reversed)
+        remaining.remove(i)
+        pos = strokes[i][0] if is_reversed else strokes[i][-1]
+
+    best = _travel(strokes, order, reverse, start)
+    is_improved = True
+    while is_improved:
+        is_improved = False
+        for i in range(len(order)):
+            for j in range(i + 1, len(order) + 1):
+                new_order = order[:i] + order[i:j][::-1] + order[j:]
+                new_reverse = reverse[:i] + [not r for r in reverse[i:j][::-1]] + reverse[j:]
+                travel = _travel(strokes, new_order, new_reverse, start)
+                if travel < best - 1e-9:
+                    order, reverse, best = new_order, new_reverse, travel
+                    is_improved = True
+
+    return order, reverse
+
+
+def optimise_path(positions: np.ndarray, desorb: np.ndarray):
+    """Reorders a path to minimise non-desorbing travel while desorbing exactly the same lines
+
+    Parameters
+    ----------
+    positions: ndarray
+        Points of the path in the shape (no_points, 2)
+    desorb: ndarray
+        Whether the move onto each point desorbs, in the shape (no_points,)
+
+    Returns
+    -------
+    positions: ndarray
+        Points of the optimised path
+    desorb: ndarray
+        Desorb flags of the optimised path
+    """
+    positions = np.asarray(positions)
+    desorb = np.asarray(desorb, dtype=bool)
+
+    strokes = [merge_collinear(stroke) for stroke in split_strokes(positions, desorb)]
+    if not strokes:
+        return positions, desorb
+
+    order, reverse = order_strokes(strokes, positions[0])
+
+    new_positions, new_desorb = [], []
+    for i, is_reversed in zip(order, reverse):
+        stroke = strokes[i][::-1] if is_reversed else strokes[i]
+        if not new_positions or np.any(new_positions[-1] != stroke[0]):
+            new_positions.append(stroke[0])
+            new_desorb.append(False)
+        new_positions.extend(stroke[1:])
+        new_desorb.extend([True] * (len(stroke) - 1))
+
+    return np.array(new_positions), np.array(new_desorb)
+
+
+def path_travel(positions: np.ndarray, desorb: np.ndarray):
+    """Total length of the desorbing and non-desorbing moves of a path"""
+    lengths = np.linalg.norm(np.diff(positions, axis=0), axis=1)
+    return np.sum(lengths[desorb[1:]]), np.sum(lengths[~desorb[1:]])
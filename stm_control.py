@@ -1,21 +1,33 @@
+import os
+import uuid
 import warnings
+from concurrent.futures import wait
 
 import numpy as np
-from matplotlib import pyplot as plt
-from nOmicron.mate import objects as mo
-from nOmicron.microscope import IO
-from nOmicron.utils.plotting import nanomap
 
 import utils
-from binarisation import ImagePreprocessing
+from binarisation import ImagePreprocessing, StreamingPreprocessing
+from checkpoint import load_checkpoint, save_checkpoint
+from board_reading import CellReader
+from drift import DriftTracker
+from hardware.backends import CachedBackend, MicroscopeBackend, NOmicronBackend, set_backend
 from model.self_play_test import SelfPlayTester
+from options import InstrumentOptions, OutputOptions, ReadingOptions
+from pipeline import TurnPipeline
+from recording import RecordingBackend
+from scanning import BoardScanCache
 from shapes.shapes import DataShape
+from tracing import traced, tracer
+from verification import DesorptionVerifier
+from viability import AreaSearch
 
 
 class STMTicTacToe:
     def __init__(self, scan_bias, scan_setpoint, desorption_bias, desorption_current, t_raster, raster_points,
                  player_1_type="rules", player_2_type="best", first_player="player_1", render_mode="plot",
-                 savefig=None):
+                 savefig=None, backend: MicroscopeBackend = None, geometry: utils.BoardGeometry = None,
+                 pipeline: TurnPipeline = None, scan_cache: BoardScanCache = None, pipelined=True,
+                 instrument: InstrumentOptions = None, reading: ReadingOptions = None, output: OutputOptions = None):
         """Play noughts and crosses in STM using RL
 
         Parameters
@@ -39,13 +51,48 @@ class STMTicTacToe:
         first_player: str
             Who goes first. One of 'player_1' (default), 'player_2', 'random'
         render_mode: str or None
-            How to render the game. One of 'plot' (default), 'print', None
+            How to render the game. One of 'plot' (default), 'print', None. With None (headless) no figure is made,
+            and matplotlib is never imported unless savefig is set
         savefig: str or None
             If we should save each figure. Either None (default), or a path to a directory
+        backend: MicroscopeBackend or None
+            Microscope to play on. Either None (default) for the real instrument through nOmicron, or e.g. a
+            hardware.simulated.SimulatedBackend
+        geometry: utils.BoardGeometry or None
+            Where the board is laid out in the scan area. None (default) for the 3x3 board filling the scan area
+        pipeline: TurnPipeline or None
+            Lanes to queue work on. Games sharing one tip share one pipeline so their hardware work is queued in turn
+            (see scheduling.MultiBoardScheduler). None (default) makes a new one
+        scan_cache: BoardScanCache or None
+            Image of the scan area to rescan pieces into, shared between games on one tip. None (default) starts a
+            new one on every reset
+        pipelined: bool
+            Preprocess, render and choose moves while the instrument is drawing and scanning (default, True), or
+            run every phase strictly in turn. Ignored if given a pipeline
+        instrument: options.InstrumentOptions or None
+            How pieces are drawn, scanned and checked. None (default) for the defaults
+        reading: options.ReadingOptions or None
+            How the board is read back from each scan. None (default) reads nothing
+        output: options.OutputOptions or None
+            What is saved of each game besides the figures, e.g. recordings, traces and checkpoints. None (default)
+            saves nothing
         """
+        instrument = instrument if instrument is not None else InstrumentOptions()
+        reading = reading if reading is not None else ReadingOptions()
+        output = output if output is not None else OutputOptions()
+        self.instrument_options = instrument
+        self.reading_options = reading
+        self.output_options = output
 
         # Connect to the probe
-        IO.connect()
+        self.backend = backend if backend is not None else NOmicronBackend()
+        self.owns_parameter_cache = instrument.cache_parameters and not isinstance(self.backend, CachedBackend)
+        if output.recorder is not None:
+            self.backend = RecordingBackend(self.backend, output.recorder)
+        if self.owns_parameter_cache:
+            self.backend = CachedBackend(self.backend)
+        set_backend(self.backend)
+        self.backend.connect()
 
         # STM parameters
         self.scan_bias = scan_bias
@@ -54,8 +101,14 @@ class STMTicTacToe:
         self.desorption_current = desorption_current
         self.t_raster = t_raster
         self.raster_points = raster_points
+        self.dose_optimiser = instrument.dose_optimiser
         self.num_coarse_moves_on_reset = 5
-        mo.xy_scanner.Return_To_Stored_Position(False)
+        self.area_search = AreaSearch(coarse_steps=self.num_coarse_moves_on_reset) if instrument.check_area else None
+        self.optimise_paths = instrument.optimise_paths
+        self.geometry = geometry if geometry is not None else utils.board_geometry()
+        self.roi_scans = instrument.roi_scans
+        self.roi_margin = instrument.roi_margin
+        self.backend.return_to_stored_position(False)
 
         # Game parameters
         self.game = None
@@ -66,96 +119,435 @@ class STMTicTacToe:
                           "auto_render": False}
 
         self.preprocessor = None
+        self.scans = None
+        self.pipeline = pipeline if pipeline is not None else TurnPipeline(is_threaded=pipelined)
+        self.scan_cache = scan_cache
+        self.track_drift = instrument.track_drift
+        self.drift_tracker = None
+        self.drift_offset = np.zeros(2)
+        self.verifier = DesorptionVerifier() if instrument.verify_pieces else None
+        self.max_redraws = instrument.max_redraws
+        self.max_rereads = reading.max_rereads
+        self._pending_render = None
+        self._unconfirmed_piece = None
+        self._n_rereads = 0
+        self._last_scan = None
+        self.board_reader = reading.board_reader
+        self.stream_scans = instrument.stream_scans
+        self.recorder = output.recorder
+        self.checkpoint = output.checkpoint
+        self.checkpoint_every = output.checkpoint_every
+        self._checkpoint_saved = None
+        self._game_id = None
+        self._queued_pieces = []
+        self.n_turns = 0
 
         # CNN parameters
         self.cnn_datadir = None
-        # self.
         self.cnn_folder = None
-
-        # self.ensemble_classifier = EnsembleClassifier(5, '29-12-19', ['CNN1DBatchnorm'], ['adam'], [0.001])
-        # self.ensemble_classifier.load_models(rootdir="")
+        self.cell_reader = (CellReader(reading.classifier, self.geometry, reading.class_tokens)
+                            if reading.classifier is not None else None)
+        if self.board_reader is None and self.cell_reader is not None:
+            self.board_reader = self.CNN_assess
 
         # Others
+        self.renderer = None
         self.fig = None
         self.axs = None
         self.savefig = savefig
         self.savefig_step = 0
+        self.frame_writer = None
+        self.trace_dir = output.trace_dir
+        self._trace_game = None
+        self._holding_tracer = False
+        if self.trace_dir:
+            os.makedirs(self.trace_dir, exist_ok=True)
 
     def play_game(self):
         self.reset()
         while not self.game.is_episode_done:
             self.step()
+        self.finish_game()
+
+    def finish_game(self):
+        """Renders the last piece and writes the saved frames and video, once the game is over"""
+        self._wait_through(self._render_pending())
+        if self._checkpoint_saved is not None:
+            self._checkpoint_saved.result()
+        if self.frame_writer is not None:
+            self.frame_writer.close()
+            self.frame_writer = None
+        if self.owns_parameter_cache:
+            print(f"Hardware parameters: {self.backend.summary()}")
+        if self.trace_dir:
+            tracer.write_chrome_trace(os.path.join(self.trace_dir, f"trace_game{self._trace_game}.json"),
+                                      game=self._trace_game)
+            tracer.write_turn_csv(os.path.join(self.trace_dir, f"turns_game{self._trace_game}.csv"),
+                                  game=self._trace_game)
+        tracer.clear(self._trace_game)
+        if self._holding_tracer:
+            tracer.release()
+            self._holding_tracer = False
         self.game._announce_winner()
 
-    def CNN_assess(self):
-        raise NotImplementedError
+    def CNN_assess(self, binarised_scan):
+        """Reads the token number (1, -1 or 0) of each square from the latest binarised scan, classifying every cell
+        in one batch (see board_reading.CellReader)"""
+        if self.cell_reader is None:
+            raise RuntimeError("No classifier was given to read the board with")
+        return self.cell_reader.read(binarised_scan, offset=self.drift_offset)
 
     def step(self):
-        action = self.game.player_0.choose_action(self.game.env, choose_best_action=True, mask_invalid_actions=True)
-
-        cross_move = DataShape("cross", centre_offset=utils.action2ind(action))
-        cross_move.draw_in_stm(self.desorption_bias, self.desorption_current, self.t_raster, self.raster_points)
-        cross_image = utils.get_scan()
-        binarised_cross_image = self.preprocessor.preprocess_and_binarise(cross_image)
-        self.render(cross_image[0, :, :], binarised_cross_image, cross_move)
-
-        self.game.step(action)
+        """Plays one turn, the agent's move and the opponent's reply"""
+        self._wait_through(self.turn())
+
+    def turn(self):
+        """Plays one turn as step does, but as a generator that yields each future it has to wait on rather than
+        waiting on it, e.g. so that scheduling.MultiBoardScheduler can carry on other games meanwhile. Every part of
+        the turn runs in the thread that iterates it, labelled with this game and turn"""
+        tracer.next_turn(self._trace_game)
+        label = tracer.label()
+        turn = self._turn()
+        while True:
+            try:
+                future = tracer.run_labelled(label, next, turn)
+            except StopIteration:
+                return
+            yield future
+
+    @staticmethod
+    def _wait_through(steps):
+        for future in steps:
+            wait((future,))
+
+    def _turn(self):
+        with tracer.span("step"):
+            yield from self._play_turn()
+
+    def _play_turn(self):
+        if self._unconfirmed_piece is None:
+            with tracer.span("choose_action"):
+                action = self.game.player_0.choose_action(self.game.env, choose_best_action=True,
+                                                          mask_invalid_actions=True)
+            cross_turn = self._queue_piece("cross", action)
+            cross = cross_turn[0]
+
+            # The cross is on the sample whatever the board reads back as, so it goes straight into the game
+            self.game.step_agent(action)
+            if self.recorder is not None:
+                self.recorder.record_decision("player_0", action)
+        else:
+            # The board read back wrong last step, so scan the cross again before letting the opponent reply
+            cross = self._unconfirmed_piece
+            cross_turn = self._queue_rescan(cross)
+        state_after_cross = self.game.snapshot()
+        expected_board = np.array([tile.number for tile in self.game.env.board])
+
+        # Speculatively work out the opponent's reply while the cross is still being drawn, so that unless the board
+        # is to be read back first the nought is queued right behind it, before the tip moves off to any other board
+        reply = self.pipeline.host(self._opponent_reply)
+        yield reply
+        nought_action, is_legal = reply.result()
+
+        if self.board_reader is not None:
+            yield from self._render_pending(board=expected_board)
+            yield cross_turn[2]
+            binarised_scan = cross_turn[2].result()
+            with tracer.span("read_board"):
+                read_board = np.asarray(self.board_reader(binarised_scan))
+            if np.any(read_board != expected_board):
+                if self._n_rereads < self.max_rereads:
+                    warnings.warn("Board read back from the scan disagrees with the game! Discarding opponent's "
+                                  "move and scanning again")
+                    self.game.restore(state_after_cross)
+                    self._unconfirmed_piece = cross
+                    self._n_rereads += 1
+                    self._pending_render = cross_turn
+                    return
+                warnings.warn(f"Board still disagrees with the game after {self.max_rereads} rescans! Carrying on")
+        self._unconfirmed_piece = None
+        self._n_rereads = 0
+        if self.recorder is not None:
+            self.recorder.record_decision("player_1", nought_action)
+
+        nought_turn = None
+        if is_legal:
+            nought_turn = self._queue_piece("nought", nought_action)
+
+        # Render the last piece of the previous turn on the board as it was before the reply, then the cross
+        yield from self._render_pending(board=expected_board)
+        self._pending_render = cross_turn
+        yield from self._render_pending()
+        self._pending_render = nought_turn
+
+        self.n_turns += 1
+        if self.checkpoint is not None and self.n_turns % self.checkpoint_every == 0:
+            self.save_checkpoint()
+
+    def _host_unless_plotting(self, fn, *args, **kwargs):
+        """Runs game work on the host lane, unless the env may plot from inside it as matplotlib must stay on the
+        main thread"""
+        if self.game_args["render_mode"] == "plot":
+            return self.pipeline.run_now(fn, *args, **kwargs)
+        return self.pipeline.host(fn, *args, **kwargs)
+
+    @traced("opponent_reply")
+    def _opponent_reply(self):
+        """Plays the opponent's reply to the agent's move in the game
+
+        Run on the host lane, so the env's own plots are turned off meanwhile as matplotlib must stay on the main
+        thread. The renderer draws the board from the game instead
+
+        Returns
+        -------
+        reply: tuple
+            The square the opponent chose, or None if they didn't get to move, and whether it was legal and so is to
+            be drawn. An illegal move loses the opponent the game
+        """
+        if self.game.is_episode_done:
+            return None, False
+
+        env = self.game.env
+        render_mode = env.render_mode
+        if render_mode == "plot":
+            env.render_mode = None
+        try:
+            turns_taken = env.turns_taken
+            self.game.step_opponent()
+        finally:
+            env.render_mode = render_mode
+        return self.game.opponent_last_move, env.turns_taken > turns_taken
+
+    def _queue_piece(self, object_shape: str, action: int, offset=None):
+        """Queues drawing and scanning a piece on the instrument, and preprocessing the scan once it arrives
 
-        nought_move = DataShape("nought", centre_offset=utils.action2ind(self.game.env.player_1_last_move))
-        nought_move.draw_in_stm(self.desorption_bias, self.desorption_current, self.t_raster, self.raster_points)
-        nought_image = utils.get_scan()
-        binarised_nought_image = self.preprocessor.preprocess_and_binarise(nought_image)
-        self.render(nought_image[0, :, :], binarised_nought_image, nought_move)
+        Parameters
+        ----------
+        object_shape: str
+            Shape of the piece
+        action: int
+            Square to draw it on
+        offset: ndarray or None
+            Moves the piece (index co-ords). None (default) to follow the drift measured so far
+
+        Returns
+        -------
+        turn: tuple
+            The DataShape, and futures for its scan and binarised scan
+        """
+        if offset is None:
+            offset = self.drift_offset
+        piece = DataShape.on_action(object_shape, action, geometry=self.geometry, offset=offset)
+        if self.optimise_paths:
+            piece.optimise_path()
+        self._journal_piece(object_shape, action, offset)
+        if self.recorder is not None:
+            self.recorder.record_piece(piece, offset)
+
+        if self.stream_scans:
+            streamed = self.pipeline.instrument(self._draw_and_stream, piece)
+            return piece, self.pipeline.then(streamed, lambda r: r[0]), self.pipeline.then(streamed, lambda r: r[1])
+
+        scan = self.pipeline.instrument(self._draw_and_scan, piece)
+        binarised = self.pipeline.preprocessing(lambda: self.preprocessor.preprocess_and_binarise(scan.result()))
+        return piece, scan, binarised
+
+    def _journal_piece(self, object_shape: str, action: int, offset):
+        """Notes a piece in the journal next to the checkpoint before it is drawn, so that resume can look for it on
+        the sample if the game dies before the next checkpoint"""
+        if self.checkpoint is None:
+            return
+        self._queued_pieces.append({"shape": object_shape, "action": int(action),
+                                    "offset": np.asarray(offset, dtype=float).tolist()})
+        save_checkpoint(f"{self.checkpoint}.queued", {"game_id": self._game_id, "pieces": self._queued_pieces}, {})
+
+    def _queue_rescan(self, piece: DataShape):
+        """Queues scanning around an already drawn piece again, and preprocessing the scan once it arrives
+
+        Returns
+        -------
+        turn: tuple
+            None in place of a piece to draw, and futures for the scan and binarised scan
+        """
+        scan = self.pipeline.instrument(self._scan_after, piece)
+        binarised = self.pipeline.preprocessing(lambda: self.preprocessor.preprocess_and_binarise(scan.result()))
+        return None, scan, binarised
+
+    def _draw(self, piece: DataShape):
+        if self.dose_optimiser is None:
+            piece.draw_in_stm(self.desorption_bias, self.desorption_current, self.t_raster, self.raster_points,
+                              backend=self.backend)
+            return
+
+        start = self.backend.tip_position() if self.backend.supports_position_readback else None
+        t_rasters = self.dose_optimiser.plan(piece, self.desorption_bias, self.desorption_current, self.raster_points)
+        piece.draw_in_stm(self.desorption_bias, self.desorption_current, self.t_raster, self.raster_points,
+                          backend=self.backend, t_rasters=t_rasters)
+        self.dose_optimiser.record(piece, self.t_raster, t_rasters, self.raster_points, start)
+
+    def _draw_and_scan(self, piece: DataShape):
+        reference = self._board_before(piece)
+        self._draw(piece)
+        return self._verify_and_redraw(piece, self._scan_after(piece), reference)
+
+    def _draw_and_stream(self, piece: DataShape):
+        """Draws a piece, then preprocesses the forward scan line by line as it is acquired"""
+        reference = self._board_before(piece)
+        self._draw(piece)
+
+        streaming = StreamingPreprocessing(self.preprocessor)
+        lines = []
+        line_iter = self.scans.iter_update(piece) if self.roi_scans else utils.iter_scan_lines(self.backend)
+        with tracer.span("stream_scan"):
+            for _, line in line_iter:
+                lines.append(line)
+                streaming.add_line(line[0])
+
+        image = np.stack(lines, axis=1)
+        self._last_scan = image
+        self._track_drift(image, piece)
+
+        verified = self._verify_and_redraw(piece, image, reference)
+        if verified is not image:
+            # Segments were redrawn and rescanned, so the streamed lines are out of date
+            streaming = StreamingPreprocessing(self.preprocessor)
+            for line in verified[0]:
+                streaming.add_line(line)
+        return verified, streaming.finish()
+
+    def _board_before(self, piece: DataShape):
+        """Forward scan of the board around `piece` from the last scan, i.e. before it is drawn, for the verifier to
+        compare the scans after it with. None if nothing has been scanned yet or pieces aren't verified"""
+        if self.verifier is None:
+            return None
+        image = self.scans.image if self.roi_scans else self._last_scan
+        if image is None:
+            return None
+        col_min, row_min, col_max, row_max = self.verifier.window(piece, image.shape[-1])
+        return image[0, row_min:row_max, col_min:col_max].copy()
+
+    @traced("verify")
+    def _verify_and_redraw(self, piece: DataShape, image: np.ndarray, reference: np.ndarray = None):
+        """Redraws the segments of `piece` that didn't desorb in `image`, rescanning after each redraw. Desorption
+        is found from the height gained since `reference`, the scan around the piece before it was drawn, if given
+
+        Returns
+        -------
+        image: ndarray
+            The last scan, which is `image` itself if nothing was redrawn
+        """
+        if self.verifier is None:
+            return image
+
+        resolution = image.shape[-1]
+        col_min, row_min, col_max, row_max = window = self.verifier.window(piece, resolution)
+        for n_redraws in range(self.max_redraws + 1):
+            binarised = self.preprocessor.binarise_region(image[0, row_min:row_max, col_min:col_max], reference)
+            failed = self.verifier.failed_segments(piece, binarised, window, resolution)
+            if len(failed) == 0:
+                return image
+            if n_redraws == self.max_redraws:
+                break
+
+            print(f"Redrawing {len(failed)} of {len(piece.segment_ends())} segments of {piece.object_shape}")
+            piece.with_segments(failed).draw_in_stm(self.desorption_bias, self.desorption_current, self.t_raster,
+                                                    self.raster_points, backend=self.backend)
+            image = self._scan_after(piece)
+
+        warnings.warn(f"{len(failed)} segments of {piece.object_shape} still didn't desorb after "
+                      f"{self.max_redraws} redraws")
+        return image
+
+    def _render_pending(self, board=None):
+        """Renders the last piece queued once its scan is preprocessed, yielding the futures it waits on (see turn)"""
+        if self._pending_render is None:
+            return
+        piece, scan, binarised = self._pending_render
+        self._pending_render = None
+        yield scan
+        yield binarised
+        if self.recorder is not None:
+            self.recorder.record_scan(scan.result(), binarised.result(),
+                                      label="rescan" if piece is None else piece.object_shape)
+        self.render(scan.result()[0, :, :], binarised.result(), piece, board)
+
+    def _scan_after(self, piece: DataShape):
+        image = self.scans.update(piece) if self.roi_scans else utils.get_scan(self.backend)
+        self._last_scan = image
+        self._track_drift(image, piece)
+        return image
+
+    @traced("track_drift")
+    def _track_drift(self, image: np.ndarray, piece: DataShape):
+        """Measures the drift in the part of `image` just scanned, so that later pieces are drawn where the board
+        has drifted to"""
+        if self.drift_tracker is None:
+            return
+        if self.drift_tracker.reference is None:
+            self.drift_tracker.set_reference(image[0], at=self.backend.time())
+            return
+
+        # Region of interest scans too small to match reliably, or implausible matches, leave the drift as it was
+        window = self.scans.roi_window(piece) if self.roi_scans else None
+        shift = self.drift_tracker.estimate(image[0], window, at=self.backend.time())
+        if shift is None:
+            return
+
+        self.drift_offset = self.geometry.scan_shift2ind(shift, image.shape[-1])
+        print(f"Drift is ({shift[0]:.1f}, {shift[1]:.1f}) pixels, "
+              f"estimated in {self.drift_tracker.times[-1] * 1e3:.1f}ms")
+
+    def _start_trace(self):
+        """Labels the spans of a new game, tracing them to trace_dir if it is set, and forgets the last game's"""
+        if self.trace_dir and not self._holding_tracer:
+            tracer.hold()
+            self._holding_tracer = True
+        if self._trace_game is not None:
+            tracer.clear(self._trace_game)
+        self._trace_game = tracer.new_game()
 
     def reset(self):
-        # Reset env
-        self.game = SelfPlayTester(**self.game_args)
-        self.preprocessor = ImagePreprocessing()
-
-        mo.gap_voltage_control.Voltage(self.scan_bias)
-        mo.regulator.Setpoint_1(self.scan_setpoint)
-
-        # Coarse move random walk
-        mo.experiment.stop()
-        # print("Coarse Moving")
-        # black_box.backward()
-        #
-        # for i in range(self.num_coarse_moves_on_reset):
-        #     rand_coarse_move = np.random.rand()
-        #     if 0 <= rand_coarse_move <= 0.25:
-        #         black_box.x_minus()
-        #     elif 0.25 < rand_coarse_move <= 0.5:
-        #         black_box.x_plus()
-        #     elif 0.5 < rand_coarse_move <= 0.75:
-        #         black_box.y_minus()
-        #     else:
-        #         black_box.y_plus()
-        #
-        # black_box.auto_approach()
-
-        # Check if flat
-        is_flat = True  # TODO
-        if not is_flat:
-            warnings.warn("Game area is not viable! Retracting and moving!")
-            self.reset()
-
-        # Setup figs
-        self.fig, self.axs = plt.subplots(1, 4)
-        self.fig.set_size_inches(16, 6)
-
-        self.axs[0].set_title("Game Board")
-        self.axs[1].set_title("Desorption Path")
-        self.axs[2].set_title("STM Image")
-        self.axs[3].set_title("Binarised STM Image")
-        self.axs[1].invert_xaxis()
-
-        for i in range(4):
-            self.axs[i].set_xticks([])
-            self.axs[i].set_yticks([])
-
-        self.game.env._make_axis(ax=self.axs[0])
-        self.game.env.fig = self.fig
-        plt.pause(0.01)
+        self._start_trace()
+        self._pending_render = None
+        self._unconfirmed_piece = None
+        self._n_rereads = 0
+        self._checkpoint_saved = None
+        self._game_id = uuid.uuid4().hex
+        self._queued_pieces = []
+        self._last_scan = None
+        self.n_turns = 0
+
+        # Reset env, loading the players' models in the background while the microscope is set up
+        game = self._host_unless_plotting(SelfPlayTester, **self.game_args)
+        self.preprocessor = ImagePreprocessing(median_mode=self.instrument_options.median_mode)
+        self.drift_tracker = DriftTracker() if self.track_drift else None
+        self.drift_offset = np.zeros(2)
+        if self.owns_parameter_cache:
+            self.backend.reset_stats()
+        self.scans = self.scan_cache if self.scan_cache is not None else BoardScanCache(self.backend,
+                                                                                           margin=self.roi_margin)
+        if self.recorder is not None:
+            self.recorder.record_parameters({"scan_bias": self.scan_bias, "scan_setpoint": self.scan_setpoint,
+                                             "desorption_bias": self.desorption_bias,
+                                             "desorption_current": self.desorption_current,
+                                             "t_raster": self.t_raster, "raster_points": self.raster_points,
+                                             **{key: value for key, value in self.game_args.items()
+                                                if key != "auto_render"},
+                                             "instrument": self.instrument_options.serialisable()})
+
+        self.backend.voltage(self.scan_bias)
+        self.backend.setpoint(self.scan_setpoint)
+
+        # Find a flat area to play on, moving away from the last game's area first
+        self.backend.stop_experiment()
+        if self.area_search is not None and not self.area_search.find(self.backend, move_first=self.game is not None):
+            warnings.warn("No viable game area found within the search budget! Playing here anyway")
+
+        self.game = game.result()
+        if self.recorder is not None and self.game.env.turns_taken > 0:
+            # The opponent went first, as the env was reset
+            self.recorder.record_decision("player_1", self.game.opponent_last_move)
+        self._setup_renderer()
 
         # Draw grid
         # prelim_scan = utils.get_scan()
@@ -168,16 +560,164 @@ class STMTicTacToe:
         # scan = utils.get_scan()
         # self.render(scan_data=scan[0, :, :], binary_data=scan, piece=grid)
 
-    def render(self, scan_data: np.ndarray, binary_data: np.ndarray, piece: DataShape):
-        self.game.env.render()
-        if piece is not None:
-            piece.plot(ax=self.axs[1])
-        self.axs[2].imshow(np.fliplr(scan_data), cmap=nanomap)
-        # self.axs[3].imshow(binary_data, cmap=utils.rabanimap)
-        plt.pause(0.001)
-
-        if self.savefig:
-            plt.savefig(self.fig, f"{self.savefig}/tictactoe_{self.savefig_step}.png")
+    def _setup_renderer(self):
+        if self.savefig and self.frame_writer is None:
+            from rendering import FrameWriter
+            output = self.output_options
+            self.frame_writer = FrameWriter(self.savefig, max_queued=output.max_queued_frames,
+                                            drop_when_full=output.drop_frames, video_fps=output.video_fps,
+                                            video_name=f"tictactoe_{self.savefig_step}.mp4")
+        if self.game_args["render_mode"] is not None or self.frame_writer is not None:
+            from rendering import BoardRenderer
+            self.renderer = BoardRenderer(self.game.env, resolution=self.geometry.resolution)
+            self.fig, self.axs = self.renderer.fig, self.renderer.axs
+
+    def save_checkpoint(self):
+        """Queues atomically saving everything resume needs to carry on the game to `checkpoint`, on the instrument
+        lane behind the pieces queued so far
+
+        Returns
+        -------
+        saved: Future
+            Done once the checkpoint is written
+        """
+        state = {"game_id": self._game_id,
+                 "game": self.game.snapshot(serialisable=True),
+                 "n_turns": self.n_turns,
+                 "n_pieces": len(self._queued_pieces),
+                 "savefig_step": self.savefig_step}
+        last_binarised = None if self._pending_render is None else self._pending_render[2]
+        self._checkpoint_saved = self.pipeline.instrument(self._write_checkpoint, state, last_binarised)
+        return self._checkpoint_saved
+
+    def _write_checkpoint(self, state: dict, last_binarised=None):
+        """Adds the preprocessor, drift and image of the board to `state` and saves it, once the last piece queued
+        before it, whose scan may set the flattening parameters, is preprocessed"""
+        if last_binarised is not None:
+            last_binarised.result()
+
+        preprocessor_values, preprocessor_arrays = self.preprocessor.get_state()
+        state = {**state,
+                 "drift_offset": self.drift_offset.tolist(),
+                 "drift_shift": None if self.drift_tracker is None else np.asarray(self.drift_tracker.shift).tolist(),
+                 "preprocessor": preprocessor_values}
+        arrays = {"scan_image": self.scans.image,
+                  "drift_reference": None if self.drift_tracker is None else self.drift_tracker.reference,
+                  **{f"preprocessor.{name}": arr for name, arr in preprocessor_arrays.items()}}
+        save_checkpoint(self.checkpoint, state, arrays)
+
+    def restore_checkpoint(self):
+        """Sets up the game as saved in `checkpoint`, in place of reset
+
+        No new area is searched for, and the image of the board is taken from the checkpoint rather than rescanned.
+        Only the pieces in the journal queued after the checkpoint are scanned, to find any drawn before the game
+        died (see _recover_pieces)
+        """
+        state, arrays = load_checkpoint(self.checkpoint)
+        self._start_trace()
+        self._pending_render = None
+        self._unconfirmed_piece = None
+        self._n_rereads = 0
+        self._checkpoint_saved = None
+        self._game_id = state["game_id"]
+        self.n_turns = state["n_turns"]
+        self.savefig_step = state["savefig_step"]
+        game = self._host_unless_plotting(SelfPlayTester, **self.game_args)
+
+        journal = []
+        if os.path.exists(f"{self.checkpoint}.queued"):
+            journal_state, _ = load_checkpoint(f"{self.checkpoint}.queued")
+            if journal_state["game_id"] == self._game_id:
+                journal = journal_state["pieces"]
+        self._queued_pieces = journal[:state["n_pieces"]]
+
+        self.preprocessor = ImagePreprocessing(median_mode=self.instrument_options.median_mode)
+        self.preprocessor.set_state(state["preprocessor"],
+                                    {name.split(".", 1)[1]: arr for name, arr in arrays.items()
+                                     if name.startswith("preprocessor.")})
+
+        self.drift_tracker = DriftTracker() if self.track_drift else None
+        if self.drift_tracker is not None and "drift_reference" in arrays:
+            # The instrument's clock may have restarted since, so the next estimate isn't limited by the time passed
+            self.drift_tracker.set_reference(arrays["drift_reference"])
+            self.drift_tracker.shift = np.array(state["drift_shift"])
+        self.drift_offset = np.array(state["drift_offset"])
+
+        if self.owns_parameter_cache:
+            self.backend.reset_stats()
+        self.scans = self.scan_cache if self.scan_cache is not None else BoardScanCache(self.backend,
+                                                                                           margin=self.roi_margin)
+        if "scan_image" in arrays:
+            self.scans.image = np.array(arrays["scan_image"])
+            self.scans.resolution = self.scans.image.shape[-1]
+        self._last_scan = self.scans.image
+
+        self.backend.voltage(self.scan_bias)
+        self.backend.setpoint(self.scan_setpoint)
+
+        self.game = game.result()
+        self.game.restore(state["game"])
+        self._recover_pieces(journal[state["n_pieces"]:])
+        self._setup_renderer()
+        print(f"Resumed from {self.checkpoint} after {self.n_turns} turns")
+
+    def _recover_pieces(self, pieces):
+        """Scans around each piece queued after the checkpoint, in the order they were queued, and puts the ones
+        found on the sample into the game, redrawing any of their segments that didn't desorb. The first piece not
+        found at all was never started, nor were any after it
+
+        A cross found without the nought after it leaves the opponent to reply on the next step, as if the board had
+        read back wrong
+        """
+        verifier = self.verifier if self.verifier is not None else DesorptionVerifier()
+        for entry in pieces:
+            piece = DataShape.on_action(entry["shape"], entry["action"], geometry=self.geometry,
+                                        offset=entry["offset"])
+            if self.optimise_paths:
+                piece.optimise_path()
+
+            reference = None
+            if self._last_scan is not None:
+                col_min, row_min, col_max, row_max = verifier.window(piece, self._last_scan.shape[-1])
+                reference = self._last_scan[0, row_min:row_max, col_min:col_max].copy()
+            image = self._scan_after(piece)
+            col_min, row_min, col_max, row_max = window = verifier.window(piece, image.shape[-1])
+            binarised = self.preprocessor.binarise_region(image[0, row_min:row_max, col_min:col_max], reference)
+            failed = verifier.failed_segments(piece, binarised, window, image.shape[-1])
+            if len(failed) == len(piece.segment_ends()):
+                break
+
+            print(f"Found the {entry['shape']} on square {entry['action']} drawn before the game stopped")
+            if len(failed) > 0:
+                piece.with_segments(failed).draw_in_stm(self.desorption_bias, self.desorption_current, self.t_raster,
+                                                        self.raster_points, backend=self.backend)
+                self._scan_after(piece)
+            self._queued_pieces.append(entry)
+            self.game.play_move(entry["action"])
+            self._unconfirmed_piece = piece if entry["shape"] == "cross" else None
+            if entry["shape"] == "nought":
+                self.n_turns += 1
+
+        if self._unconfirmed_piece is not None and self.game.is_episode_done:
+            self._unconfirmed_piece = None
+
+    def resume(self):
+        """Carries on the game saved in `checkpoint`, e.g. after the process died, to the end"""
+        self.restore_checkpoint()
+        while not self.game.is_episode_done:
+            self.step()
+        self.finish_game()
+
+    @traced("render")
+    def render(self, scan_data: np.ndarray, binary_data: np.ndarray, piece: DataShape, board=None):
+        if self.game_args["render_mode"] != "plot":
+            self.game.env.render()
+        if self.renderer is None:
+            return
+        self.renderer.render(scan_data, binary_data, piece, board)
+
+        if self.frame_writer is not None:
+            self.frame_writer.put_figure(self.fig, f"tictactoe_{self.savefig_step}")
             self.savefig_step += 1
 
 
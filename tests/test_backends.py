@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from hardware.backends import CachedBackend, get_backend, set_backend
+from hardware.simulated import SimulatedBackend
+
+
+def test_parameters_are_read_without_a_value_and_set_with_one():
+    backend = SimulatedBackend(time_scale=0.0, seed=0)
+
+    assert backend.voltage(4.2) is None
+    assert backend.voltage() == 4.2
+    assert backend.n_calls == 2
+
+
+@pytest.mark.parametrize("voltage, is_desorbed", [(-2.0, False), (3.5, True)])
+def test_tip_only_desorbs_at_the_desorption_voltage(voltage, is_desorbed):
+    backend = SimulatedBackend(resolution=64, time_scale=0.0, noise=0.0, seed=0)
+    before = backend.get_xy_scan()
+
+    backend.move_tip((-0.5, 0.0))
+    backend.voltage(voltage)
+    backend.move_tip((0.5, 0.0))
+    after = backend.get_xy_scan()
+
+    assert np.any(backend.desorbed) == is_desorbed
+    assert np.any(after - before > 0.5) == is_desorbed
+
+
+def test_windowed_scan_matches_the_full_scan():
+    backend = SimulatedBackend(resolution=64, time_scale=0.0, noise=0.0, seed=0)
+    full = backend.get_xy_scan()
+
+    scan = backend.get_xy_scan(window=(8, 16, 40, 24))
+
+    assert scan.shape == (2, 8, 32)
+    np.testing.assert_array_equal(scan, full[:, 16:24, 8:40])
+
+
+def test_coarse_moves_need_the_tip_retracted():
+    backend = SimulatedBackend(resolution=64, time_scale=0.0, seed=0)
+
+    with pytest.raises(RuntimeError):
+        backend.coarse_move("x_plus")
+    backend.retract()
+    backend.coarse_move("x_plus", steps=2)
+    backend.approach()
+
+    assert backend.coarse_position == (2, 0)
+    assert not np.any(backend.desorbed)
+
+
+def test_set_backend_replaces_the_active_backend():
+    backend = SimulatedBackend(resolution=64, time_scale=0.0, seed=0)
+
+    set_backend(backend)
+    try:
+        assert get_backend() is backend
+    finally:
+        set_backend(None)
+
+
+def test_cache_skips_unchanged_writes_and_serves_reads():
+    backend = CachedBackend(SimulatedBackend(resolution=64, time_scale=0.0, seed=0))
+
+    backend.voltage(4.2)
+    backend.voltage(4.2)
+    assert backend.voltage() == 4.2
+    backend.voltage(-2.0)
+
+    assert backend.n_calls == 2
+    assert backend.stats["voltage"]["skipped_writes"] == 1
+    assert backend.stats["voltage"]["cache_hits"] == 1
+    assert backend.backend.voltage() == -2.0
+
+
+@pytest.mark.parametrize("method", ["stop_experiment", "resume_experiment"])
+def test_cache_is_invalidated_when_the_experiment_stops_or_resumes(method):
+    simulated = SimulatedBackend(resolution=64, time_scale=0.0, seed=0)
+    backend = CachedBackend(simulated)
+    backend.setpoint(1e-9)
+
+    getattr(backend, method)()
+    # The instrument may change its parameters while stopped, so the cache must not be trusted afterwards
+    simulated._setpoint = 2e-9
+
+    assert backend.setpoint() == 2e-9
+    n_calls = backend.n_calls
+    backend.setpoint(1e-9)
+    assert backend.n_calls == n_calls + 1
+    assert simulated.setpoint() == 1e-9
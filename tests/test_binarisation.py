@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+
+from binarisation import ImagePreprocessing, StreamingPreprocessing
+
+
+def _loop_median_offset(diff):
+    """The line alignment's median before it was vectorised"""
+    bins = np.linspace(np.min(diff), np.max(diff), 1000)
+    binned_indices = np.digitize(diff, bins, right=True)
+    return bins[int(np.median(binned_indices))]
+
+
+def _loop_median_align(arr):
+    for i in range(len(arr)):
+        arr[i, :] += _loop_median_offset(arr[i - 1, :] - arr[i, :])
+    return arr
+
+
+def _image(n, quantised, seed=0):
+    rng = np.random.default_rng(seed)
+    image = rng.normal(size=(n, n)) + rng.normal(size=(n, 1)) * 3
+    if quantised:
+        image = np.round(image * 3)
+    return ImagePreprocessing._normalize_data(image)
+
+
+@pytest.mark.parametrize("n", [64, 512, 1024])
+@pytest.mark.parametrize("quantised", [False, True])
+def test_median_offsets_match_loop(n, quantised):
+    image = _image(n, quantised)
+    diffs = np.roll(image, 1, axis=0) - image
+    expected = np.array([_loop_median_offset(diff) for diff in diffs])
+    np.testing.assert_array_equal(ImagePreprocessing._median_offsets(diffs), expected)
+
+
+def test_median_offsets_of_constant_difference():
+    assert ImagePreprocessing._median_offset(np.full(8, 0.25)) == 0.25
+
+
+@pytest.mark.parametrize("n", [64, 512, 1024])
+def test_median_align_matches_loop(n):
+    image = _image(n, quantised=False)
+    np.testing.assert_allclose(ImagePreprocessing._median_align(image.copy()), _loop_median_align(image.copy()),
+                               rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize("n", [64, 512, 1024])
+@pytest.mark.parametrize("seed", range(3))
+def test_median_align_matches_loop_on_quantised_data_within_tolerance(n, seed):
+    image = _image(n, quantised=True, seed=seed)
+    error = ImagePreprocessing._median_align(image.copy()) - _loop_median_align(image.copy())
+    assert np.max(np.abs(error)) < 1e-2
+
+
+@pytest.mark.parametrize("quantised", [False, True])
+def test_streaming_alignment_matches_loop(quantised):
+    image = _image(64, quantised)
+    streaming = StreamingPreprocessing(ImagePreprocessing())
+    for line in image:
+        streaming.add_line(line)
+
+    # Streaming can't align the first line to the last, which hasn't arrived yet, so leaves it as it is
+    expected = image.copy()
+    for i in range(1, len(expected)):
+        expected[i, :] += _loop_median_offset(expected[i - 1, :] - expected[i, :])
+    np.testing.assert_array_equal(np.array(streaming.lines), expected)
+
+
+def _scan(n, seed):
+    """Forward-Backward scan of a tilted, line offset surface with a desorbed square, in the shape (2, n, n)"""
+    rng = np.random.default_rng(seed)
+    lines, points = np.mgrid[0:n, 0:n] / n
+    image = 0.5 * lines + 0.3 * points ** 2 + rng.normal(size=(n, 1)) + 0.02 * rng.normal(size=(n, n))
+    image[n // 4:n // 2, n // 3:2 * n // 3] += 1
+    return np.stack([image, image[:, ::-1]]) * 1e-9
+
+
+@pytest.mark.parametrize("n", [64, 256])
+@pytest.mark.parametrize("median_mode", ["histogram", "exact"])
+def test_streaming_binarises_as_batch(n, median_mode):
+    batch = ImagePreprocessing(median_mode)
+    streaming = StreamingPreprocessing(ImagePreprocessing(median_mode))
+    for seed in range(3):
+        scan = _scan(n, seed)
+        for line in scan[0]:
+            streaming.add_line(line)
+        streamed = streaming.finish()
+
+        binarised = batch.preprocess_and_binarise(scan)
+        assert binarised.dtype == bool and binarised.shape == (n, n)
+        assert np.mean(binarised[n // 4:n // 2, n // 3:2 * n // 3]) > 0.9
+        np.testing.assert_array_equal(streamed, binarised)
+    # The flattening parameters only differ by the offset the batch alignment gives the whole image
+    assert np.ptp(streaming.preprocessor.xv + streaming.preprocessor.yv - batch.xv - batch.yv) < 1e-9
+
+
+def test_exact_median_mode_aligns_by_exact_medians():
+    scan = _scan(64, 0)
+    preprocessor = ImagePreprocessing(median_mode="exact")
+    aligned = []
+    preprocessor._flatten_and_binarise = aligned.append
+    preprocessor.preprocess_and_binarise(scan)
+
+    expected = ImagePreprocessing._normalize_data(scan[0].astype(float))
+    expected += np.cumsum(np.median(np.roll(expected, 1, axis=0) - expected, axis=-1))[:, None]
+    np.testing.assert_allclose(aligned[0], expected)
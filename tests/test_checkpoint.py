@@ -0,0 +1,68 @@
+import contextlib
+import io
+import os
+
+import numpy as np
+import pytest
+
+from checkpoint import load_checkpoint, save_checkpoint
+from hardware.simulated import SimulatedBackend
+from options import OutputOptions
+
+
+def test_checkpoint_round_trips(tmp_path):
+    path = str(tmp_path / "game.npz")
+    state = {"game_id": 3, "n_turns": 2, "drift_offset": [0.5, -1.0], "preprocessor": {"levels": None}}
+    arrays = {"scan_image": np.arange(24.0).reshape(2, 3, 4), "drift_reference": None}
+
+    save_checkpoint(path, state, arrays)
+    loaded_state, loaded_arrays = load_checkpoint(path)
+
+    assert loaded_state == state
+    assert list(loaded_arrays) == ["scan_image"]
+    np.testing.assert_array_equal(loaded_arrays["scan_image"], arrays["scan_image"])
+
+
+def test_failed_save_keeps_the_previous_checkpoint(tmp_path):
+    path = str(tmp_path / "game.npz")
+    save_checkpoint(path, {"n_turns": 1}, {})
+
+    with pytest.raises(TypeError):
+        save_checkpoint(path, {"n_turns": object()}, {})
+
+    assert load_checkpoint(path)[0] == {"n_turns": 1}
+    assert os.listdir(tmp_path) == ["game.npz"]
+
+
+def test_resume_recovers_a_piece_queued_after_the_checkpoint(tmp_path):
+    stm_control = pytest.importorskip("stm_control")
+    checkpoint = str(tmp_path / "game.npz")
+    backend = SimulatedBackend(time_scale=0.0, seed=0)
+
+    game = stm_control.STMTicTacToe(-2.25, 250e-12, 4.2, 1.5e-9, 20e-3, 512, player_1_type="rules",
+                                    player_2_type="rules", render_mode=None, backend=backend,
+                                    output=OutputOptions(checkpoint=checkpoint))
+    with contextlib.redirect_stdout(io.StringIO()):
+        game.reset()
+        game.step()
+        game._checkpoint_saved.result()
+        n_pieces = len(game._queued_pieces)
+        # The game dies after drawing a cross but before the next checkpoint
+        action = int(np.argmax(game.game.env.legal_actions))
+        game._queue_piece("cross", action)[2].result()
+    game.pipeline.shutdown()
+    assert load_checkpoint(checkpoint)[0]["n_pieces"] == n_pieces
+
+    resumed = stm_control.STMTicTacToe(-2.25, 250e-12, 4.2, 1.5e-9, 20e-3, 512, player_1_type="rules",
+                                       player_2_type="rules", render_mode=None, backend=backend,
+                                       output=OutputOptions(checkpoint=checkpoint))
+    out = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(out):
+            resumed.resume()
+    finally:
+        resumed.pipeline.shutdown()
+
+    assert f"Found the cross on square {action}" in out.getvalue()
+    assert resumed._queued_pieces[n_pieces]["action"] == action
+    assert resumed.game.is_episode_done
@@ -0,0 +1,42 @@
+import contextlib
+import io
+import json
+
+import numpy as np
+import pytest
+
+from dose import DoseOptimiser
+from hardware.simulated import SimulatedBackend
+from shapes.shapes import DataShape
+
+
+CROSS = {"size": 70, "centre_offset": [0, 0],
+         "all_points": [{"datapoint": [0, 0], "desorb": "False"}, {"datapoint": [70, 70], "desorb": "True"},
+                        {"datapoint": [0, 70], "desorb": "False"}, {"datapoint": [70, 0], "desorb": "True"}]}
+
+
+@pytest.fixture(scope="module")
+def shape_directory(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("shapes")
+    (directory / "cross.json").write_text(json.dumps(CROSS))
+    return f"{directory}/"
+
+
+@pytest.mark.parametrize("readback", [True, False])
+def test_actual_saving_is_measured_like_the_prediction(shape_directory, readback):
+    backend = SimulatedBackend(time_scale=0.0, seed=0)
+    backend.supports_position_readback = readback
+    backend.move_tip((-0.9, -0.9))
+    optimiser = DoseOptimiser()
+    piece = DataShape.on_action("cross", 4, shape_directory=shape_directory)
+
+    start = backend.tip_position() if readback else None
+    t_rasters = optimiser.plan(piece, 4.2, 1.5e-9, 512)
+    with contextlib.redirect_stdout(io.StringIO()):
+        piece.draw_in_stm(4.2, 1.5e-9, 20e-3, 512, backend=backend, t_rasters=t_rasters)
+        saved = optimiser.record(piece, 20e-3, t_rasters, 512, start)
+
+    fixed = optimiser.predicted_time(piece, np.full(len(piece.desorb), 20e-3), 512, start)
+    assert saved["predicted"] > 0
+    # Waits overshoot each move by up to a poll, or by the margin of the estimate without readback
+    assert saved["predicted"] - 0.15 * fixed < saved["actual"] <= saved["predicted"]
@@ -0,0 +1,85 @@
+import contextlib
+import io
+import json
+import warnings
+
+import numpy as np
+import pytest
+
+import utils
+from drift import DriftTracker
+from hardware.simulated import SimulatedBackend
+from scanning import BoardScanCache
+from shapes.shapes import DataShape
+
+
+CROSS = {"size": 70, "centre_offset": [0, 0],
+         "all_points": [{"datapoint": [0, 0], "desorb": "False"}, {"datapoint": [70, 70], "desorb": "True"},
+                        {"datapoint": [0, 70], "desorb": "False"}, {"datapoint": [70, 0], "desorb": "True"}]}
+
+
+@pytest.fixture(scope="module")
+def shape_directory(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("shapes")
+    (directory / "cross.json").write_text(json.dumps(CROSS))
+    return f"{directory}/"
+
+
+def _track(shape_directory, resolution, drift_velocity, roi_scans, seed):
+    """Draws a cross on every square as a game would, estimating the drift from the scan after each
+
+    Returns
+    -------
+    shifts, drifts: ndarray
+        The drift followed after each scan, i.e. the last accepted estimate, and the drift in that scan (pixels)
+    """
+    backend = SimulatedBackend(resolution=resolution, drift_velocity=drift_velocity, time_scale=0.0, seed=seed)
+    scans = BoardScanCache(backend)
+    tracker = DriftTracker()
+    tracker.set_reference(scans.full_scan()[0], at=backend.time())
+
+    shifts, drifts = [], []
+    with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for action in range(9):
+            piece = DataShape.on_action("cross", action, shape_directory=shape_directory)
+            piece.draw_in_stm(4.2, 1.5e-9, 20e-3, 512, backend=backend)
+            drifts.append(backend.sample_offset())
+            image = scans.update(piece) if roi_scans else utils.get_scan(backend)
+            tracker.estimate(image[0], scans.roi_window(piece) if roi_scans else None, at=backend.time())
+            shifts.append(np.array(tracker.shift))
+    return np.array(shifts), np.array(drifts)
+
+
+@pytest.mark.parametrize("seed", range(4))
+@pytest.mark.parametrize("resolution", [256, 512])
+@pytest.mark.parametrize("roi_scans", [True, False])
+def test_no_drift_is_found_without_drift(shape_directory, seed, resolution, roi_scans):
+    shifts, _ = _track(shape_directory, resolution, (0, 0), roi_scans, seed)
+    np.testing.assert_allclose(shifts, 0, atol=0.5)
+
+
+@pytest.mark.parametrize("roi_scans", [True, False])
+def test_known_drift_is_followed(shape_directory, roi_scans):
+    shifts, drifts = _track(shape_directory, 512, (0.05, -0.03), roi_scans, 0)
+    assert np.linalg.norm(drifts[-1] - drifts[0]) > 3
+    # The sample drifts while the reference is scanned, so only changes in the drift can be compared
+    np.testing.assert_allclose(shifts - shifts[0], drifts - drifts[0], atol=1.5)
+
+
+def test_small_windows_are_not_estimated_from():
+    tracker = DriftTracker(min_size=64)
+    tracker.set_reference(np.random.default_rng(0).normal(size=(256, 256)))
+    assert tracker.estimate(tracker.reference, window=(0, 0, 60, 200)) is None
+    np.testing.assert_array_equal(tracker.shift, 0)
+
+
+def test_faster_change_than_max_rate_is_rejected():
+    rng = np.random.default_rng(0)
+    reference = rng.normal(size=(128, 128))
+    tracker = DriftTracker(max_rate=0.1, tolerance=1.0)
+    tracker.set_reference(reference, at=0.0)
+    shifted = np.roll(reference, (5, 5), axis=(0, 1))
+    with pytest.warns(UserWarning, match="further from the last"):
+        assert tracker.estimate(shifted, at=10.0) is None
+    np.testing.assert_allclose(tracker.estimate(shifted, at=100.0), (5, 5), atol=0.5)
@@ -0,0 +1,61 @@
+import json
+
+import numpy as np
+import pytest
+
+from shapes.registry import clear_library, load_shape
+from utils import board_geometry
+
+
+NOUGHT = {"size": 70, "centre_offset": [5, -5],
+          "all_points": [{"datapoint": [35, 0], "desorb": "False"}, {"datapoint": [70, 35], "desorb": "True"},
+                         {"datapoint": [35, 70], "desorb": "True"}, {"datapoint": [0, 35], "desorb": "True"},
+                         {"datapoint": [35, 0], "desorb": "True"}]}
+
+
+@pytest.fixture
+def shape_directory(tmp_path):
+    (tmp_path / "nought.json").write_text(json.dumps(NOUGHT))
+    yield f"{tmp_path}/"
+    clear_library()
+
+
+def test_shape_round_trips_through_its_file(shape_directory):
+    shape = load_shape("nought", shape_directory)
+
+    assert shape.name == "nought"
+    assert shape.size == NOUGHT["size"]
+    np.testing.assert_array_equal(shape.centre_offset, NOUGHT["centre_offset"])
+    np.testing.assert_array_equal(shape.positions, [point["datapoint"] for point in NOUGHT["all_points"]])
+    np.testing.assert_array_equal(shape.desorb, [point["desorb"] == "True" for point in NOUGHT["all_points"]])
+    with pytest.raises(ValueError):
+        shape.positions[0, 0] = 1
+
+
+def test_shape_file_is_only_read_once_until_the_library_is_cleared(tmp_path, shape_directory):
+    shape = load_shape("nought", shape_directory)
+    (tmp_path / "nought.json").unlink()
+
+    assert load_shape("nought", shape_directory) is shape
+    clear_library()
+    with pytest.raises(FileNotFoundError):
+        load_shape("nought", shape_directory)
+
+
+def test_matrix_positions_are_computed_once_per_geometry(shape_directory):
+    shape = load_shape("nought", shape_directory)
+    geometry = board_geometry()
+
+    mtrx_positions = shape.mtrx_positions(geometry)
+
+    assert shape.mtrx_positions(geometry) is mtrx_positions
+    np.testing.assert_array_equal(mtrx_positions, geometry.ind2mtrx(shape.positions))
+    assert shape.mtrx_positions(board_geometry((4, 4))).shape == mtrx_positions.shape
+
+
+def test_points_outside_the_shape_are_rejected(tmp_path):
+    datafile = dict(NOUGHT, all_points=NOUGHT["all_points"] + [{"datapoint": [-1, 35], "desorb": "True"}])
+    (tmp_path / "broken.json").write_text(json.dumps(datafile))
+
+    with pytest.raises(LookupError):
+        load_shape("broken", f"{tmp_path}/")
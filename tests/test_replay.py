@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from dose import DoseOptimiser
+from hardware.simulated import SimulatedBackend
+from options import InstrumentOptions
+from recording import RecordingBackend, SessionArchive, SessionRecorder
+
+
+def _record_session(directory):
+    recorder = SessionRecorder(directory, chunk_size=2)
+    backend = RecordingBackend(SimulatedBackend(resolution=32, time_scale=0, seed=0), recorder)
+    acquired = [backend.get_preview_scan(8),
+                backend.get_xy_scan(),
+                backend.get_xy_scan(window=(4, 6, 20, 16)),
+                np.stack([line for _, line in backend.iter_xy_scan_lines(trace="Down")], axis=1),
+                np.stack([line for _, line in backend.iter_xy_scan_lines(window=(0, 0, 8, 8))], axis=1)]
+    recorder.close()
+    return acquired
+
+
+def test_every_acquisition_is_recorded(tmp_path):
+    acquired = _record_session(tmp_path)
+    acquisitions = SessionArchive(tmp_path).acquisitions()
+    assert [event["method"] for event, _ in acquisitions] == ["preview", "scan", "scan", "scan", "scan"]
+    assert acquisitions[2][0]["window"] == [4, 6, 20, 16]
+    # Scans taken downwards are stored top to bottom
+    np.testing.assert_array_equal(acquisitions[3][1], acquired[3][:, ::-1])
+
+
+def test_appending_carries_on_from_the_last_step(tmp_path):
+    _record_session(tmp_path)
+    n_events = len(SessionArchive(tmp_path).events)
+    recorder = SessionRecorder(tmp_path)
+    recorder.record_decision("player_0", 4)
+    recorder.close()
+    assert [event["step"] for event in SessionArchive(tmp_path).events] == list(range(n_events + 1))
+
+
+def test_instrument_options_round_trip_through_the_archive(tmp_path):
+    options = InstrumentOptions(stream_scans=True, roi_margin=8, dose_optimiser=DoseOptimiser(margin=1.5))
+    recorder = SessionRecorder(tmp_path)
+    recorder.record_parameters({"instrument": options.serialisable()})
+    recorder.close()
+
+    restored = InstrumentOptions.from_serialisable(SessionArchive(tmp_path).of_kind("parameters")[0]["parameters"]
+                                                   ["instrument"])
+    assert {key: value for key, value in vars(restored).items() if key != "dose_optimiser"} == \
+        {key: value for key, value in vars(options).items() if key != "dose_optimiser"}
+    assert vars(restored.dose_optimiser) == vars(options.dose_optimiser)
+
+
+def test_replay_serves_each_acquisition_in_turn(tmp_path):
+    replay = pytest.importorskip("replay")
+    acquired = _record_session(tmp_path)
+    backend = replay.ReplayBackend(SessionArchive(tmp_path), time_scale=0)
+
+    np.testing.assert_array_equal(backend.get_preview_scan(8), acquired[0])
+    np.testing.assert_array_equal(backend.get_xy_scan(), acquired[1])
+    np.testing.assert_array_equal(backend.get_xy_scan(window=(4, 6, 20, 16)), acquired[2])
+    np.testing.assert_array_equal(backend.get_xy_scan(trace="Down"), acquired[3])
+    np.testing.assert_array_equal(backend.get_xy_scan(window=(0, 0, 8, 8)), acquired[4])
+    with pytest.raises(RuntimeError, match="No recorded scans left"):
+        backend.get_xy_scan()
+
+
+def test_replay_out_of_sync_raises(tmp_path):
+    replay = pytest.importorskip("replay")
+    _record_session(tmp_path)
+    backend = replay.ReplayBackend(SessionArchive(tmp_path), time_scale=0)
+    with pytest.raises(RuntimeError, match="out of sync"):
+        backend.get_xy_scan()
@@ -0,0 +1,48 @@
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+from hardware.simulated import SimulatedBackend
+from options import InstrumentOptions, OutputOptions
+
+scheduling = pytest.importorskip("scheduling")
+
+
+def test_two_boards_finish_on_separate_geometries():
+    backend = SimulatedBackend(time_scale=0.0, seed=0)
+    scheduler = scheduling.MultiBoardScheduler(2, -2.25, 250e-12, 4.2, 1.5e-9, 20e-3, 512, backend=backend,
+                                               player_1_type="rules", player_2_type="rules",
+                                               instrument=InstrumentOptions(check_area=False))
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            scheduler.play_games()
+    finally:
+        scheduler.shutdown()
+
+    assert all(game.game.is_episode_done for game in scheduler.games)
+    origins = [tuple(game.geometry.origin) for game in scheduler.games]
+    assert len(set(origins)) == 2
+    assert backend.coarse_position == (0, 0)
+
+    # Each board is drawn in its own half of the scan area
+    half = backend.resolution // 2
+    assert backend.desorbed[:, :half].any() and backend.desorbed[:, half:].any()
+
+
+def test_every_game_saves_its_own_trace(tmp_path):
+    scheduler = scheduling.MultiBoardScheduler(2, -2.25, 250e-12, 4.2, 1.5e-9, 20e-3, 512,
+                                               backend=SimulatedBackend(time_scale=0.0, seed=1),
+                                               player_1_type="rules", player_2_type="rules",
+                                               output=OutputOptions(trace_dir=str(tmp_path)))
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(2):
+                scheduler.play_games()
+    finally:
+        scheduler.shutdown()
+
+    traces = [sorted(path.name for path in (tmp_path / f"board_{i}").glob("trace_game*.json")) for i in range(2)]
+    assert all(len(names) == 2 for names in traces)
+    assert not set(traces[0]) & set(traces[1])
@@ -0,0 +1,66 @@
+import contextlib
+import io
+import json
+
+import numpy as np
+import pytest
+
+from hardware.simulated import SimulatedBackend
+from shapes.shapes import DataShape
+
+
+CROSS = {"size": 70, "centre_offset": [0, 0],
+         "all_points": [{"datapoint": [0, 0], "desorb": "False"}, {"datapoint": [35, 35], "desorb": "True"},
+                        {"datapoint": [70, 70], "desorb": "True"}, {"datapoint": [0, 70], "desorb": "False"},
+                        {"datapoint": [35, 35], "desorb": "True"}, {"datapoint": [70, 0], "desorb": "True"}]}
+
+
+class WriteCountingBackend(SimulatedBackend):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.writes = []
+
+    def _param(self, name, value):
+        if value is not None:
+            self.writes.append(name)
+        return super()._param(name, value)
+
+
+@pytest.fixture(scope="module")
+def shape_directory(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("shapes")
+    (directory / "cross.json").write_text(json.dumps(CROSS))
+    return f"{directory}/"
+
+
+def test_path_only_switches_parameters_between_strokes(shape_directory):
+    backend = WriteCountingBackend(resolution=128, time_scale=0.0, seed=0)
+    backend.supports_position_readback = False
+    piece = DataShape.on_action("cross", 4, shape_directory=shape_directory)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        piece.draw_in_stm(4.2, 1.5e-9, 20e-3, 512, backend=backend)
+
+    # Into each of the two strokes, out between them and restored once at the end
+    assert backend.writes.count("_voltage") == 4
+    assert backend.writes.count("_setpoint") == 4
+    assert backend.voltage() == -2.0
+    assert backend.setpoint() == 100e-12
+    assert backend.raster_time() == 1e-4
+
+
+def test_path_desorbs_the_same_as_setting_parameters_per_point(shape_directory):
+    piece = DataShape.on_action("cross", 4, shape_directory=shape_directory)
+    per_point = SimulatedBackend(resolution=128, time_scale=0.0, seed=0)
+    for target, is_desorbing in zip(piece.mtrx_positions, piece.desorb):
+        per_point.voltage(4.2 if is_desorbing else -2.0)
+        per_point.setpoint(1.5e-9 if is_desorbing else 100e-12)
+        per_point.move_tip(target)
+        per_point.sleep(1.0)
+
+    backend = SimulatedBackend(resolution=128, time_scale=0.0, seed=0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        piece.draw_in_stm(4.2, 1.5e-9, 20e-3, 512, backend=backend)
+
+    assert np.any(backend.desorbed)
+    np.testing.assert_array_equal(backend.desorbed, per_point.desorbed)
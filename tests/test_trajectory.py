@@ -0,0 +1,68 @@
+from math import gcd
+
+import numpy as np
+import pytest
+
+from shapes.trajectory import merge_collinear, optimise_path, order_strokes, path_travel, split_strokes
+
+
+def _coverage(positions, desorb):
+    """The unit lattice steps desorbed by a path of integer points, regardless of order and direction"""
+    covered = set()
+    for start, end, is_desorbing in zip(positions[:-1], positions[1:], desorb[1:]):
+        if not is_desorbing:
+            continue
+        delta = end - start
+        n_steps = gcd(*(abs(int(d)) for d in delta))
+        step = delta // n_steps
+        for k in range(n_steps):
+            a, b = tuple(start + k * step), tuple(start + (k + 1) * step)
+            covered.add((a, b) if a < b else (b, a))
+    return covered
+
+
+def _random_path(rng, n_points=40):
+    directions = np.array([(1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (-1, -1), (1, -1), (-1, 1)])
+    steps = directions[rng.integers(len(directions), size=n_points - 1)] * rng.integers(1, 4, size=(n_points - 1, 1))
+    # Repeat some steps so strokes have collinear runs to merge
+    steps[1::3] = steps[::3][:len(steps[1::3])]
+    positions = np.concatenate([[(0, 0)], np.cumsum(steps, axis=0)])
+    desorb = rng.random(n_points) < 0.6
+    return positions, desorb
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_optimised_path_desorbs_the_same_lines(seed):
+    positions, desorb = _random_path(np.random.default_rng(seed))
+    desorb[0] = seed % 2 == 0
+
+    new_positions, new_desorb = optimise_path(positions, desorb)
+
+    assert _coverage(new_positions, new_desorb) == _coverage(positions, desorb)
+    assert path_travel(new_positions, new_desorb)[0] == pytest.approx(path_travel(positions, desorb)[0])
+    assert not new_desorb[0]
+    assert np.all(np.any(np.diff(new_positions, axis=0) != 0, axis=1))
+
+
+def test_first_stroke_does_not_repeat_its_start_when_the_first_point_desorbs():
+    positions = np.array([(0, 0), (2, 0), (2, 2)])
+
+    strokes = split_strokes(positions, np.array([True, True, False]))
+
+    assert len(strokes) == 1
+    np.testing.assert_array_equal(strokes[0], positions[:2])
+
+
+def test_merge_collinear_only_drops_points_continuing_the_same_way():
+    stroke = np.array([(0, 0), (1, 1), (2, 2), (2, 4), (2, 3)])
+
+    np.testing.assert_array_equal(merge_collinear(stroke), [(0, 0), (2, 2), (2, 4), (2, 3)])
+
+
+def test_order_strokes_reverses_strokes_ending_nearer_the_tip():
+    strokes = [np.array([(10, 0), (11, 0)]), np.array([(5, 0), (1, 0)])]
+
+    order, reverse = order_strokes(strokes, np.array((0, 0)))
+
+    assert order == [1, 0]
+    assert reverse == [True, False]
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from utils import BoardGeometry, action2ind, board_geometry, ind2mtrx
+
+
+# The hand placed tables of the original 3x3 board at 512
+LEGACY_ACTION_INDS = [[392, 392], [220, 392], [50, 392], [392, 220], [220, 220], [50, 220], [392, 50], [220, 50],
+                      [50, 50]]
+
+
+def legacy_ind2mtrx(action_ind):
+    mtrx_inds = np.array(action_ind) / 256 - 1
+    mtrx_inds[0] = -mtrx_inds[0]
+    return mtrx_inds
+
+
+def test_default_geometry_matches_the_legacy_tables():
+    geometry = board_geometry()
+
+    assert [action2ind(action) for action in range(9)] == LEGACY_ACTION_INDS
+    np.testing.assert_array_equal(geometry.action2ind(np.arange(9)), LEGACY_ACTION_INDS)
+    assert geometry.shape_scale == 1
+    for ind in LEGACY_ACTION_INDS + [[0, 0], [70, 35], [512, 512]]:
+        np.testing.assert_array_equal(ind2mtrx(ind), legacy_ind2mtrx(ind))
+
+
+def test_shape_points_are_placed_like_the_legacy_data_points():
+    geometry = board_geometry()
+    positions = np.array([[0, 0], [70, 70], [0, 70], [35, 10]])
+
+    placed = geometry.shape_mtrx(positions, [0, 4, 8])
+
+    # DataPoint.mtrx_pos of a point offset by its action, scaled by the original piece_scale
+    expected = [[legacy_ind2mtrx(np.array(LEGACY_ACTION_INDS[action]) + pos) * 0.75 for pos in positions]
+                for action in [0, 4, 8]]
+    np.testing.assert_allclose(placed, expected)
+
+
+@pytest.mark.parametrize("action", [-1, 9])
+def test_unknown_actions_are_rejected(action):
+    with pytest.raises(ValueError):
+        action2ind(action)
+
+
+@pytest.mark.parametrize("grid_shape", [(3, 3), (4, 4), (5, 5), (3, 4)])
+def test_larger_boards_fit_their_pieces_in_separate_cells(grid_shape):
+    geometry = BoardGeometry(grid_shape, resolution=512)
+    pitch = 512 / max(grid_shape)
+    piece_size = 70 * geometry.shape_scale
+
+    inds = geometry.action2ind(np.arange(geometry.n_actions))
+
+    assert len({tuple(ind) for ind in inds}) == geometry.n_actions
+    assert np.all(inds >= 0) and np.all(inds + piece_size <= 512)
+    assert piece_size <= pitch
@@ -0,0 +1,50 @@
+import contextlib
+import io
+import json
+
+import numpy as np
+import pytest
+
+from binarisation import ImagePreprocessing
+from hardware.simulated import SimulatedBackend
+from shapes.shapes import DataShape
+from verification import DesorptionVerifier
+
+
+CROSS = {"size": 70, "centre_offset": [0, 0],
+         "all_points": [{"datapoint": [0, 0], "desorb": "False"}, {"datapoint": [70, 70], "desorb": "True"},
+                        {"datapoint": [0, 70], "desorb": "False"}, {"datapoint": [70, 0], "desorb": "True"}]}
+
+
+@pytest.fixture(scope="module")
+def shape_directory(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("shapes")
+    (directory / "cross.json").write_text(json.dumps(CROSS))
+    return f"{directory}/"
+
+
+def _draw_and_verify(shape_directory, desorption_probability, seed, use_reference):
+    backend = SimulatedBackend(time_scale=0.0, seed=seed, desorption_probability=desorption_probability)
+    verifier = DesorptionVerifier()
+    piece = DataShape.on_action("cross", 4, shape_directory=shape_directory)
+    window = verifier.window(piece, backend.resolution)
+
+    reference = backend.get_xy_scan(window=window)[0] if use_reference else None
+    with contextlib.redirect_stdout(io.StringIO()):
+        piece.draw_in_stm(4.2, 1.5e-9, 20e-3, 512, backend=backend)
+    binarised = ImagePreprocessing.binarise_region(backend.get_xy_scan(window=window)[0], reference)
+    return piece, verifier.failed_segments(piece, binarised, window, backend.resolution)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("use_reference", [True, False])
+def test_every_segment_fails_when_nothing_desorbs(shape_directory, seed, use_reference):
+    piece, failed = _draw_and_verify(shape_directory, 0.0, seed, use_reference)
+    np.testing.assert_array_equal(failed, piece.segment_ends())
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("use_reference", [True, False])
+def test_no_segment_fails_when_everything_desorbs(shape_directory, seed, use_reference):
+    _, failed = _draw_and_verify(shape_directory, 1.0, seed, use_reference)
+    assert len(failed) == 0
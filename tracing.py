@@ -0,0 +1,176 @@
+import csv
+import functools
+import json
+import os
+import threading
+from contextlib import nullcontext
+from time import perf_counter_ns
+
+_NULL_SPAN = nullcontext()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "start", "game", "turn")
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.game, self.turn = self.tracer.label()
+        self.start = perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = perf_counter_ns()
+        thread = threading.current_thread()
+        self.tracer.events.append((self.name, self.start, end - self.start, thread.ident, thread.name,
+                                   self.game, self.turn))
+        return False
+
+
+class Tracer:
+    def __init__(self):
+        """Records how long each phase of a turn takes, as spans on the thread that ran them
+
+        Disabled by default, when a span costs one attribute check. Each span is labelled with the game and turn in
+        progress when it started, or on a pipeline worker, when its work was queued (see run_labelled), so several
+        games can be traced at once
+
+        Examples
+        --------
+        >>> tracer.enable()
+        >>> game.play_game()
+        >>> tracer.write_chrome_trace("trace.json")  # Open in chrome://tracing or https://ui.perfetto.dev
+        >>> tracer.write_turn_csv("turns.csv")
+        """
+        self.enabled = False
+        self.events = []
+        self.game = None
+        self.turn = 0
+        self._turns = {}
+        self._n_games = 0
+        self._holds = 0
+        self._enabled_before_hold = False
+        self._local = threading.local()
+        self._origin = perf_counter_ns()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def hold(self):
+        """Enables tracing until every hold is released, e.g. for as long as any of several games is traced"""
+        if self._holds == 0:
+            self._enabled_before_hold = self.enabled
+        self._holds += 1
+        self.enabled = True
+
+    def release(self):
+        """Releases a hold, leaving tracing as it was before the first once they all are"""
+        self._holds -= 1
+        if self._holds == 0:
+            self.enabled = self._enabled_before_hold
+
+    def clear(self, game=None):
+        """Forgets the recorded spans and turn count of `game`, or if None of every game"""
+        if game is None:
+            self.events = []
+            self._turns = {}
+            self.game = None
+            self.turn = 0
+            self._origin = perf_counter_ns()
+            return
+        self.events = [event for event in list(self.events) if event[5] != game]
+        self._turns.pop(game, None)
+
+    def new_game(self):
+        """A new label to tell the spans of one game from those of others, labelling the spans started from here on
+        until its first turn, e.g. while the game is set up, as turn 0"""
+        self._n_games += 1
+        self.game, self.turn = self._n_games, 0
+        return self._n_games
+
+    def next_turn(self, game=None):
+        """Starts the next turn of `game`, which labels the spans started from here on"""
+        self._turns[game] = self._turns.get(game, 0) + 1
+        self.game, self.turn = game, self._turns[game]
+
+    def label(self):
+        """(game, turn) that spans started now, on this thread, are labelled with"""
+        label = getattr(self._local, "label", None)
+        return label if label is not None else (self.game, self.turn)
+
+    def run_labelled(self, label, fn, *args, **kwargs):
+        """Runs `fn`, labelling the spans on this thread meanwhile with `label`, e.g. the (game, turn) a pipeline
+        worker's work was queued in"""
+        previous = getattr(self._local, "label", None)
+        self._local.label = label
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self._local.label = previous
+
+    def span(self, name: str):
+        """Context manager timing the code inside it as the span `name`"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def _events(self, game=None):
+        return [event for event in list(self.events) if game is None or event[5] == game]
+
+    def write_chrome_trace(self, path, game=None):
+        """Writes every span of `game`, or if None of every game, in the Chrome trace event format, with one track
+        per thread"""
+        pid = os.getpid()
+        events = [{"name": name, "cat": "stm", "ph": "X", "ts": (start - self._origin) / 1e3, "dur": duration / 1e3,
+                   "pid": pid, "tid": tid, "args": {"game": span_game, "turn": turn}}
+                  for name, start, duration, tid, _, span_game, turn in self._events(game)]
+        thread_names = {tid: thread_name for _, _, _, tid, thread_name, _, _ in self._events(game)}
+        events += [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": thread_name}}
+                   for tid, thread_name in thread_names.items()]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def turn_summary(self, game=None):
+        """Total time spent in each span per turn of `game`, or if None of every game
+
+        Returns
+        -------
+        summary: dict
+            {(game, turn): {span name: seconds}}
+        """
+        summary = {}
+        for name, _, duration, _, _, span_game, turn in self._events(game):
+            spans = summary.setdefault((span_game, turn), {})
+            spans[name] = spans.get(name, 0.0) + duration / 1e9
+        return summary
+
+    def write_turn_csv(self, path, game=None):
+        """Writes turn_summary as a CSV with one row per turn and one column per span name (Seconds)"""
+        summary = self.turn_summary(game)
+        names = sorted({name for spans in summary.values() for name in spans})
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["game", "turn"] + names)
+            for key in sorted(summary, key=lambda key: (str(key[0]), key[1])):
+                writer.writerow(list(key) + [f"{summary[key].get(name, 0.0):.6f}" for name in names])
+
+
+tracer = Tracer()
+
+
+def traced(name: str):
+    """Decorator timing every call of the function as the span `name` of the module tracer, when it is enabled"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return fn(*args, **kwargs)
+            with _Span(tracer, name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
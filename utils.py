@@ -1,56 +1,160 @@
+from functools import lru_cache
 from typing import Tuple
 
 import numpy as np
-from matplotlib import colors
-from nOmicron.microscope import xy_scanner
 
-rabanimap = colors.ListedColormap(["black", "white", "orange"])
+from hardware.backends import get_backend
+from tracing import traced
 
 
-def get_scan():
-    print("Acquiring scan")
-    return xy_scanner.get_xy_scan("Z", "Forward-Backward", "Up")
+def __getattr__(name):
+    # Made on first use, so headless runs never import matplotlib
+    if name == "rabanimap":
+        from matplotlib import colors
+
+        global rabanimap
+        rabanimap = colors.ListedColormap(["black", "white", "orange"])
+        return rabanimap
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+@traced("get_scan")
+def get_scan(backend=None, window=None):
+    """Acquires a Forward-Backward Z scan, of the full frame or only of `window` (see MicroscopeBackend.get_xy_scan)"""
+    print("Acquiring scan" if window is None else "Acquiring region of interest scan")
+    if backend is None:
+        backend = get_backend()
+    return backend.get_xy_scan("Z", "Forward-Backward", "Up", window=window)
+
+
+def iter_scan_lines(backend=None, window=None):
+    """As get_scan, but yields (line_index, line) as each line is acquired"""
+    print("Streaming scan" if window is None else "Streaming region of interest scan")
+    if backend is None:
+        backend = get_backend()
+    return backend.iter_xy_scan_lines("Z", "Forward-Backward", "Up", window=window)
+
+
+# The 3x3 board at 512, which the shapes were drawn for: their pieces span 70 index co-ords, and were placed by hand
+_LEGACY_GRID_SHAPE = (3, 3)
+_LEGACY_RESOLUTION = 512
+_LEGACY_PIECE_INSET = 35
+_LEGACY_CELL_INDS = (392, 220, 50)
+
+
+class BoardGeometry:
+    def __init__(self, grid_shape=(3, 3), resolution=512, piece_scale=0.75, piece_inset=None, origin=(0, 0),
+                 shape_scale=None):
+        """Coordinate tables mapping board actions and shape points to Matrix co-ords, for any grid size
+
+        Build these with board_geometry, which only builds each one once
+
+        Parameters
+        ----------
+        grid_shape: tuple of int
+            Number of (rows, columns) on the board
+        resolution: int
+            Size of the index co-ord space the board is laid out in
+        piece_scale: float
+            Scale applied to Matrix co-ords, so the board covers this fraction of the scan area
+        piece_inset: float or None
+            Offset from the centre of each cell to where its piece's origin goes, i.e. half the piece size. None
+            (default) for half the size of the scaled shapes, 35 on the 3x3 board at 512
+        origin: tuple of float
+            Matrix co-ords of the centre of the board in the scan area, to lay out several boards side by side.
+            Default (0, 0)
+        shape_scale: float or None
+            Scale of the shapes' points about their origin. None (default) to keep the pieces the same size relative
+            to the cell pitch, resolution / max(grid_shape), as on the 3x3 board at 512, where it is 1
+        """
+        self.grid_shape = grid_shape
+        self.resolution = resolution
+        self.piece_scale = piece_scale
+        self.origin = np.array(origin, dtype=float)
+        self.origin.flags.writeable = False
+
+        n_rows, n_cols = grid_shape
+        pitch = resolution / max(n_rows, n_cols)
+        if shape_scale is None:
+            shape_scale = pitch / (_LEGACY_RESOLUTION / max(_LEGACY_GRID_SHAPE))
+        if piece_inset is None:
+            piece_inset = _LEGACY_PIECE_INSET * shape_scale
+        self.shape_scale = shape_scale
+        self.piece_inset = piece_inset
+
+        self.n_actions = n_rows * n_cols
+        if (tuple(grid_shape), resolution, piece_inset) == (_LEGACY_GRID_SHAPE, _LEGACY_RESOLUTION, _LEGACY_PIECE_INSET):
+            # Keep the hand placed squares exactly, as the formula puts the middle one at 221
+            cell_xs = cell_ys = np.array(_LEGACY_CELL_INDS)
+        else:
+            cell_xs = np.round(resolution - (np.arange(n_cols) + 0.5) * resolution / n_cols - piece_inset)
+            cell_ys = np.round(resolution - (np.arange(n_rows) + 0.5) * resolution / n_rows - piece_inset)
+        rows, cols = np.divmod(np.arange(self.n_actions), n_cols)
+
+        self.action_inds = np.stack([cell_xs[cols], cell_ys[rows]], axis=1).astype(int)
+        self.cell_centre_inds = self.action_inds + piece_inset
+        self.action_mtrx_offsets = self.ind2mtrx(self.action_inds) - self.ind2mtrx(np.zeros(2))
+        for arr in (self.action_inds, self.cell_centre_inds, self.action_mtrx_offsets):
+            arr.flags.writeable = False
+
+    def action2ind(self, actions):
+        """Index co-ords of where the piece for each action goes, in the shape (..., 2)"""
+        actions = np.asarray(actions)
+        if np.any((actions < 0) | (actions >= self.n_actions)):
+            raise ValueError(f"Actions must be between 0 and {self.n_actions - 1}")
+        return self.action_inds[actions]
+
+    def ind2mtrx(self, inds):
+        """Converts index co-ords in the shape (..., 2) to unscaled Matrix co-ords"""
+        # Invert y because of different origin
+        mtrx_inds = np.array(inds, dtype=float) / (self.resolution / 2) - 1
+        mtrx_inds[..., 0] = -mtrx_inds[..., 0]
+        return mtrx_inds
+
+    def to_scan(self, mtrx_positions):
+        """Places unscaled Matrix co-ords of the board in the scan area, scaling them and moving them to the origin"""
+        return np.asarray(mtrx_positions) * self.piece_scale + self.origin
+
+    def scan_shift2ind(self, shift_px, scan_resolution: int):
+        """Converts a shift in (column, row) pixels of a scan with `scan_resolution` points into the same shift in
+        index co-ords of the board"""
+        shift_mtrx = np.asarray(shift_px, dtype=float) * 2 / (scan_resolution - 1)
+        shift_ind = shift_mtrx / self.piece_scale * (self.resolution / 2)
+        shift_ind[..., 0] = -shift_ind[..., 0]
+        return shift_ind
+
+    def shape_mtrx(self, positions, actions):
+        """Scaled Matrix co-ords of shape points (no_points, 2), scaled by shape_scale, placed on each action, in the
+        shape (no_actions, no_points, 2)"""
+        self.action2ind(actions)
+        offsets = self.action_mtrx_offsets[np.atleast_1d(actions)]
+        positions = np.asarray(positions, dtype=float) * self.shape_scale
+        return self.to_scan(self.ind2mtrx(positions)[None, :, :] + offsets[:, None, :])
+
+
+@lru_cache(maxsize=None)
+def board_geometry(grid_shape=(3, 3), resolution=512, piece_scale=0.75, piece_inset=None, origin=(0, 0),
+                   shape_scale=None):
+    """Returns the BoardGeometry for these parameters, building it the first time it is asked for"""
+    return BoardGeometry(tuple(grid_shape), resolution, piece_scale, piece_inset, tuple(origin), shape_scale)
 
 
 def action2ind(action: int):
     """Converts action 0-9 into a tuple of form [0-512, 0-512] showing center of action to draw on"""
-    # assert type(action) is int
-    #
-    # action_arr = np.zeros(9)
-    # action_arr[action] = 1
-    # action_arr = np.flipud(np.fliplr((action_arr.reshape((3, 3)).T)))   # I don't understand why this works, it should do nothing?????
-    # action_ind = np.array(np.argwhere(action_arr)[0])
-
-    if action == 0:
-        action_ind = [392, 392]
-    elif action == 1:
-        action_ind = [220, 392]
-    elif action == 2:
-        action_ind = [50, 392]
-    elif action == 3:
-        action_ind = [392, 220]
-    elif action == 4:
-        action_ind = [220, 220]
-    elif action == 5:
-        action_ind = [50, 220]
-    elif action == 6:
-        action_ind = [392, 50]
-    elif action == 7:
-        action_ind = [220, 50]
-    elif action == 8:
-        action_ind = [50, 50]
-    else:
-        raise ValueError
-
-    return action_ind
+    return board_geometry().action2ind(action).tolist()
 
 
 def ind2mtrx(action_ind: Tuple[int, int]):
-    """Converts action index from [0-512, 0-512] to Matrix co-ord form [-1 - 1, -1 - 1]"""
-    # assert type(action_ind[0]) is int
+    """Converts action index from [0-512, 0-512] to Matrix co-ord form [-1 - 1, -1 - 1]. Also takes arrays of
+    indices in the shape (..., 2)"""
+    return board_geometry().ind2mtrx(action_ind)
+
+
+def mtrx2px(mtrx_pos, resolution: int):
+    """Converts Matrix co-ords [-1 - 1, -1 - 1] to (column, row) pixel co-ords of a scan with `resolution` points"""
+    return (np.asarray(mtrx_pos, dtype=float) + 1) / 2 * (resolution - 1)
 
-    # Invert y because of different origin
-    mtrx_inds = ((np.array(action_ind)) / 256) - 1
-    mtrx_inds[0] = -mtrx_inds[0]
 
-    return mtrx_inds
+def px2mtrx(px_pos, resolution: int):
+    """Converts (column, row) pixel co-ords of a scan with `resolution` points to Matrix co-ords [-1 - 1, -1 - 1]"""
+    return np.asarray(px_pos, dtype=float) / (resolution - 1) * 2 - 1
@@ -0,0 +1,91 @@
+import numpy as np
+
+import utils
+from shapes.shapes import DataShape
+
+
+class DesorptionVerifier:
+    def __init__(self, threshold=0.5, line_width=3, max_shift=2):
+        """Checks that each segment of a drawn piece actually desorbed, by matching the piece against a binarised scan
+
+        The piece is rendered into the mask of pixels each of its desorbing segments should have desorbed. The mask
+        is aligned with the scan at the shift, within `max_shift`, that correlates best, then the fraction of each
+        segment's pixels found desorbed is its coverage
+
+        Parameters
+        ----------
+        threshold: float
+            Segments with less coverage than this are reported as failed. Default 0.5
+        line_width: float
+            Width of desorbed lines (pixels). Default 3
+        max_shift: int
+            Largest misalignment between the path and the scan allowed for, e.g. uncorrected drift (pixels).
+            Default 2
+        """
+        self.threshold = threshold
+        self.line_width = line_width
+        self.max_shift = max_shift
+
+    def window(self, piece: DataShape, resolution: int):
+        """Pixel bounds (col_min, row_min, col_max, row_max) of the piece in a scan with `resolution` points, padded
+        to leave room for the line width and misalignment"""
+        px_points = utils.mtrx2px(piece.mtrx_positions, resolution)
+        padding = self.line_width + self.max_shift + 1
+        lo = np.maximum(np.floor(px_points.min(axis=0)) - padding, 0).astype(int)
+        hi = np.minimum(np.ceil(px_points.max(axis=0)) + padding + 1, resolution).astype(int)
+        return lo[0], lo[1], hi[0], hi[1]
+
+    def expected_segments(self, piece: DataShape, window, resolution: int):
+        """Labels each pixel of the window with the desorbing segment it should belong to
+
+        Returns
+        -------
+        labels: ndarray
+            In the shape (rows, columns) of the window, 0 where nothing should desorb, and i + 1 on segment i of
+            piece.segment_ends()
+        """
+        col_min, row_min, col_max, row_max = window
+        ends = piece.segment_ends()
+        px_points = utils.mtrx2px(piece.mtrx_positions, resolution)
+        starts, stops = px_points[ends - 1], px_points[ends]
+
+        rows, cols = np.mgrid[row_min:row_max, col_min:col_max]
+        pixels = np.stack([cols.ravel(), rows.ravel()], axis=1).astype(float)
+
+        # Distance from every pixel to every segment, in the shape (pixels, segments)
+        segments = stops - starts
+        length_sq = np.maximum(np.sum(segments ** 2, axis=1), 1e-12)
+        t = np.clip(((pixels[:, None, :] - starts[None]) * segments[None]).sum(axis=-1) / length_sq, 0, 1)
+        nearest = starts[None] + t[..., None] * segments[None]
+        distance = np.linalg.norm(pixels[:, None, :] - nearest, axis=-1)
+
+        labels = np.argmin(distance, axis=1) + 1
+        labels[np.min(distance, axis=1) > self.line_width / 2] = 0
+        return labels.reshape(rows.shape)
+
+    def _best_shift(self, expected, binarised):
+        """The shift of `binarised`, within max_shift, that overlaps most with `expected`"""
+        shifts = np.arange(-self.max_shift, self.max_shift + 1)
+        overlaps = np.array([[np.count_nonzero(expected & np.roll(binarised, (-d_row, -d_col), axis=(0, 1)))
+                              for d_col in shifts] for d_row in shifts])
+        d_row, d_col = np.unravel_index(np.argmax(overlaps), overlaps.shape)
+        return shifts[d_row], shifts[d_col]
+
+    def coverage(self, piece: DataShape, binarised_window, window, resolution: int):
+        """Fraction of each desorbing segment's pixels that are desorbed in `binarised_window`, the binarised scan
+        cropped to `window`, in the order of piece.segment_ends()"""
+        labels = self.expected_segments(piece, window, resolution)
+        binarised_window = np.asarray(binarised_window, dtype=bool)
+
+        d_row, d_col = self._best_shift(labels > 0, binarised_window)
+        aligned = np.roll(binarised_window, (-d_row, -d_col), axis=(0, 1))
+
+        n_segments = len(piece.segment_ends())
+        expected_pixels = np.bincount(labels.ravel(), minlength=n_segments + 1)[1:]
+        found_pixels = np.bincount(labels[aligned], minlength=n_segments + 1)[1:]
+        return found_pixels / np.maximum(expected_pixels, 1)
+
+    def failed_segments(self, piece: DataShape, binarised_window, window, resolution: int):
+        """Ends of the segments with less coverage than the threshold, as accepted by piece.with_segments"""
+        coverage = self.coverage(piece, binarised_window, window, resolution)
+        return piece.segment_ends()[coverage < self.threshold]
@@ -0,0 +1,149 @@
+import itertools
+from time import perf_counter
+
+import numpy as np
+from skimage import measure
+
+from hardware.backends import MicroscopeBackend
+
+
+class SurfaceViability:
+    def __init__(self, max_residual=2.0, max_step_density=5e-3, max_defect_density=0.015, edge_sigma=6.0,
+                 defect_sigma=5.0, max_defect_area=9):
+        """Judges from a low resolution preview scan whether an area is flat and clean enough to play on
+
+        Every measure is relative to the point to point noise of the preview, so the same limits hold whatever the
+        Z units or gain
+
+        Parameters
+        ----------
+        max_residual: float
+            Largest RMS deviation from the best fit plane, as a multiple of the noise. Default 2
+        max_step_density: float
+            Largest fraction of pixels on a step edge. Default 5e-3
+        max_defect_density: float
+            Most defects per pixel. Default 0.015
+        edge_sigma: float
+            Height change between neighbouring pixels, as a multiple of their noise, counted as a step edge. Default 6
+        defect_sigma: float
+            Deviation from the plane, as a multiple of the noise, counted as part of a defect. Default 5
+        max_defect_area: int
+            Largest patch counted as a defect, rather than e.g. a terrace (pixels). Default 9
+        """
+        self.max_residual = max_residual
+        self.max_step_density = max_step_density
+        self.max_defect_density = max_defect_density
+        self.edge_sigma = edge_sigma
+        self.defect_sigma = defect_sigma
+        self.max_defect_area = max_defect_area
+
+    @staticmethod
+    def _remove_plane(image):
+        rows, cols = np.indices(image.shape)
+        a = np.stack([rows.ravel(), cols.ravel(), np.ones(image.size)], axis=1)
+        coeffs, *_ = np.linalg.lstsq(a, image.ravel(), rcond=None)
+        return image - (a @ coeffs).reshape(image.shape)
+
+    @staticmethod
+    def _noise(image):
+        """Robust estimate of the per pixel noise, from differences between neighbouring points along each line"""
+        diff = np.diff(image, axis=1)
+        return 1.4826 * np.median(np.abs(diff - np.median(diff))) / np.sqrt(2)
+
+    def score(self, preview):
+        """Scores a preview scan in the shape (lines, points)
+
+        Returns
+        -------
+        score: dict
+            'residual', 'step_density' and 'defect_density' as described in __init__, and 'is_viable' if every one
+            is within its limit
+        """
+        preview = np.asarray(preview, dtype=float)
+        noise = self._noise(preview)
+        residual = self._remove_plane(preview)
+
+        residual_rms = np.sqrt(np.mean(residual ** 2)) / noise
+
+        # Step edges, where the height jumps between neighbouring pixels in either direction
+        edge_threshold = self.edge_sigma * np.sqrt(2) * noise
+        is_edge = np.zeros(preview.shape, dtype=bool)
+        is_edge[:, 1:] |= np.abs(np.diff(preview, axis=1)) > edge_threshold
+        is_edge[1:, :] |= np.abs(np.diff(preview, axis=0)) > edge_threshold
+        step_density = np.count_nonzero(is_edge) / preview.size
+
+        # Defects, small patches standing out from the plane
+        is_outlier = np.abs(residual - np.median(residual)) > self.defect_sigma * noise
+        patch_areas = np.bincount(measure.label(is_outlier).ravel())[1:]
+        defect_density = np.count_nonzero(patch_areas <= self.max_defect_area) / preview.size
+
+        return {"residual": residual_rms, "step_density": step_density, "defect_density": defect_density,
+                "is_viable": bool(residual_rms <= self.max_residual and step_density <= self.max_step_density
+                                  and defect_density <= self.max_defect_density)}
+
+
+class AreaSearch:
+    def __init__(self, scorer: SurfaceViability = None, max_attempts=5, coarse_steps=5, preview_points=64):
+        """Looks for an area to play on with coarse moves, trying at most `max_attempts` areas
+
+        Areas are visited along an outward square spiral that carries on from where the last search ended, so no
+        area is tried twice
+
+        Parameters
+        ----------
+        scorer: SurfaceViability or None
+            Judges each area. None (default) for SurfaceViability()
+        max_attempts: int
+            Most areas previewed per search, bounding the instrument time it can take. Default 5
+        coarse_steps: int
+            Coarse steps between neighbouring areas. Default 5
+        preview_points: int
+            Points per line and lines of each preview scan. Default 64
+        """
+        self.scorer = scorer if scorer is not None else SurfaceViability()
+        self.max_attempts = max_attempts
+        self.coarse_steps = coarse_steps
+        self.preview_points = preview_points
+        self.scores = []
+        self._directions = self._spiral()
+
+    @staticmethod
+    def _spiral():
+        """Yields the direction of each move of an outward square spiral, i.e. legs of 1, 1, 2, 2, 3, 3... moves"""
+        directions = itertools.cycle(("x_plus", "y_plus", "x_minus", "y_minus"))
+        for leg in itertools.count():
+            direction = next(directions)
+            for _ in range(leg // 2 + 1):
+                yield direction
+
+    def find(self, backend: MicroscopeBackend, move_first=False):
+        """Previews areas until a viable one is found or the budget is spent
+
+        Parameters
+        ----------
+        backend: MicroscopeBackend
+            Microscope to search with
+        move_first: bool
+            Move to a new area before the first preview, e.g. as the current one was used by the last game
+
+        Returns
+        -------
+        is_viable: bool
+            If the tip was left over a viable area
+        """
+        start = perf_counter()
+        for attempt in range(self.max_attempts):
+            if attempt > 0 or move_first:
+                backend.retract()
+                backend.coarse_move(next(self._directions), self.coarse_steps)
+                backend.approach()
+
+            score = self.scorer.score(backend.get_preview_scan(self.preview_points))
+            self.scores.append(score)
+            print(f"Area {attempt + 1}/{self.max_attempts}: residual {score['residual']:.2f}, "
+                  f"step density {score['step_density']:.4f}, defect density {score['defect_density']:.4f}")
+            if score["is_viable"]:
+                print(f"Found a viable area in {perf_counter() - start:.1f}s")
+                return True
+
+        return False